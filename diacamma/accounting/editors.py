@@ -41,7 +41,8 @@ from lucterios.framework.tools import FORMTYPE_REFRESH, CLOSE_NO, ActionsManage,
 from lucterios.framework.xferadvance import TITLE_MODIFY
 from lucterios.CORE.parameters import Params
 
-from diacamma.accounting.models import current_system_account, FiscalYear, EntryLineAccount, EntryAccount, get_amount_sum, Third, CostAccounting
+from diacamma.accounting.models import current_system_account, FiscalYear, EntryLineAccount, EntryAccount, get_amount_sum, Third, CostAccounting,\
+    EntryAccountDraft
 from lucterios.framework import signal_and_lock
 from lucterios.contacts.models import CustomField
 
@@ -81,7 +82,7 @@ class AccountThirdEditor(LucteriosEditor):
     def edit(self, xfer):
         old_account = xfer.get_components("code")
         try:
-            chart_accouts = FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=current_system_account().get_third_mask())
+            chart_accouts = FiscalYear.get_current().chartsaccount_set.all().filter(is_third=True)
             xfer.remove_component("code")
             sel_code = XferCompSelect("code")
             sel_code.set_location(old_account.col, old_account.row, old_account.colspan + 1, old_account.rowspan)
@@ -236,8 +237,7 @@ class EntryAccountEditor(LucteriosEditor):
             grid_lines.add_action(xfer.request, ActionsManage.get_action_url('accounting.EntryAccount', 'CostAccounting', xfer), close=CLOSE_NO, unique=SELECT_MULTI)
         xfer.add_component(grid_lines)
         if self.item.has_third:
-            sum_customer = get_amount_sum(self.item.entrylineaccount_set.filter(
-                account__code__regex=current_system_account().get_third_mask()).aggregate(Sum('amount')))
+            sum_customer = get_amount_sum(self.item.entrylineaccount_set.filter(account__is_third=True).aggregate(Sum('amount')))
             if ((sum_customer < 0) and not self.item.has_cash) or ((sum_customer > 0) and self.item.has_cash):
                 lbl = XferCompLabelForm('asset_warning')
                 lbl.set_location(0, last_row + 3, 6)
@@ -261,7 +261,7 @@ class EntryAccountEditor(LucteriosEditor):
         if self.added:
             xfer.add_action(xfer.get_action(TITLE_MODIFY, "images/ok.png"), params={"SAVE": "YES"})
 
-    def _entryline_editor(self, xfer, serial_vals, debit_rest, credit_rest):
+    def _entryline_editor(self, xfer, entry_draft, debit_rest, credit_rest):
         last_row = xfer.get_max_row() + 5
         lbl = XferCompLabelForm('sep1')
         lbl.set_location(0, last_row, 6)
@@ -285,7 +285,7 @@ class EntryAccountEditor(LucteriosEditor):
         xfer.remove_component('entrylineaccount')
         new_grid_lines = XferCompGrid('entrylineaccount_serial')
         new_grid_lines.description = grid_lines.description
-        new_grid_lines.set_model(self.item.get_entrylineaccounts(serial_vals), EntryLineAccount.get_other_fields(), xfer)
+        new_grid_lines.set_model(entry_draft.get_entrylineaccounts(), EntryLineAccount.get_other_fields(), xfer)
         new_grid_lines.set_location(grid_lines.col, grid_lines.row, grid_lines.colspan, grid_lines.rowspan)
         new_grid_lines.add_action_notified(xfer, EntryLineAccount)
         xfer.add_component(new_grid_lines)
@@ -304,15 +304,14 @@ class EntryAccountEditor(LucteriosEditor):
 
     def edit(self, xfer):
         self._remove_lastyear_notbuilding(xfer)
-        serial_vals = xfer.getparam('serial_entry')
-        if serial_vals is None:
-            xfer.params['serial_entry'] = self.item.get_serial()
-            serial_vals = xfer.getparam('serial_entry')
-        xfer.no_change, xfer.debit_rest, xfer.credit_rest = self.item.serial_control(serial_vals)
         if self.item.id:
-            xfer.nb_lines = self._entryline_editor(xfer, serial_vals, xfer.debit_rest, xfer.credit_rest)
+            entry_draft = EntryAccountDraft.get_draft(self.item, xfer)
+            xfer.params['entrydraft'] = entry_draft.id
+            xfer.no_change, xfer.debit_rest, xfer.credit_rest = not entry_draft.changed, entry_draft.debit_rest, entry_draft.credit_rest
+            xfer.nb_lines = self._entryline_editor(xfer, entry_draft, xfer.debit_rest, xfer.credit_rest)
             self.added = True
         else:
+            xfer.no_change, xfer.debit_rest, xfer.credit_rest = False, 0.0, 0.0
             self._add_cost_savebtn(xfer)
             xfer.nb_lines = 0
         xfer.added = self.added
@@ -477,16 +476,16 @@ class BudgetEditor(EntryLineAccountEditor):
     def edit(self, xfer):
         self.edit_creditdebit_for_line(xfer, 1, xfer.get_max_row() + 1)
         if xfer.field_id == 'budget_revenue':
-            code_mask = current_system_account().get_revenue_mask() + "|" + current_system_account().get_annexe_mask()
+            code_filter = Q(is_revenue=True) | Q(is_annexe=True)
         elif xfer.field_id == 'budget_expense':
-            code_mask = current_system_account().get_expence_mask() + "|" + current_system_account().get_annexe_mask()
+            code_filter = Q(is_expense=True) | Q(is_annexe=True)
         else:
-            code_mask = current_system_account().get_revenue_mask() + "|" + current_system_account().get_expence_mask() + "|" + current_system_account().get_annexe_mask()
+            code_filter = Q(is_revenue=True) | Q(is_expense=True) | Q(is_annexe=True)
         old_account = xfer.get_components("code")
         xfer.remove_component("code")
         sel_code = XferCompSelect("code")
         sel_code.set_location(old_account.col, old_account.row, old_account.colspan + 1, old_account.rowspan)
-        for item in FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=code_mask).order_by('code'):
+        for item in FiscalYear.get_current().chartsaccount_set.all().filter(code_filter).order_by('code'):
             sel_code.select_list.append((item.code, six.text_type(item)))
         sel_code.set_value(self.item.code)
         xfer.add_component(sel_code)
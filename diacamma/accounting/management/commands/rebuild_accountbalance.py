@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+'''
+Rebuild balances of accounts
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from diacamma.accounting.models import ChartsAccountBalance, FiscalYear
+
+
+class Command(BaseCommand):
+    help = 'Rebuild balances of accounts from entry lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, default=None, help='fiscal year id (all years if not set)')
+
+    def handle(self, *args, **options):
+        year = None
+        if options['year'] is not None:
+            year = FiscalYear.objects.get(id=options['year'])
+        nb_balance = ChartsAccountBalance.rebuild(year=year)
+        self.stdout.write('%d balances of account rebuilt' % nb_balance)
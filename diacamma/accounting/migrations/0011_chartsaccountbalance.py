@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, When, Value
+from django.db.models.aggregates import Sum
+import django.db.models.deletion
+
+
+def fill_balances(apps, schema_editor):
+    chartsaccount_mdl = apps.get_model("accounting", "ChartsAccount")
+    entrylineaccount_mdl = apps.get_model("accounting", "EntryLineAccount")
+    balance_mdl = apps.get_model("accounting", "ChartsAccountBalance")
+    sums = {}
+    for value in entrylineaccount_mdl.objects.values('account_id').annotate(sum_total=Sum('amount'),
+                                                                            sum_validated=Sum(Case(When(entry__close=True, then='amount'), default=Value(0.0), output_field=models.FloatField())),
+                                                                            sum_last_year=Sum(Case(When(entry__journal_id=1, then='amount'), default=Value(0.0), output_field=models.FloatField()))).order_by():
+        sums[value['account_id']] = value
+    new_balances = []
+    for account_id in chartsaccount_mdl.objects.values_list('id', flat=True):
+        value = sums.get(account_id, {})
+        new_balances.append(balance_mdl(account_id=account_id, total=value.get('sum_total') or 0.0,
+                                        validated=value.get('sum_validated') or 0.0, last_year=value.get('sum_last_year') or 0.0))
+    balance_mdl.objects.bulk_create(new_balances)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0010_entryline_costaccouting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartsAccountBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.FloatField(default=0.0, verbose_name='total current')),
+                ('validated', models.FloatField(default=0.0, verbose_name='total validated')),
+                ('last_year', models.FloatField(default=0.0, verbose_name='total of last year')),
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='accounting.ChartsAccount', verbose_name='account')),
+            ],
+            options={
+                'verbose_name': 'balance of account',
+                'verbose_name_plural': 'balances of account',
+                'default_permissions': [],
+            },
+        ),
+        migrations.RunPython(fill_balances),
+    ]
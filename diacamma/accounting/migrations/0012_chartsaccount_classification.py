@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+
+# masks of the accounting systems frozen at the time of this migration:
+# later changes are applied by ChartsAccount.refresh_classification() when the accounting system is set
+CLASSIFICATION_MASKS = {
+    'diacamma.accounting.system.french.FrenchSystemAcounting': {
+        'is_cash': r'^5[0-9][0-9][0-9a-zA-Z]*$',
+        'is_third': r'^4[0-9][0-9][0-9a-zA-Z]*$',
+        'is_customer': r'^41[0-9][0-9a-zA-Z]*$',
+        'is_provider': r'^40[0-9][0-9a-zA-Z]*$',
+        'is_revenue': r'^7[0-9][0-9][0-9a-zA-Z]*$',
+        'is_expense': r'^6[0-9][0-9][0-9a-zA-Z]*$',
+        'is_annexe': r'^8[0-9][0-9][0-9a-zA-Z]*$',
+    },
+    'diacamma.accounting.system.belgium.BelgiumSystemAcounting': {
+        'is_cash': r'^5[0-9][0-9][0-9a-zA-Z]*$',
+        'is_third': r'^44[0-9][0-9a-zA-Z]*$|^40[0-9][0-9a-zA-Z]*$|^455[0-9][0-9a-zA-Z]*$|^47[0-9][0-9a-zA-Z]*|410[0-9a-zA-Z]*$',
+        'is_customer': r'^40[0-9][0-9a-zA-Z]*$',
+        'is_provider': r'^44[0-9][0-9a-zA-Z]*$',
+        'is_revenue': r'^7[0-9][0-9][0-9a-zA-Z]*$',
+        'is_expense': r'^6[0-9][0-9][0-9a-zA-Z]*$',
+        'is_annexe': r'X',
+    },
+}
+
+
+def fill_classification(apps, schema_editor):
+    parameter_mdl = apps.get_model("CORE", "Parameter")
+    chartsaccount_mdl = apps.get_model("accounting", "ChartsAccount")
+    system_name = parameter_mdl.objects.filter(name='accounting-system').values_list('value', flat=True).first()
+    if system_name not in CLASSIFICATION_MASKS:
+        return
+    account_codes = list(chartsaccount_mdl.objects.values_list('id', 'code'))
+    for field_name, code_mask in CLASSIFICATION_MASKS[system_name].items():
+        code_regex = re.compile(code_mask)
+        match_ids = [account_id for account_id, account_code in account_codes if code_regex.search(account_code) is not None]
+        chartsaccount_mdl.objects.filter(id__in=match_ids).update(**{field_name: True})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CORE', '0001_initial'),
+        ('accounting', '0011_chartsaccountbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_cash',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='is cash'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_third',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='is third'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_customer',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='is customer'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_provider',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='is provider'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_revenue',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='is revenue'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_expense',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='is expense'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_annexe',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='is annexe'),
+        ),
+        migrations.RunPython(fill_classification),
+    ]
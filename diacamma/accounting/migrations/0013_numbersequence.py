@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0012_chartsaccount_classification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=100, verbose_name='model')),
+                ('sub_type', models.IntegerField(default=0, verbose_name='type')),
+                ('last_num', models.IntegerField(default=0, verbose_name='last number')),
+                ('year', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounting.FiscalYear', verbose_name='fiscal year')),
+            ],
+            options={
+                'verbose_name': 'number sequence',
+                'verbose_name_plural': 'number sequences',
+                'default_permissions': [],
+                'unique_together': {('model_name', 'year', 'sub_type')},
+            },
+        ),
+    ]
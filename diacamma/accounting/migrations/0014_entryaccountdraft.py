@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0013_numbersequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryAccountDraft',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, max_length=40, verbose_name='session')),
+                ('last_modified', models.DateTimeField(auto_now=True, verbose_name='last modified')),
+                ('debit', models.FloatField(default=0.0, verbose_name='debit')),
+                ('credit', models.FloatField(default=0.0, verbose_name='credit')),
+                ('changed', models.BooleanField(default=False, verbose_name='changed')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounting.EntryAccount', verbose_name='entry')),
+            ],
+            options={
+                'verbose_name': 'draft of entry',
+                'verbose_name_plural': 'drafts of entry',
+                'default_permissions': [],
+                'unique_together': {('entry', 'session_key')},
+            },
+        ),
+        migrations.CreateModel(
+            name='EntryLineDraft',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_id', models.IntegerField(verbose_name='line')),
+                ('serial', models.TextField(verbose_name='serial')),
+                ('debit', models.FloatField(default=0.0, verbose_name='debit')),
+                ('credit', models.FloatField(default=0.0, verbose_name='credit')),
+                ('draft', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounting.EntryAccountDraft', verbose_name='draft of entry')),
+            ],
+            options={
+                'verbose_name': 'draft of entry line',
+                'verbose_name_plural': 'drafts of entry line',
+                'ordering': ['id'],
+                'default_permissions': [],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.aggregates import Count
+
+
+def convert_letter(nb_link):
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    res = ''
+    while nb_link >= 26:
+        div, mod = divmod(nb_link, 26)
+        res = letters[mod] + res
+        nb_link = int(div) - 1
+    return letters[nb_link] + res
+
+
+def fill_letters(apps, schema_editor):
+    fiscalyear_mdl = apps.get_model("accounting", "FiscalYear")
+    entryaccount_mdl = apps.get_model("accounting", "EntryAccount")
+    accountlink_mdl = apps.get_model("accounting", "AccountLink")
+    for nb_year, year in enumerate(fiscalyear_mdl.objects.order_by('id')):
+        year.letter = convert_letter(nb_year)
+        year.save(update_fields=['letter'])
+    year_id = None
+    nb_link = 0
+    for link_value in entryaccount_mdl.objects.filter(link__isnull=False).values('year_id', 'link_id').annotate(nb_entry=Count('id')).order_by('year_id', 'link_id'):
+        if year_id != link_value['year_id']:
+            year_id = link_value['year_id']
+            nb_link = 0
+        accountlink_mdl.objects.filter(id=link_value['link_id']).update(letter=convert_letter(nb_link))
+        nb_link += link_value['nb_entry']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0014_entryaccountdraft'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountlink',
+            name='letter',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10, verbose_name='letter'),
+        ),
+        migrations.AddField(
+            model_name='fiscalyear',
+            name='letter',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10, verbose_name='letter'),
+        ),
+        migrations.RunPython(fill_letters),
+    ]
@@ -24,31 +24,37 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 
 from datetime import date, timedelta
+from os import unlink
 from os.path import join, isfile
-from re import match
+from itertools import groupby, combinations
+from collections import deque
+import re
+import json
 from csv import DictReader
 from _csv import QUOTE_NONE
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Case, When, Value, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.db.models.query import QuerySet
-from django.db.models.aggregates import Sum, Max
-from django.template import engines
+from django.db.models.aggregates import Sum, Max, Min, Count
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import ugettext_lazy as _
-from django.utils import six
-from django.db.models.signals import pre_save
+from django.utils import six, timezone
+from django.db.models.signals import pre_save, post_delete
 from django_fsm import FSMIntegerField, transition
+from lxml.etree import xmlfile
 
 from lucterios.framework.models import LucteriosModel, get_value_converted, get_value_if_choices
 from lucterios.framework.error import LucteriosException, IMPORTANT, GRAVE
-from lucterios.framework.filetools import read_file, xml_validator, save_file, get_user_path
+from lucterios.framework.filetools import get_user_path
 from lucterios.framework.signal_and_lock import RecordLocker, Signal
 from lucterios.CORE.models import Parameter
 from lucterios.CORE.parameters import Params
 from lucterios.contacts.models import AbstractContact, CustomField, CustomizeObject
 
-from diacamma.accounting.tools import get_amount_sum, format_devise, current_system_account, currency_round, correct_accounting_code
+from diacamma.accounting.tools import get_amount_sum, format_devise, current_system_account, currency_round, correct_accounting_code,\
+    get_xml_element, xml_file_validator
 
 
 class ThirdCustomField(LucteriosModel):
@@ -109,17 +115,42 @@ class Third(LucteriosModel, CustomizeObject):
         result.extend(["status", "accountthird_set.code"])
         return result
 
-    def get_total(self, current_date=None, strict=True):
-        current_filter = Q(third=self)
+    @classmethod
+    def _get_total_filter(cls, current_date=None, strict=True):
+        current_filter = Q(third__isnull=False)
         if current_date is not None:
             if strict:
                 current_filter &= Q(entry__date_value__lte=current_date)
             else:
                 current_filter &= Q(entry__date_value__lt=current_date)
-        active_sum = get_amount_sum(EntryLineAccount.objects.filter(current_filter & Q(account__type_of_account=0)).aggregate(Sum('amount')))
-        passive_sum = get_amount_sum(EntryLineAccount.objects.filter(current_filter & Q(account__type_of_account=1)).aggregate(Sum('amount')))
-        other_sum = get_amount_sum(EntryLineAccount.objects.filter(current_filter & Q(account__type_of_account__gt=1)).aggregate(Sum('amount')))
-        return passive_sum - active_sum + other_sum
+        return current_filter
+
+    @classmethod
+    def _get_total_sum(cls):
+        return Sum(Case(When(account__type_of_account=0, then=-1 * F('amount')),
+                        When(account__type_of_account__gte=1, then=F('amount')),
+                        default=Value(0.0), output_field=models.FloatField()))
+
+    @classmethod
+    def annotate_total(cls, queryset, current_date=None, strict=True):
+        third_lines = EntryLineAccount.objects.filter(cls._get_total_filter(current_date, strict) & Q(third=OuterRef('pk')))
+        third_lines = third_lines.values('third').annotate(third_total=cls._get_total_sum()).values('third_total').order_by()
+        return queryset.annotate(total_amount=Coalesce(Subquery(third_lines, output_field=models.FloatField()), Value(0.0)))
+
+    @classmethod
+    def get_totals(cls, thirds=None, current_date=None, strict=True):
+        current_filter = cls._get_total_filter(current_date, strict)
+        if thirds is not None:
+            current_filter &= Q(third__in=thirds)
+        totals = {}
+        for value in EntryLineAccount.objects.filter(current_filter).values('third_id').annotate(third_total=cls._get_total_sum()).order_by():
+            totals[value['third_id']] = value['third_total'] or 0.0
+        return totals
+
+    def get_total(self, current_date=None, strict=True):
+        if (current_date is None) and hasattr(self, 'total_amount'):
+            return self.total_amount
+        return self.get_totals([self.id], current_date, strict).get(self.id, 0.0)
 
     @property
     def total(self):
@@ -218,6 +249,16 @@ class FiscalYear(LucteriosModel):
     is_actif = models.BooleanField(verbose_name=_('actif'), default=False, db_index=True)
     last_fiscalyear = models.ForeignKey('FiscalYear', verbose_name=_(
         'last fiscal year'), related_name='next_fiscalyear', null=True, on_delete=models.SET_NULL)
+    letter = models.CharField(_('letter'), max_length=10, blank=True, default='', editable=False)
+    total_snapshot = models.TextField(_('totals'), blank=True, default='', editable=False)
+
+    period_filtered = False
+
+    def set_period(self, begin, end):
+        if (begin != self.begin) or (end != self.end):
+            self.begin = begin
+            self.end = end
+            self.period_filtered = True
 
     def init_dates(self):
         fiscal_years = FiscalYear.objects.order_by('end')
@@ -261,38 +302,57 @@ class FiscalYear(LucteriosModel):
     def get_edit_fields(cls):
         return ['status', 'begin', 'end']
 
+    def _compute_total_values(self):
+        if self.period_filtered:
+            total_values = EntryLineAccount.objects.filter(account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(
+                revenue=Sum(Case(When(account__type_of_account=3, then='amount'), default=Value(0.0), output_field=models.FloatField())),
+                expense=Sum(Case(When(account__type_of_account=4, then='amount'), default=Value(0.0), output_field=models.FloatField())),
+                cash=Sum(Case(When(account__is_cash=True, then='amount'), default=Value(0.0), output_field=models.FloatField())),
+                cash_close=Sum(Case(When(account__is_cash=True, entry__close=True, then='amount'), default=Value(0.0), output_field=models.FloatField())))
+        else:
+            total_values = ChartsAccountBalance.objects.filter(account__year=self).aggregate(
+                revenue=Sum(Case(When(account__type_of_account=3, then='total'), default=Value(0.0), output_field=models.FloatField())),
+                expense=Sum(Case(When(account__type_of_account=4, then='total'), default=Value(0.0), output_field=models.FloatField())),
+                cash=Sum(Case(When(account__is_cash=True, then='total'), default=Value(0.0), output_field=models.FloatField())),
+                cash_close=Sum(Case(When(account__is_cash=True, then='validated'), default=Value(0.0), output_field=models.FloatField())))
+        return dict([(key, value or 0.0) for key, value in total_values.items()])
+
+    def get_total_values(self):
+        if self.period_filtered:
+            return self._compute_total_values()
+        if (self.status == 2) and (self.total_snapshot != ''):
+            return json.loads(self.total_snapshot)
+        total_values = self._compute_total_values()
+        if self.status == 2:
+            self.total_snapshot = json.dumps(total_values)
+            FiscalYear.objects.filter(id=self.id).update(total_snapshot=self.total_snapshot)
+        return total_values
+
     @property
     def total_revenue(self):
-        return get_amount_sum(EntryLineAccount.objects.filter(account__type_of_account=3, account__year=self,
-                                                              entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_total_values()['revenue']
 
     @property
     def total_expense(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(account__type_of_account=4, account__year=self,
-                                                              entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_total_values()['expense']
 
     @property
     def total_cash(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(account__code__regex=current_system_account().get_cash_mask(),
-                                                              account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_total_values()['cash']
 
     @property
     def total_cash_close(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(entry__close=True, account__code__regex=current_system_account().get_cash_mask(),
-                                                              account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_total_values()['cash_close']
 
     @property
     def total_result_text(self):
+        total_values = self.get_total_values()
         value = {}
-        value['revenue'] = format_devise(self.total_revenue, 5)
-        value['expense'] = format_devise(self.total_expense, 5)
-        value['result'] = format_devise(
-            self.total_revenue - self.total_expense, 5)
-        value['cash'] = format_devise(self.total_cash, 5)
-        value['closed'] = format_devise(self.total_cash_close, 5)
+        value['revenue'] = format_devise(total_values['revenue'], 5)
+        value['expense'] = format_devise(total_values['expense'], 5)
+        value['result'] = format_devise(total_values['revenue'] - total_values['expense'], 5)
+        value['cash'] = format_devise(total_values['cash'], 5)
+        value['closed'] = format_devise(total_values['cash_close'], 5)
         res_text = _(
             '{[b]}Revenue:{[/b]} %(revenue)s - {[b]}Expense:{[/b]} %(expense)s = {[b]}Result:{[/b]} %(result)s{[br/]}{[b]}Cash:{[/b]} %(cash)s - {[b]}Closed:{[/b]} %(closed)s')
         return res_text % value
@@ -308,20 +368,15 @@ class FiscalYear(LucteriosModel):
                 IMPORTANT, _("This fiscal year has not a last fiscal year!"))
         if self.status == 2:
             raise LucteriosException(IMPORTANT, _('Fiscal year finished!'))
-        for last_charts_account in self.last_fiscalyear.chartsaccount_set.all():
-            try:
-                self.chartsaccount_set.get(
-                    code=correct_accounting_code(last_charts_account.code))
-            except ObjectDoesNotExist:
-                ChartsAccount.objects.create(year=self, code=last_charts_account.code, name=last_charts_account.name,
-                                             type_of_account=last_charts_account.type_of_account)
+        ChartsAccount.create_accounts(self, self.last_fiscalyear.chartsaccount_set.values_list('code', 'name', 'type_of_account'))
 
     def run_report_lastyear(self, import_result):
         if self.last_fiscalyear is None:
             raise LucteriosException(IMPORTANT, _("This fiscal year has not a last fiscal year!"))
         if self.status != 0:
             raise LucteriosException(IMPORTANT, _("This fiscal year is not 'in building'!"))
-        current_system_account().import_lastyear(self, import_result)
+        with transaction.atomic():
+            current_system_account().import_lastyear(self, import_result)
 
     def getorcreate_chartaccount(self, code, name=None):
         code = correct_accounting_code(code)
@@ -334,24 +389,33 @@ class FiscalYear(LucteriosModel):
                 name = descript
             return ChartsAccount.objects.create(year=self, code=code, name=name, type_of_account=typeaccount)
 
+    def get_chartaccount_map(self, accounts):
+        chart_map = dict([(chart.code, chart) for chart in self.chartsaccount_set.filter(code__in=[correct_accounting_code(code) for code, _name in accounts])])
+        for code, name in accounts:
+            if correct_accounting_code(code) not in chart_map:
+                new_chart = self.getorcreate_chartaccount(code, name)
+                chart_map[new_chart.code] = new_chart
+        return dict([(code, chart_map[correct_accounting_code(code)]) for code, _name in accounts])
+
     def move_entry_noclose(self):
         if self.status == 1:
-            next_ficalyear = None
-            for entry_noclose in EntryAccount.objects.filter(close=False, entrylineaccount__account__year=self).distinct():
-                if next_ficalyear is None:
-                    try:
-                        next_ficalyear = FiscalYear.objects.get(
-                            last_fiscalyear=self)
-                    except BaseException:
-                        raise LucteriosException(IMPORTANT, _(
-                            "This fiscal year has entries not closed and not next fiscal year!"))
-                for entryline in entry_noclose.entrylineaccount_set.all():
-                    entryline.account = next_ficalyear.getorcreate_chartaccount(
-                        entryline.account.code, entryline.account.name)
-                    entryline.save()
-                entry_noclose.year = next_ficalyear
-                entry_noclose.date_value = next_ficalyear.begin
-                entry_noclose.save()
+            entry_ids = list(EntryAccount.objects.filter(close=False, entrylineaccount__account__year=self).distinct().values_list('id', flat=True))
+            if len(entry_ids) == 0:
+                return
+            next_ficalyear = FiscalYear.objects.filter(last_fiscalyear=self).first()
+            if next_ficalyear is None:
+                raise LucteriosException(IMPORTANT, _("This fiscal year has entries not closed and not next fiscal year!"))
+            entrylines = list(EntryLineAccount.objects.filter(entry_id__in=entry_ids).select_related('account'))
+            chart_map = next_ficalyear.get_chartaccount_map(set([(entryline.account.code, entryline.account.name) for entryline in entrylines]))
+            account_ids = set()
+            for entryline in entrylines:
+                account_ids.add(entryline.account_id)
+                entryline.account = chart_map[entryline.account.code]
+                account_ids.add(entryline.account_id)
+            EntryLineAccount.objects.bulk_update(entrylines, ['account'], batch_size=1000)
+            EntryAccount.objects.filter(id__in=entry_ids, costaccounting__year__isnull=False).exclude(costaccounting__year=next_ficalyear).update(costaccounting=None)
+            EntryAccount.objects.filter(id__in=entry_ids).update(year=next_ficalyear, date_value=next_ficalyear.begin)
+            ChartsAccountBalance.refresh(account_ids)
 
     @classmethod
     def get_current(cls, select_year=None):
@@ -382,28 +446,76 @@ class FiscalYear(LucteriosModel):
 
         return account_list, current_account
 
-    def get_context(self):
-        entries_by_journal = []
-        for journal in Journal.objects.all():
-            entries = self.entryaccount_set.filter(journal=journal, close=True)
-            if len(entries) > 0:
-                entries_by_journal.append((journal, entries))
-        if len(entries_by_journal) == 0:
-            raise LucteriosException(IMPORTANT, _('This fiscal year has no validated entrie !'))
-        return {'year': self, 'entries_by_journal': entries_by_journal}
+    def _write_xml_entry(self, xml_file, entry, lines, letters):
+        with xml_file.element('ecriture'):
+            xml_file.write(get_xml_element('EcritureNum', entry.num))
+            xml_file.write(get_xml_element('EcritureDate', entry.date_value.isoformat()))
+            xml_file.write(get_xml_element('EcritureLib', entry.designation))
+            xml_file.write(get_xml_element('PieceRef', ''))
+            xml_file.write(get_xml_element('PieceDate', entry.date_value.isoformat()))
+            if entry.link_id is not None:
+                xml_file.write(get_xml_element('EcritureLet', letters.get(entry.link_id, '')))
+            xml_file.write(get_xml_element('ValidDate', entry.date_entry.isoformat()))
+            xml_file.write(get_xml_element('DateRglt', entry.date_entry.isoformat()))
+            xml_file.write(get_xml_element('ModeRglt', ''))
+            for line in lines:
+                with xml_file.element('ligne'):
+                    xml_file.write(get_xml_element('CompteNum', line.account.code))
+                    xml_file.write(get_xml_element('CompteLib', line.account.name))
+                    if line.third_id is not None:
+                        xml_file.write(get_xml_element('CompAuxLib', line.third))
+                    xml_file.write(get_xml_element('Debit', line.get_debit()))
+                    xml_file.write(get_xml_element('Credit', line.get_credit()))
+            if len(lines) == 1:
+                with xml_file.element('ligne'):
+                    xml_file.write(get_xml_element('CompteLib', ''))
+                    xml_file.write(get_xml_element('Debit', 0))
+
+    def _get_export_entries(self):
+        entry_lines = EntryLineAccount.objects.filter(entry__year=self, entry__close=True)
+        entry_lines = entry_lines.select_related('entry', 'entry__journal', 'account', 'third', 'third__contact', 'third__contact__legalentity', 'third__contact__individual')
+        entry_lines = entry_lines.order_by('entry__journal_id', 'entry__date_value', 'entry__id', 'account__code', 'third_id')
+        last_entry = None
+        lines = []
+        for line in entry_lines.iterator(chunk_size=2000):
+            if (last_entry is not None) and (last_entry.id != line.entry_id):
+                yield last_entry, lines
+                lines = []
+            last_entry = line.entry
+            lines.append(line)
+        if last_entry is not None:
+            yield last_entry, lines
+
+    def write_xml_export(self, file_name):
+        letters = AccountLink.get_letters(self)
+        nb_entry = 0
+        with xmlfile(file_name, encoding='utf-8') as xml_file:
+            with xml_file.element('comptabilite'):
+                with xml_file.element('exercice'):
+                    xml_file.write(get_xml_element('DateCloture', self.end.isoformat()))
+                    for _journal_id, journal_entries in groupby(self._get_export_entries(), key=lambda entry_lines: entry_lines[0].journal_id):
+                        with xml_file.element('journal'):
+                            with_journal_name = True
+                            for entry, lines in journal_entries:
+                                if with_journal_name:
+                                    xml_file.write(get_xml_element('JournalLib', entry.journal.name))
+                                    with_journal_name = False
+                                self._write_xml_entry(xml_file, entry, lines, letters)
+                                nb_entry += 1
+        return nb_entry
 
     def get_xml_export(self):
         file_name = "fiscalyear_export_%s.xml" % six.text_type(self.id)
-        xmlfiles = current_system_account().get_export_xmlfiles()
-        if xmlfiles is None:
+        xsd_file = current_system_account().get_export_xsdfile()
+        if xsd_file is None:
             raise LucteriosException(IMPORTANT, _('No export for this accounting system!'))
-        xml_file, xsd_file = xmlfiles
-        template = engines['django'].from_string(read_file(xml_file).decode('utf-8'))
-        fiscal_year_xml = six.text_type(template.render(self.get_context()))
-        res_val = xml_validator(fiscal_year_xml, xsd_file)
+        xml_file = get_user_path("accounting", file_name)
+        if self.write_xml_export(xml_file) == 0:
+            unlink(xml_file)
+            raise LucteriosException(IMPORTANT, _('This fiscal year has no validated entrie !'))
+        res_val = xml_file_validator(xml_file, xsd_file)
         if res_val is not None:
             raise LucteriosException(GRAVE, res_val)
-        save_file(get_user_path("accounting", file_name), fiscal_year_xml)
         return join("accounting", file_name)
 
     def get_identify(self):
@@ -417,21 +529,8 @@ class FiscalYear(LucteriosModel):
             'status'))
         return _("Fiscal year from %(begin)s to %(end)s [%(status)s]") % {'begin': get_value_converted(self.begin), 'end': get_value_converted(self.end), 'status': status}
 
-    @property
-    def letter(self):
-        nb_year = FiscalYear.objects.filter(id__lt=self.id).count()
-        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-        res = ''
-        while nb_year >= 26:
-            div, mod = divmod(nb_year, 26)
-            res = letters[mod] + res
-            nb_year = int(div) - 1
-        return letters[nb_year] + res
-
     def _check_annexe(self):
-        total = 0
-        for chart in self.chartsaccount_set.filter(type_of_account=5):
-            total += chart.get_current_total()
+        total = self.chartsaccount_set.filter(type_of_account=5).aggregate(total=Sum('balance__total'))['total'] or 0.0
         if abs(total) > 0.0001:
             raise LucteriosException(IMPORTANT, _("The sum of annexe account must be null!"))
 
@@ -446,13 +545,24 @@ class FiscalYear(LucteriosModel):
         return nb_entry_noclose
 
     def closed(self):
-        for cost in CostAccounting.objects.filter(year=self):
-            cost.close()
-        self._check_annexe()
-        self.move_entry_noclose()
-        current_system_account().finalize_year(self)
-        self.status = 2
-        self.save()
+        with transaction.atomic():
+            for cost in CostAccounting.objects.filter(year=self):
+                cost.close()
+            self._check_annexe()
+            self.move_entry_noclose()
+            current_system_account().finalize_year(self)
+            self.status = 2
+            self.total_snapshot = json.dumps(self._compute_total_values())
+            self.save()
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if self.letter == '':
+            if self.id is None:
+                nb_year = FiscalYear.objects.count()
+            else:
+                nb_year = FiscalYear.objects.filter(id__lt=self.id).count()
+            self.letter = AccountLink.convert_letter(nb_year)
+        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 
     class Meta(object):
         verbose_name = _('fiscal year')
@@ -487,11 +597,25 @@ class CostAccounting(LucteriosModel):
     def get_edit_fields(cls):
         return ['name', 'description', 'year', 'last_costaccounting']
 
+    @classmethod
+    def annotate_totals(cls, queryset=None, date_begin=None, date_end=None):
+        if queryset is None:
+            queryset = cls.objects.all()
+        line_filter = Q()
+        if date_begin is not None:
+            line_filter &= Q(entrylineaccount__entry__date_value__gte=date_begin)
+        if date_end is not None:
+            line_filter &= Q(entrylineaccount__entry__date_value__lte=date_end)
+        return queryset.annotate(sum_revenue=Sum('entrylineaccount__amount', filter=line_filter & Q(entrylineaccount__account__type_of_account=3)),
+                                 sum_expense=Sum('entrylineaccount__amount', filter=line_filter & Q(entrylineaccount__account__type_of_account=4)))
+
     @property
     def total_revenue(self):
         return format_devise(self.get_total_revenue(), 5)
 
     def get_total_revenue(self):
+        if hasattr(self, 'sum_revenue'):
+            return self.sum_revenue or 0.0
         return get_amount_sum(EntryLineAccount.objects.filter(account__type_of_account=3, costaccounting=self).aggregate(Sum('amount')))
 
     @property
@@ -499,6 +623,8 @@ class CostAccounting(LucteriosModel):
         return format_devise(self.get_total_expense(), 5)
 
     def get_total_expense(self):
+        if hasattr(self, 'sum_expense'):
+            return self.sum_expense or 0.0
         return get_amount_sum(EntryLineAccount.objects.filter(account__type_of_account=4, costaccounting=self).aggregate(Sum('amount')))
 
     @property
@@ -555,6 +681,41 @@ class ChartsAccount(LucteriosModel):
     year = models.ForeignKey('FiscalYear', verbose_name=_('fiscal year'), null=False, on_delete=models.CASCADE, db_index=True)
     type_of_account = models.IntegerField(verbose_name=_('type of account'),
                                           choices=((0, _('Asset')), (1, _('Liability')), (2, _('Equity')), (3, _('Revenue')), (4, _('Expense')), (5, _('Contra-accounts'))), null=True, db_index=True)
+    is_cash = models.BooleanField(verbose_name=_('is cash'), default=False, db_index=True, editable=False)
+    is_third = models.BooleanField(verbose_name=_('is third'), default=False, db_index=True, editable=False)
+    is_customer = models.BooleanField(verbose_name=_('is customer'), default=False, db_index=True, editable=False)
+    is_provider = models.BooleanField(verbose_name=_('is provider'), default=False, db_index=True, editable=False)
+    is_revenue = models.BooleanField(verbose_name=_('is revenue'), default=False, db_index=True, editable=False)
+    is_expense = models.BooleanField(verbose_name=_('is expense'), default=False, db_index=True, editable=False)
+    is_annexe = models.BooleanField(verbose_name=_('is annexe'), default=False, db_index=True, editable=False)
+
+    CLASSIFICATION_MASKS = (('is_cash', 'get_cash_mask'), ('is_third', 'get_third_mask'), ('is_customer', 'get_customer_mask'),
+                            ('is_provider', 'get_provider_mask'), ('is_revenue', 'get_revenue_mask'), ('is_expense', 'get_expence_mask'),
+                            ('is_annexe', 'get_annexe_mask'))
+
+    @classmethod
+    def get_classification_regex(cls):
+        system_account = current_system_account()
+        return [(field_name, re.compile(getattr(system_account, mask_name)())) for field_name, mask_name in cls.CLASSIFICATION_MASKS]
+
+    @classmethod
+    def refresh_classification(cls, queryset=None):
+        if queryset is None:
+            queryset = cls.objects.all()
+        classification_regex = cls.get_classification_regex()
+        account_ids = {field_name: ([], []) for field_name, _code_regex in classification_regex}
+        for account_id, account_code in queryset.values_list('id', 'code'):
+            for field_name, code_regex in classification_regex:
+                account_ids[field_name][0 if code_regex.search(account_code) is not None else 1].append(account_id)
+        for field_name, (match_ids, unmatch_ids) in account_ids.items():
+            cls.objects.filter(id__in=match_ids).exclude(**{field_name: True}).update(**{field_name: True})
+            cls.objects.filter(id__in=unmatch_ids).exclude(**{field_name: False}).update(**{field_name: False})
+
+    def set_classification(self, classification_regex=None):
+        if classification_regex is None:
+            classification_regex = self.get_classification_regex()
+        for field_name, code_regex in classification_regex:
+            setattr(self, field_name, code_regex.search(self.code) is not None)
 
     @classmethod
     def get_default_fields(cls):
@@ -580,14 +741,22 @@ class ChartsAccount(LucteriosModel):
     def get_name(self):
         return "[%s] %s" % (correct_accounting_code(self.code), self.name)
 
+    def get_balance(self):
+        try:
+            return self.balance
+        except ObjectDoesNotExist:
+            ChartsAccountBalance.rebuild(accounts=[self.id])
+            self.balance = ChartsAccountBalance.objects.get(account_id=self.id)
+            return self.balance
+
     def get_last_year_total(self):
-        return get_amount_sum(self.entrylineaccount_set.filter(entry__journal__id=1).aggregate(Sum('amount')))
+        return self.get_balance().last_year
 
     def get_current_total(self):
-        return get_amount_sum(self.entrylineaccount_set.all().aggregate(Sum('amount')))
+        return self.get_balance().total
 
     def get_current_validated(self):
-        return get_amount_sum(self.entrylineaccount_set.filter(entry__close=True).aggregate(Sum('amount')))
+        return self.get_balance().validated
 
     def credit_debit_way(self):
         if self.type_of_account in [0, 4]:
@@ -607,14 +776,6 @@ class ChartsAccount(LucteriosModel):
     def current_validated(self):
         return format_devise(self.credit_debit_way() * self.get_current_validated(), 2)
 
-    @property
-    def is_third(self):
-        return match(current_system_account().get_third_mask(), self.code) is not None
-
-    @property
-    def is_cash(self):
-        return match(current_system_account().get_cash_mask(), self.code) is not None
-
     @classmethod
     def get_account(cls, code, year):
         accounts = ChartsAccount.objects.filter(year=year, code=code)
@@ -635,28 +796,48 @@ class ChartsAccount(LucteriosModel):
         return chart
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        try:
-            self.code = correct_accounting_code(self.code)
-            exist_account = ChartsAccount.objects.get(
-                code=self.code, year=self.year)
-            if exist_account.id != self.id:
-                raise LucteriosException(
-                    IMPORTANT, _('Account already exists for this fiscal year!'))
-        except ObjectDoesNotExist:
-            pass
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        self.code = correct_accounting_code(self.code)
+        if ChartsAccount.objects.filter(code=self.code, year=self.year).exclude(id=self.id).exists():
+            raise LucteriosException(IMPORTANT, _('Account already exists for this fiscal year!'))
+        self.set_classification()
+        is_new = self.id is None
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if is_new:
+            self.balance = ChartsAccountBalance.objects.create(account=self)
+        return res
+
+    @classmethod
+    def create_accounts(cls, year, account_values):
+        # account_values: iterable of (code, name, type_of_account), type_of_account None to ask accounting system
+        system_account = current_system_account()
+        classification_regex = cls.get_classification_regex()
+        existing_codes = set(year.chartsaccount_set.values_list('code', flat=True))
+        new_accounts = []
+        for code, name, type_of_account in account_values:
+            code = correct_accounting_code(code)
+            if code in existing_codes:
+                continue
+            if type_of_account is None:
+                type_of_account = system_account.new_charts_account(code)[1]
+                if type_of_account < 0:
+                    continue
+            new_account = cls(year=year, code=code, name=name, type_of_account=type_of_account)
+            new_account.set_classification(classification_regex)
+            new_accounts.append(new_account)
+            existing_codes.add(code)
+        if len(new_accounts) > 0:
+            with transaction.atomic():
+                cls.objects.bulk_create(new_accounts)
+                ChartsAccountBalance.objects.bulk_create([ChartsAccountBalance(account_id=account_id)
+                                                          for account_id in year.chartsaccount_set.filter(balance__isnull=True).values_list('id', flat=True)])
+        return len(new_accounts)
 
     @classmethod
     def import_initial(cls, year, account_item):
         if isfile(account_item):
             with open(account_item, 'r', encoding='UTF-8') as fcsv:
                 csv_read = DictReader(fcsv, delimiter=';', quotechar='', quoting=QUOTE_NONE)
-                for row in csv_read:
-                    new_code = correct_accounting_code(row['code'])
-                    if cls.get_account(new_code, year) is None:
-                        account_desc = current_system_account().new_charts_account(new_code)
-                        if account_desc[1] >= 0:
-                            ChartsAccount.objects.create(year=year, code=new_code, name=row['name'], type_of_account=account_desc[1])
+                cls.create_accounts(year, [(row['code'], row['name'], None) for row in csv_read])
 
     class Meta(object):
         verbose_name = _('charts of account')
@@ -664,6 +845,99 @@ class ChartsAccount(LucteriosModel):
         ordering = ['year', 'code']
 
 
+class ChartsAccountBalance(LucteriosModel):
+    account = models.OneToOneField('ChartsAccount', verbose_name=_('account'), related_name='balance', null=False, on_delete=models.CASCADE)
+    total = models.FloatField(_('total current'), default=0.0)
+    validated = models.FloatField(_('total validated'), default=0.0)
+    last_year = models.FloatField(_('total of last year'), default=0.0)
+
+    def __str__(self):
+        return six.text_type(self.account)
+
+    @classmethod
+    def get_balance_query(cls, lines):
+        return lines.values('account_id').annotate(sum_total=Sum('amount'),
+                                                   sum_validated=Sum(Case(When(entry__close=True, then='amount'), default=Value(0.0), output_field=models.FloatField())),
+                                                   sum_last_year=Sum(Case(When(entry__journal_id=1, then='amount'), default=Value(0.0), output_field=models.FloatField()))).order_by()
+
+    @classmethod
+    def rebuild(cls, year=None, accounts=None):
+        charts = ChartsAccount.objects.all()
+        if year is not None:
+            charts = charts.filter(year=year)
+        if accounts is not None:
+            charts = charts.filter(id__in=accounts)
+        account_ids = list(charts.values_list('id', flat=True))
+        sums = {}
+        for value in cls.get_balance_query(EntryLineAccount.objects.filter(account_id__in=charts)):
+            sums[value['account_id']] = value
+        cls.objects.filter(account_id__in=account_ids).delete()
+        new_balances = []
+        for account_id in account_ids:
+            value = sums.get(account_id, {})
+            new_balances.append(cls(account_id=account_id, total=value.get('sum_total') or 0.0,
+                                    validated=value.get('sum_validated') or 0.0, last_year=value.get('sum_last_year') or 0.0))
+        cls.objects.bulk_create(new_balances)
+        return len(new_balances)
+
+    @classmethod
+    def refresh(cls, account_ids):
+        account_ids = set(account_ids)
+        for value in cls.get_balance_query(EntryLineAccount.objects.filter(account_id__in=account_ids)):
+            account_ids.discard(value['account_id'])
+            cls.objects.filter(account_id=value['account_id']).update(total=value['sum_total'] or 0.0,
+                                                                      validated=value['sum_validated'] or 0.0,
+                                                                      last_year=value['sum_last_year'] or 0.0)
+        if len(account_ids) > 0:
+            cls.objects.filter(account_id__in=account_ids).update(total=0.0, validated=0.0, last_year=0.0)
+
+    @classmethod
+    def add_amount(cls, account_id, amount, close, journal_id):
+        if abs(amount) > 0.00001:
+            new_values = {'total': F('total') + amount}
+            if close:
+                new_values['validated'] = F('validated') + amount
+            if journal_id == 1:
+                new_values['last_year'] = F('last_year') + amount
+            cls.objects.filter(account_id=account_id).update(**new_values)
+
+    class Meta(object):
+        verbose_name = _('balance of account')
+        verbose_name_plural = _('balances of account')
+        default_permissions = []
+
+
+class NumberSequence(LucteriosModel):
+    model_name = models.CharField(_('model'), max_length=100)
+    year = models.ForeignKey('FiscalYear', verbose_name=_('fiscal year'), null=False, on_delete=models.CASCADE)
+    sub_type = models.IntegerField(verbose_name=_('type'), default=0)
+    last_num = models.IntegerField(verbose_name=_('last number'), default=0)
+
+    def __str__(self):
+        return "%s %s/%d: %d" % (self.model_name, self.year, self.sub_type, self.last_num)
+
+    @classmethod
+    def reserve(cls, model_name, year_id, nb_num=1, sub_type=0, get_last_num=None):
+        with transaction.atomic():
+            sequence = cls.objects.select_for_update().filter(model_name=model_name, year_id=year_id, sub_type=sub_type).first()
+            if sequence is None:
+                last_num = get_last_num() if get_last_num is not None else None
+                try:
+                    with transaction.atomic():
+                        sequence = cls.objects.create(model_name=model_name, year_id=year_id, sub_type=sub_type, last_num=last_num if last_num is not None else 0)
+                except IntegrityError:
+                    sequence = cls.objects.select_for_update().get(model_name=model_name, year_id=year_id, sub_type=sub_type)
+            first_num = sequence.last_num + 1
+            cls.objects.filter(id=sequence.id).update(last_num=F('last_num') + nb_num)
+        return first_num
+
+    class Meta(object):
+        verbose_name = _('number sequence')
+        verbose_name_plural = _('number sequences')
+        default_permissions = []
+        unique_together = (('model_name', 'year', 'sub_type'),)
+
+
 class Journal(LucteriosModel):
     name = models.CharField(_('name'), max_length=50, unique=True)
 
@@ -688,13 +962,13 @@ class Journal(LucteriosModel):
 
 
 class AccountLink(LucteriosModel):
+    letter = models.CharField(_('letter'), max_length=10, blank=True, default='', editable=False)
+
     def __str__(self):
         return self.letter
 
-    @property
-    def letter(self):
-        year = self.entryaccount_set.all()[0].year
-        nb_link = AccountLink.objects.filter(entryaccount__year=year, id__lt=self.id).count()
+    @classmethod
+    def convert_letter(cls, nb_link):
         letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
         res = ''
         while nb_link >= 26:
@@ -703,22 +977,155 @@ class AccountLink(LucteriosModel):
             nb_link = int(div) - 1
         return letters[nb_link] + res
 
+    @classmethod
+    def convert_index(cls, letter):
+        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        nb_link = -1
+        for char in letter:
+            nb_link = (nb_link + 1) * 26 + letters.index(char)
+        return nb_link
+
+    @classmethod
+    def _get_last_letter_num(cls, year_id):
+        last_num = 0
+        for letter, nb_entry in EntryAccount.objects.filter(year_id=year_id, link__isnull=False).values_list('link__letter').annotate(Count('id')).order_by():
+            if letter != '':
+                last_num = max(last_num, cls.convert_index(letter) + nb_entry)
+        return last_num
+
+    @classmethod
+    def reserve_letter_index(cls, year_id, nb_entry):
+        return NumberSequence.reserve(cls._meta.label, year_id, nb_entry, get_last_num=lambda: cls._get_last_letter_num(year_id)) - 1
+
+    @classmethod
+    def get_letters(cls, year):
+        return dict(cls.objects.filter(entryaccount__year=year).values_list('id', 'letter').distinct())
+
     @classmethod
     def create_link(cls, entries):
-        year = None
-        for entry in entries:
-            entry = EntryAccount.objects.get(id=entry.id)
+        entry_ids = [entry.id for entry in entries]
+        year_ids = set()
+        link_ids = set()
+        for entry in EntryAccount.objects.filter(id__in=entry_ids).select_related('year', 'link'):
             if entry.year.status == 2:
                 raise LucteriosException(IMPORTANT, _("Fiscal year finished!"))
-            if year is None:
-                year = entry.year
-            elif year != entry.year:
+            year_ids.add(entry.year_id)
+            if len(year_ids) > 1:
                 raise LucteriosException(IMPORTANT, _("This entries are not in same fiscal year!"))
-            entry.unlink()
-        new_link = AccountLink.objects.create()
+            if entry.link_id not in link_ids:
+                link_ids.add(entry.link_id)
+                entry.unlink()
+        if len(year_ids) == 0:
+            return None
+        nb_link = cls.reserve_letter_index(year_ids.pop(), len(entry_ids))
+        new_link = AccountLink.objects.create(letter=cls.convert_letter(nb_link))
+        EntryAccount.objects.filter(id__in=entry_ids).update(link=new_link)
         for entry in entries:
             entry.link = new_link
-            entry.save()
+        return new_link
+
+    @classmethod
+    def _get_autolink_groups(cls, year, third_ids=None):
+        entry_keys = {}
+        entry_values = {}
+        lines = EntryLineAccount.objects.filter(entry__year=year, entry__link__isnull=True, account__is_third=True, third__isnull=False)
+        for line_value in lines.values('entry_id', 'entry__date_value', 'third_id', 'account_id').annotate(amount=Sum('amount')).order_by():
+            entry_id = line_value['entry_id']
+            key = (line_value['third_id'], line_value['account_id'])
+            if entry_keys.setdefault(entry_id, key) != key:
+                entry_keys[entry_id] = None
+            entry_values[entry_id] = (line_value['entry__date_value'], entry_id, int(round(line_value['amount'] * 100)))
+        groups = {}
+        for entry_id, key in entry_keys.items():
+            if (key is not None) and ((third_ids is None) or (key[0] in third_ids)) and (entry_values[entry_id][2] != 0):
+                groups.setdefault(key, []).append(entry_values[entry_id])
+        for items in groups.values():
+            items.sort()
+        return groups
+
+    @classmethod
+    def _find_exact_links(cls, items, used_ids):
+        links = []
+        by_amount = {}
+        for _date_value, entry_id, amount in items:
+            by_amount.setdefault(amount, deque()).append(entry_id)
+        for _date_value, entry_id, amount in items:
+            if entry_id in used_ids:
+                continue
+            candidates = by_amount.get(-1 * amount, ())
+            while (len(candidates) > 0) and (candidates[0] in used_ids):
+                candidates.popleft()
+            if len(candidates) > 0:
+                other_id = candidates.popleft()
+                used_ids.update((entry_id, other_id))
+                links.append([entry_id, other_id])
+        return links
+
+    @classmethod
+    def _find_subset_links(cls, items, used_ids, max_subset, window):
+        links = []
+        for item_idx, (_date_value, entry_id, amount) in enumerate(items):
+            if entry_id in used_ids:
+                continue
+            others = []
+            for dist in range(1, len(items)):
+                for other_idx in (item_idx - dist, item_idx + dist):
+                    if (0 <= other_idx < len(items)) and (items[other_idx][1] not in used_ids) and ((items[other_idx][2] > 0) != (amount > 0)):
+                        others.append((dist, items[other_idx][1], items[other_idx][2]))
+                if (len(others) >= window) or ((dist > item_idx) and (item_idx + dist >= len(items))):
+                    break
+            others = others[:window]
+            by_amount = {}
+            for _dist, other_id, other_amount in others:
+                by_amount.setdefault(other_amount, []).append(other_id)
+            subset = None
+            for subset_size in range(1, max_subset):
+                for combo in combinations(others, subset_size):
+                    rest = -1 * (amount + sum([other_amount for _dist, _other_id, other_amount in combo]))
+                    combo_ids = [other_id for _dist, other_id, _other_amount in combo]
+                    last_id = next((other_id for other_id in by_amount.get(rest, ()) if other_id not in combo_ids), None)
+                    if last_id is not None:
+                        subset = [entry_id] + combo_ids + [last_id]
+                        break
+                if subset is not None:
+                    break
+            if subset is not None:
+                used_ids.update(subset)
+                links.append(subset)
+        return links
+
+    @classmethod
+    def find_auto_links(cls, year, third_ids=None, max_subset=3, window=20):
+        links = []
+        for items in cls._get_autolink_groups(year, third_ids).values():
+            used_ids = set()
+            links.extend(cls._find_exact_links(items, used_ids))
+            if max_subset > 1:
+                links.extend(cls._find_subset_links(items, used_ids, max_subset, window))
+        return links
+
+    @classmethod
+    def auto_link(cls, year, third_ids=None, max_subset=3, window=20):
+        if year.status == 2:
+            raise LucteriosException(IMPORTANT, _("Fiscal year finished!"))
+        links = cls.find_auto_links(year, third_ids, max_subset, window)
+        with transaction.atomic():
+            nb_link = cls.reserve_letter_index(year.id, sum([len(entry_ids) for entry_ids in links]))
+            new_links = []
+            for entry_ids in links:
+                new_links.append(cls(letter=cls.convert_letter(nb_link)))
+                nb_link += len(entry_ids)
+            last_id = cls.objects.aggregate(Max('id'))['id__max'] or 0
+            cls.objects.bulk_create(new_links)
+            if (len(new_links) > 0) and (new_links[0].id is None):
+                link_ids = dict(cls.objects.filter(id__gt=last_id).values_list('letter', 'id'))
+                for new_link in new_links:
+                    new_link.id = link_ids[new_link.letter]
+            entries = []
+            for new_link, entry_ids in zip(new_links, links):
+                entries.extend([EntryAccount(id=entry_id, link_id=new_link.id) for entry_id in entry_ids])
+            EntryAccount.objects.bulk_update(entries, ['link'], batch_size=500)
+        return links
 
     class Meta(object):
 
@@ -767,9 +1174,14 @@ class EntryAccount(LucteriosModel):
     @classmethod
     def clear_ghost(cls):
         if not RecordLocker.has_item_lock(cls):
-            for entry in cls.objects.filter(close=False):
-                if len(entry.entrylineaccount_set.all()) == 0:
-                    entry.delete()
+            ghost_filter = Q(close=False) & Q(entrylineaccount__isnull=True)
+            link_ids = list(cls.objects.filter(ghost_filter & Q(link__isnull=False)).exclude(year__status=2).values_list('link_id', flat=True).distinct())
+            if len(link_ids) > 0:
+                ghost_filter = Q(entrylineaccount__isnull=True) & (Q(close=False) | Q(link_id__in=link_ids))
+            cls.objects.filter(ghost_filter).delete()
+            if len(link_ids) > 0:
+                cls.objects.filter(link_id__in=link_ids).update(link=None)
+                AccountLink.objects.filter(id__in=link_ids).delete()
 
     @property
     def description(self):
@@ -827,14 +1239,14 @@ class EntryAccount(LucteriosModel):
             serial_val += line.get_serial()
         return serial_val
 
+    def get_entry_draft(self):
+        if not hasattr(self, '_entry_draft'):
+            self._entry_draft = EntryDraft()
+        return self._entry_draft
+
     def get_entrylineaccounts(self, serial_vals):
         res = QuerySet(model=EntryLineAccount)
-        res._result_cache = []
-        for serial_val in serial_vals.split('\n'):
-            if serial_val != '':
-                new_line = EntryLineAccount.get_entrylineaccount(serial_val)
-                new_line.entry = self
-                res._result_cache.append(new_line)
+        res._result_cache = self.get_entry_draft().get_lines(self, serial_vals)
         return res
 
     def save_entrylineaccounts(self, serial_vals):
@@ -845,33 +1257,20 @@ class EntryAccount(LucteriosModel):
                     line.id = None
                 line.save()
 
-    def remove_entrylineaccounts(self, serial_vals, entrylineid):
-        lines = self.get_entrylineaccounts(serial_vals)
-        line_idx = -1
-        for idx in range(len(lines)):
-            if lines[idx].id == entrylineid:
-                line_idx = idx
-        del lines._result_cache[line_idx]
-        return self.get_serial(lines)
-
-    def add_new_entryline(self, serial_entry, entrylineaccount, num_cpt, credit_val, debit_val, third, costaccounting, reference):
+    def add_new_entryline(self, entry_draft, entrylineaccount, num_cpt, credit_val, debit_val, third, costaccounting, reference):
         if self.journal.id == 1:
             charts = ChartsAccount.objects.get(id=num_cpt)
-            if match(current_system_account().get_revenue_mask(), charts.code) or \
-                    match(current_system_account().get_expence_mask(), charts.code):
+            if charts.is_revenue or charts.is_expense:
                 raise LucteriosException(IMPORTANT, _('This kind of entry is not allowed for this journal!'))
         if entrylineaccount != 0:
-            serial_entry = self.remove_entrylineaccounts(serial_entry, entrylineaccount)
-        if serial_entry != '':
-            serial_entry += '\n'
-        serial_entry += EntryLineAccount.add_serial(num_cpt, debit_val, credit_val, third, costaccounting, reference)
-        return serial_entry
+            entry_draft.remove_line(entrylineaccount)
+        entry_draft.add_line(EntryLineAccount.add_serial(num_cpt, debit_val, credit_val, third, costaccounting, reference))
 
     def serial_control(self, serial_vals):
         total_credit = 0
         total_debit = 0
         serial = self.get_entrylineaccounts(serial_vals)
-        current = self.entrylineaccount_set.all()
+        current = list(self.entrylineaccount_set.all())
         no_change = len(serial) > 0
         if len(serial) == len(current):
             for idx in range(len(serial)):
@@ -885,24 +1284,54 @@ class EntryAccount(LucteriosModel):
                 total_debit += serial[idx].get_debit()
         return no_change, currency_round(max(0, total_credit - total_debit)), currency_round(max(0, total_debit - total_credit))
 
-    def closed(self, check_balance=True):
-        if (self.year.status != 2) and not self.close:
-            if check_balance:
-                _no_change, debit_rest, credit_rest = self.serial_control(self.get_serial())
+    @classmethod
+    def check_closing(cls, entry_ids, check_balance=True):
+        if check_balance:
+            balance_query = EntryLineAccount.objects.filter(entry_id__in=entry_ids).values('entry_id')
+            balance_query = balance_query.annotate(data_sum=Sum(Case(When(account__type_of_account__in=(0, 4), then=-1 * F('amount')),
+                                                                     default=F('amount'), output_field=models.FloatField())))
+            for balance_value in balance_query.order_by():
+                debit_rest = currency_round(max(0, balance_value['data_sum']))
+                credit_rest = currency_round(max(0, -1 * balance_value['data_sum']))
                 if abs(debit_rest - credit_rest) >= 0.001:
                     raise LucteriosException(GRAVE, "Account entry not balanced: sum credit=%.3f / sum debit=%.3f" % (debit_rest, credit_rest))
-            if Params.getvalue("accounting-needcost"):
-                for entryline in self.entrylineaccount_set.all():
-                    if (entryline.account.type_of_account in (3, 4, 5)) and (entryline.costaccounting_id is None):
-                        raise LucteriosException(IMPORTANT, _("Cost accounting is mandatory !"))
-            self.close = True
-            val = self.year.entryaccount_set.all().aggregate(Max('num'))
-            if val['num__max'] is None:
-                self.num = 1
-            else:
-                self.num = val['num__max'] + 1
-            self.date_entry = date.today()
-            self.save()
+        if Params.getvalue("accounting-needcost"):
+            if EntryLineAccount.objects.filter(entry_id__in=entry_ids, account__type_of_account__in=(3, 4, 5), costaccounting__isnull=True).exists():
+                raise LucteriosException(IMPORTANT, _("Cost accounting is mandatory !"))
+
+    @classmethod
+    def get_first_num(cls, year_id, nb_num=1):
+        return NumberSequence.reserve(cls._meta.label, year_id, nb_num, get_last_num=lambda: cls.objects.filter(year_id=year_id).aggregate(Max('num'))['num__max'])
+
+    @classmethod
+    def close_entries(cls, entry_ids, check_balance=True):
+        with transaction.atomic():
+            entries = list(cls.objects.filter(id__in=entry_ids, close=False).exclude(year__status=2).order_by('year_id', 'date_value', 'id'))
+            if len(entries) == 0:
+                return 0
+            cls.check_closing([entry.id for entry in entries], check_balance)
+            today = date.today()
+            current_year_id = None
+            for entry in entries:
+                if entry.year_id != current_year_id:
+                    current_year_id = entry.year_id
+                    current_num = cls.get_first_num(current_year_id, len([year_entry for year_entry in entries if year_entry.year_id == current_year_id]))
+                entry.close = True
+                entry.num = current_num
+                entry.date_entry = today
+                current_num += 1
+            cls.objects.bulk_update(entries, ['close', 'num', 'date_entry'], batch_size=500)
+            ChartsAccountBalance.refresh(EntryLineAccount.objects.filter(entry_id__in=[entry.id for entry in entries]).values_list('account_id', flat=True).distinct())
+        return len(entries)
+
+    def closed(self, check_balance=True):
+        if (self.year.status != 2) and not self.close:
+            self.check_closing([self.id], check_balance)
+            with transaction.atomic():
+                self.close = True
+                self.num = self.get_first_num(self.year_id)
+                self.date_entry = date.today()
+                self.save()
 
     def unlink(self):
         if (self.year.status != 2) and (self.link_id is not None):
@@ -947,20 +1376,26 @@ class EntryAccount(LucteriosModel):
 
     @property
     def has_third(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_third_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_third=True).exists()
 
     @property
     def has_customer(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_customer_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_customer=True).exists()
 
     @property
     def has_cash(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_cash_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_cash=True).exists()
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if (self.costaccounting is not None) and (self.costaccounting.year_id is not None) and (self.costaccounting.year_id != self.year_id):
             self.costaccounting_id = None
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        old_state = None
+        if self.id is not None:
+            old_state = EntryAccount.objects.filter(id=self.id).values_list('close', 'journal_id').first()
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if (old_state is not None) and (old_state != (self.close, self.journal_id)):
+            ChartsAccountBalance.refresh(self.entrylineaccount_set.values_list('account_id', flat=True).distinct())
+        return res
 
     class Meta(object):
         verbose_name = _('entry of account')
@@ -1065,34 +1500,28 @@ class EntryLineAccount(LucteriosModel):
 
     def equals(self, other):
         res = self.id == other.id
-        res = res and (self.account.id == other.account.id)
+        res = res and (self.account_id == other.account_id)
         res = res and (abs(self.amount - other.amount) < 0.0001)
         res = res and (self.reference == other.reference)
-        if self.third is None:
-            res = res and (other.third is None)
-        else:
-            res = res and (self.third.id == other.third.id)
-        if self.costaccounting is None:
-            res = res and (other.costaccounting is None)
-        else:
-            res = res and (self.costaccounting.id == other.costaccounting.id)
+        res = res and (self.third_id == other.third_id)
+        res = res and (self.costaccounting_id == other.costaccounting_id)
         return res
 
     def get_serial(self):
         # return serial information: "<id>|<accound id>|<third id> or None|<amount>|<cost id> or None|<reference> or None"
-        if self.third is None:
+        if self.third_id is None:
             third_id = 0
         else:
-            third_id = self.third.id
+            third_id = self.third_id
         if self.reference is None:
             reference = 'None'
         else:
             reference = self.reference
-        if self.costaccounting is None:
+        if self.costaccounting_id is None:
             costaccounting_id = 0
         else:
-            costaccounting_id = self.costaccounting.id
-        return "%d|%d|%d|%f|%d|%s|" % (self.id, self.account.id, third_id, self.amount, costaccounting_id, reference)
+            costaccounting_id = self.costaccounting_id
+        return "%d|%d|%d|%f|%d|%s|" % (self.id, self.account_id, third_id, self.amount, costaccounting_id, reference)
 
     @classmethod
     def add_serial(cls, num_cpt, debit_val, credit_val, thirdid=0, costaccountingid=0, reference=None):
@@ -1116,20 +1545,22 @@ class EntryLineAccount(LucteriosModel):
         return new_entry_line.get_serial()
 
     @classmethod
-    def get_entrylineaccount(cls, serial_val):
+    def get_entrylineaccount(cls, serial_val, entry_draft=None):
+        if entry_draft is None:
+            entry_draft = EntryDraft()
         serial_vals = serial_val.split('|')
         new_entry_line = cls()
         new_entry_line.id = int(serial_vals[0])
-        new_entry_line.account = ChartsAccount.objects.get(id=int(serial_vals[1]))
+        new_entry_line.account = entry_draft.get_account(int(serial_vals[1]))
         if int(serial_vals[2]) == 0:
             new_entry_line.third = None
         else:
-            new_entry_line.third = Third.objects.get(id=int(serial_vals[2]))
+            new_entry_line.third = entry_draft.get_third(int(serial_vals[2]))
         new_entry_line.amount = float(serial_vals[3])
         if (int(serial_vals[4]) == 0) or (new_entry_line.account.type_of_account not in (3, 4, 5)):
             new_entry_line.costaccounting = None
         else:
-            new_entry_line.costaccounting = CostAccounting.objects.get(id=int(serial_vals[4]))
+            new_entry_line.costaccounting = entry_draft.get_costaccounting(int(serial_vals[4]))
         new_entry_line.reference = "".join(serial_vals[5:-1])
         if new_entry_line.reference.startswith("None"):
             new_entry_line.reference = None
@@ -1162,7 +1593,14 @@ class EntryLineAccount(LucteriosModel):
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if (self.account.type_of_account not in (3, 4, 5)) and (self.costaccounting is not None):
             self.costaccounting = None
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        old_line = None
+        if self.id is not None:
+            old_line = EntryLineAccount.objects.filter(id=self.id).values_list('account_id', 'amount').first()
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if old_line is not None:
+            ChartsAccountBalance.add_amount(old_line[0], -1 * old_line[1], self.entry.close, self.entry.journal_id)
+        ChartsAccountBalance.add_amount(self.account_id, self.amount, self.entry.close, self.entry.journal_id)
+        return res
 
     class Meta(object):
         verbose_name = _('entry line of account')
@@ -1171,6 +1609,196 @@ class EntryLineAccount(LucteriosModel):
         ordering = ['entry__date_value', 'entry__id', 'account__code', 'third']
 
 
+class EntryDraft(object):
+
+    def __init__(self):
+        self.accounts = {}
+        self.thirds = {}
+        self.costaccountings = {}
+
+    def _get_item(self, queryset, items, item_id):
+        if item_id not in items:
+            item = queryset.filter(id=item_id).first()
+            if item is None:
+                raise queryset.model.DoesNotExist("%s matching query does not exist." % queryset.model._meta.object_name)
+            items[item_id] = item
+        return items[item_id]
+
+    def get_account(self, account_id):
+        return self._get_item(ChartsAccount.objects.all(), self.accounts, account_id)
+
+    def get_third(self, third_id):
+        return self._get_item(Third.objects.select_related('contact', 'contact__legalentity', 'contact__individual'), self.thirds, third_id)
+
+    def get_costaccounting(self, costaccounting_id):
+        return self._get_item(CostAccounting.objects.all(), self.costaccountings, costaccounting_id)
+
+    def load(self, serial_vals):
+        account_ids = set()
+        third_ids = set()
+        costaccounting_ids = set()
+        for serial_val in serial_vals.split('\n'):
+            if serial_val != '':
+                line_vals = serial_val.split('|')
+                account_ids.add(int(line_vals[1]))
+                if int(line_vals[2]) != 0:
+                    third_ids.add(int(line_vals[2]))
+                if int(line_vals[4]) != 0:
+                    costaccounting_ids.add(int(line_vals[4]))
+        account_ids -= set(self.accounts.keys())
+        if len(account_ids) > 0:
+            self.accounts.update(ChartsAccount.objects.in_bulk(account_ids))
+        third_ids -= set(self.thirds.keys())
+        if len(third_ids) > 0:
+            self.thirds.update(Third.objects.select_related('contact', 'contact__legalentity', 'contact__individual').in_bulk(third_ids))
+        costaccounting_ids -= set(self.costaccountings.keys())
+        if len(costaccounting_ids) > 0:
+            self.costaccountings.update(CostAccounting.objects.in_bulk(costaccounting_ids))
+
+    def get_lines(self, entry, serial_vals):
+        self.load(serial_vals)
+        lines = []
+        for serial_val in serial_vals.split('\n'):
+            if serial_val != '':
+                new_line = EntryLineAccount.get_entrylineaccount(serial_val, self)
+                new_line.entry = entry
+                lines.append(new_line)
+        return lines
+
+
+class EntryAccountDraft(LucteriosModel):
+    EXPIRY_DELAY = timedelta(days=1)
+
+    entry = models.ForeignKey('EntryAccount', verbose_name=_('entry'), null=False, on_delete=models.CASCADE)
+    session_key = models.CharField(_('session'), max_length=40, blank=True)
+    last_modified = models.DateTimeField(verbose_name=_('last modified'), auto_now=True)
+    debit = models.FloatField(verbose_name=_('debit'), default=0.0)
+    credit = models.FloatField(verbose_name=_('credit'), default=0.0)
+    changed = models.BooleanField(verbose_name=_('changed'), default=False)
+
+    def __str__(self):
+        return "%s [%s]" % (self.entry_id, self.session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        cls.objects.filter(last_modified__lt=timezone.now() - cls.EXPIRY_DELAY).delete()
+
+    @classmethod
+    def get_draft(cls, entry, xfer):
+        session = getattr(xfer.request, 'session', None)
+        if session is not None:
+            if session.session_key is None:
+                session.save()
+            session_key = session.session_key
+        else:
+            session_key = ''
+        serial_vals = xfer.getparam('serial_entry')
+        draft_id = xfer.getparam('entrydraft', 0)
+        if 'serial_entry' in xfer.params.keys():
+            del xfer.params['serial_entry']
+        draft = None
+        if (serial_vals is None) and (draft_id != 0):
+            draft = cls.objects.filter(id=draft_id, entry=entry, session_key=session_key).first()
+            if draft is None:
+                raise LucteriosException(IMPORTANT, _("This entry modification has expired!"))
+        if draft is None:
+            draft, _created = cls.objects.get_or_create(entry=entry, session_key=session_key)
+            draft.entry = entry
+            draft.reset(serial_vals)
+        return draft
+
+    def reset(self, serial_vals=None):
+        current = list(self.entry.entrylineaccount_set.all())
+        if serial_vals is None:
+            lines = current
+        else:
+            lines = self.entry.get_entrylineaccounts(serial_vals)
+        no_change = (len(lines) > 0) and (len(lines) == len(current))
+        self.debit = 0.0
+        self.credit = 0.0
+        new_lines = []
+        for idx in range(len(lines)):
+            line = lines[idx]
+            no_change = no_change and current[idx].equals(line)
+            new_lines.append(EntryLineDraft(draft=self, line_id=line.id, serial=line.get_serial(), debit=line.get_debit(), credit=line.get_credit()))
+            self.debit += new_lines[-1].debit
+            self.credit += new_lines[-1].credit
+        self.changed = not no_change
+        self.entrylinedraft_set.all().delete()
+        EntryLineDraft.objects.bulk_create(new_lines)
+        self.save()
+
+    def _update_totals(self, debit, credit):
+        EntryAccountDraft.objects.filter(id=self.id).update(debit=F('debit') + debit, credit=F('credit') + credit, changed=True, last_modified=timezone.now())
+        self.debit += debit
+        self.credit += credit
+        self.changed = True
+
+    def get_line(self, line_id):
+        line_draft = self.entrylinedraft_set.filter(line_id=line_id).first()
+        if line_draft is None:
+            return None
+        line = EntryLineAccount.get_entrylineaccount(line_draft.serial, self.entry.get_entry_draft())
+        line.entry = self.entry
+        return line
+
+    def add_line(self, serial_val):
+        line = EntryLineAccount.get_entrylineaccount(serial_val, self.entry.get_entry_draft())
+        if line.id < 0:
+            min_line_id = self.entrylinedraft_set.aggregate(Min('line_id'))['line_id__min']
+            if (min_line_id is not None) and (min_line_id <= line.id):
+                line.id = min_line_id - 1
+        line_draft = EntryLineDraft.objects.create(draft=self, line_id=line.id, serial=line.get_serial(), debit=line.get_debit(), credit=line.get_credit())
+        self._update_totals(line_draft.debit, line_draft.credit)
+
+    def remove_line(self, line_id):
+        line_draft = self.entrylinedraft_set.filter(line_id=line_id).first()
+        if line_draft is not None:
+            line_draft.delete()
+            self._update_totals(-1 * line_draft.debit, -1 * line_draft.credit)
+
+    def get_serial(self):
+        return '\n'.join(self.entrylinedraft_set.values_list('serial', flat=True))
+
+    def get_entrylineaccounts(self):
+        return self.entry.get_entrylineaccounts(self.get_serial())
+
+    @property
+    def nb_lines(self):
+        return self.entrylinedraft_set.count()
+
+    @property
+    def debit_rest(self):
+        return currency_round(max(0, self.credit - self.debit))
+
+    @property
+    def credit_rest(self):
+        return currency_round(max(0, self.debit - self.credit))
+
+    class Meta(object):
+        verbose_name = _('draft of entry')
+        verbose_name_plural = _('drafts of entry')
+        default_permissions = []
+        unique_together = (('entry', 'session_key'),)
+
+
+class EntryLineDraft(LucteriosModel):
+    draft = models.ForeignKey('EntryAccountDraft', verbose_name=_('draft of entry'), null=False, on_delete=models.CASCADE)
+    line_id = models.IntegerField(verbose_name=_('line'))
+    serial = models.TextField(verbose_name=_('serial'))
+    debit = models.FloatField(verbose_name=_('debit'), default=0.0)
+    credit = models.FloatField(verbose_name=_('credit'), default=0.0)
+
+    def __str__(self):
+        return self.serial
+
+    class Meta(object):
+        verbose_name = _('draft of entry line')
+        verbose_name_plural = _('drafts of entry line')
+        default_permissions = []
+        ordering = ['id']
+
+
 class ModelEntry(LucteriosModel):
     journal = models.ForeignKey('Journal', verbose_name=_('journal'), null=False, default=0, on_delete=models.PROTECT)
     designation = models.CharField(_('name'), max_length=200)
@@ -1355,9 +1983,35 @@ class Budget(LucteriosModel):
             budget_filter &= Q(year_id=year)
         if cost is not None:
             budget_filter &= Q(cost_accounting_id=cost)
-        total_revenue = get_amount_sum(cls.objects.filter(budget_filter & Q(code__regex=current_system_account().get_revenue_mask())).aggregate(Sum('amount')))
-        total_expense = get_amount_sum(cls.objects.filter(budget_filter & Q(code__regex=current_system_account().get_expence_mask())).aggregate(Sum('amount')))
-        return total_revenue - total_expense
+        return BudgetEngine(budget_filter).get_total()
+
+    @classmethod
+    def import_budget(cls, year, cost_accounting, source_year=0, source_cost=0):
+        entryline_filter = Q(account__type_of_account__in=(3, 4))
+        if cost_accounting == 0:
+            budget_filter = Q(year_id=year) & Q(cost_accounting__isnull=True)
+            entryline_filter &= Q(account__year_id=source_year)
+            cost_accounting = None
+        else:
+            budget_filter = Q(cost_accounting_id=cost_accounting)
+            entryline_filter &= Q(costaccounting_id=source_cost)
+            cost_year = CostAccounting.objects.filter(id=cost_accounting).values_list('year_id', flat=True).first()
+            if cost_year is not None:
+                year = cost_year
+        if year == 0:
+            year = None
+        values = {}
+        if cost_accounting is None:
+            values = dict((code, 0.0) for code in ChartsAccount.objects.filter(year_id=source_year, type_of_account__in=(3, 4)).values_list('code', flat=True))
+        values.update(EntryLineAccount.objects.filter(entryline_filter).values_list('account__code').annotate(Sum('amount')).order_by())
+        with transaction.atomic():
+            cls.objects.filter(budget_filter).delete()
+            if cost_accounting is None:
+                for code, amount in cls.objects.filter(year_id=year).values_list('code', 'amount'):
+                    if code in values:
+                        values[code] -= amount
+            cls.objects.bulk_create([cls(code=code, amount=value, year_id=year, cost_accounting_id=cost_accounting)
+                                     for code, value in sorted(values.items()) if abs(value) > 0.001])
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if (self.cost_accounting is not None) and (self.cost_accounting.year_id is not None):
@@ -1388,6 +2042,78 @@ class Budget(LucteriosModel):
         ordering = ['code']
 
 
+class BudgetEngine(object):
+
+    def __init__(self, budget_filter=None, group_by_code=True):
+        self.budget_filter = budget_filter if budget_filter is not None else Q()
+        self.group_by_code = group_by_code
+        self.year = None
+        self.charts = None
+        self.classifications = {}
+        self._values = None
+
+    @property
+    def values(self):
+        if self._values is None:
+            annexe_regex = re.compile(current_system_account().get_annexe_mask())
+            group_fields = ['code', 'is_positive'] if self.group_by_code else ['id', 'code', 'is_positive']
+            budgets = Budget.objects.filter(self.budget_filter).annotate(is_positive=Case(When(amount__gte=0, then=Value(True)), default=Value(False), output_field=models.BooleanField()))
+            self._values = []
+            for value in budgets.values(*group_fields).annotate(total=Sum('amount')).order_by('code', 'is_positive'):
+                line_id = value['id'] if 'id' in value else 'C' + value['code']
+                if (len(self._values) > 0) and (self._values[-1][0] == line_id) and (annexe_regex.search(value['code']) is None):
+                    self._values[-1] = (line_id, value['code'], self._values[-1][2] + value['total'], None)
+                else:
+                    self._values.append((line_id, value['code'], value['total'], value['is_positive']))
+        return self._values
+
+    def get_chart(self, code):
+        if self.charts is None:
+            self.year = FiscalYear.get_current()
+            self.charts = {chart.code: chart for chart in self.year.chartsaccount_set.all()}
+        code = correct_accounting_code(code)
+        if code not in self.charts:
+            descript, typeaccount = self.get_classification(code)
+            self.charts[code] = ChartsAccount(year=self.year, code=code, name=descript, type_of_account=typeaccount)
+        return self.charts[code]
+
+    def get_classification(self, code):
+        if code not in self.classifications:
+            self.classifications[code] = current_system_account().new_charts_account(code)
+        return self.classifications[code]
+
+    def credit_debit_way(self, code):
+        chart_account = self.get_classification(code)
+        if chart_account[0] == '':
+            raise LucteriosException(IMPORTANT, _("Invalid code"))
+        if chart_account[1] in [0, 4]:
+            return -1
+        else:
+            return 1
+
+    def get_lines(self, is_revenue):
+        system_account = current_system_account()
+        code_regex = re.compile(system_account.get_revenue_mask() if is_revenue else system_account.get_expence_mask())
+        annexe_regex = re.compile(system_account.get_annexe_mask())
+        lines = []
+        for line_id, code, amount, is_positive in self.values:
+            if (code_regex.search(code) is not None) or ((annexe_regex.search(code) is not None) and (is_positive == is_revenue)):
+                lines.append((line_id, self.get_chart(code), self.credit_debit_way(code) * amount))
+        return lines
+
+    def get_total(self):
+        system_account = current_system_account()
+        revenue_regex = re.compile(system_account.get_revenue_mask())
+        expense_regex = re.compile(system_account.get_expence_mask())
+        total = 0.0
+        for _line_id, code, amount, _is_positive in self.values:
+            if revenue_regex.search(code) is not None:
+                total += amount
+            if expense_regex.search(code) is not None:
+                total -= amount
+        return total
+
+
 def check_accountingcost():
     for entry in EntryAccount.objects.filter(costaccounting_id__gt=0, year__status__lt=2):
         try:
@@ -1406,6 +2132,13 @@ def check_accountingcost():
         six.print_(' * convert costaccounting: nb=%d' % entryline_cmp)
 
 
+def post_delete_entrylineaccount(sender, instance, **kwargs):
+    entry_state = EntryAccount.objects.filter(id=instance.entry_id).values_list('close', 'journal_id').first()
+    if entry_state is None:
+        entry_state = (False, 0)
+    ChartsAccountBalance.add_amount(instance.account_id, -1 * instance.amount, entry_state[0], entry_state[1])
+
+
 def pre_save_datadb(sender, **kwargs):
     if (sender == EntryAccount) and ('instance' in kwargs):
         if kwargs['instance'].costaccounting_id == 0:
@@ -1426,3 +2159,4 @@ def accounting_checkparam():
 
 
 pre_save.connect(pre_save_datadb)
+post_delete.connect(post_delete_entrylineaccount, sender=EntryLineAccount)
@@ -20,6 +20,7 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 from __future__ import unicode_literals
 import re
+from functools import lru_cache
 
 from django.utils import six
 
@@ -949,14 +950,48 @@ GENERAL_CHARTS_ACCOUNT = [
     ("794", "Intervention d'associés (ou du propriétaire) dans la perte", 3)]
 
 
+def _build_charts_tree():
+    charts_tree = {}
+    for chart_idx, chart_item in enumerate(GENERAL_CHARTS_ACCOUNT):
+        tree_node = charts_tree
+        for code_char in chart_item[0]:
+            tree_node = tree_node.setdefault(code_char, {})
+        tree_node.setdefault('', []).append(chart_idx)
+    return charts_tree
+
+
+CHARTS_TREE = _build_charts_tree()
+
+
 def find_charts(code):
-    current_charts = None
-    for chart_item in GENERAL_CHARTS_ACCOUNT:
-        if code[:len(chart_item[0])] == chart_item[0]:
-            current_charts = chart_item
-        elif current_charts is not None:
+    chart_indexes = list(CHARTS_TREE.get('', []))
+    tree_node = CHARTS_TREE
+    for code_char in code:
+        tree_node = tree_node.get(code_char)
+        if tree_node is None:
+            break
+        chart_indexes.extend(tree_node.get('', []))
+    if len(chart_indexes) == 0:
+        return None
+    chart_indexes.sort()
+    last_idx = chart_indexes[0]
+    for chart_idx in chart_indexes[1:]:
+        if chart_idx != last_idx + 1:
             break
-    return current_charts
+        last_idx = chart_idx
+    return GENERAL_CHARTS_ACCOUNT[last_idx]
+
+
+GENERAL_PATTERN = re.compile(GENERAL_MASK)
+
+
+@lru_cache(maxsize=4096)
+def get_charts_description(code):
+    if GENERAL_PATTERN.match(code):
+        current_charts = find_charts(code)
+        if current_charts is not None:
+            return current_charts[1], current_charts[2]
+    return '', -2
 
 
 class BelgiumSystemAcounting(DefaultSystemAccounting):
@@ -1004,12 +1039,7 @@ class BelgiumSystemAcounting(DefaultSystemAccounting):
         code = code.strip()
         if code == '':
             return '', -1
-        pattern = re.compile(GENERAL_MASK)
-        if pattern.match(code):
-            current_charts = find_charts(code)
-            if current_charts is not None:
-                return current_charts[1], current_charts[2]
-        return '', -2
-
-    def get_export_xmlfiles(self):
+        return get_charts_description(code)
+
+    def get_export_xsdfile(self):
         return None
@@ -179,7 +179,7 @@ class DefaultSystemAccounting(object):
         sum_third = {}
         entry_lines = []
         end_desig = _("Fiscal year closing - Third")
-        for data_line in EntryLineAccount.objects.filter(account__code__regex=self.get_third_mask(), account__year=year).values('account', 'third').annotate(data_sum=Sum('amount')):
+        for data_line in EntryLineAccount.objects.filter(account__is_third=True, account__year=year).values('account', 'third').annotate(data_sum=Sum('amount')):
             if abs(data_line['data_sum']) > 0.0001:
                 entry_lines.append((data_line['data_sum'], data_line['account'], data_line['third']))
                 if data_line['account'] not in sum_third.keys():
@@ -187,21 +187,12 @@ class DefaultSystemAccounting(object):
                 sum_third[data_line['account']] += data_line['data_sum']
         if len(sum_third) > 0:
             new_entry = EntryAccount.objects.create(year=year, journal_id=5, designation=end_desig, date_value=year.end)
+            new_lines = []
             for entry_line in entry_lines:
-                new_line = EntryLineAccount()
-                new_line.entry = new_entry
-                new_line.amount = -1 * entry_line[0]
-                new_line.account_id = entry_line[1]
-                if entry_line[2] is not None:
-                    new_line.third_id = entry_line[2]
-                new_line.save()
+                new_lines.append(EntryLineAccount(entry=new_entry, amount=-1 * entry_line[0], account_id=entry_line[1], third_id=entry_line[2]))
             for account_id, value in sum_third.items():
-                new_line = EntryLineAccount()
-                new_line.entry = new_entry
-                new_line.account_id = account_id
-                new_line.amount = value
-                new_line.third = None
-                new_line.save()
+                new_lines.append(EntryLineAccount(entry=new_entry, amount=value, account_id=account_id, third=None))
+            EntryLineAccount.objects.bulk_create(new_lines)
             new_entry.closed()
 
     def finalize_year(self, year):
@@ -210,25 +201,28 @@ class DefaultSystemAccounting(object):
         return
 
     def _create_report_lastyearresult(self, year, import_result):
-        from diacamma.accounting.models import EntryAccount
+        from diacamma.accounting.models import EntryAccount, EntryLineAccount
         end_desig = _("Retained earnings - Balance sheet")
         new_entry = EntryAccount.objects.create(year=year, journal_id=1, designation=end_desig, date_value=year.begin)
-        for charts_account in year.last_fiscalyear.chartsaccount_set.filter(type_of_account__in=(0, 1, 2)):
-            code = charts_account.code
-            name = charts_account.name
-            new_entry.add_entry_line(charts_account.get_current_validated(), code, name)
+        last_charts = [(code, name, validated) for code, name, validated in year.last_fiscalyear.chartsaccount_set.filter(type_of_account__in=(0, 1, 2)).values_list('code', 'name', 'balance__validated')
+                       if (validated is not None) and (abs(validated) > 0.0001)]
+        chart_map = year.get_chartaccount_map([(code, name) for code, name, _validated in last_charts])
+        EntryLineAccount.objects.bulk_create([EntryLineAccount(entry=new_entry, account=chart_map[code], amount=validated) for code, _name, validated in last_charts])
         new_entry.closed()
 
     def _create_report_third(self, year):
-        from diacamma.accounting.models import EntryAccount
+        from diacamma.accounting.models import EntryAccount, EntryLineAccount
         last_entry_account = list(year.last_fiscalyear.entryaccount_set.filter(journal__id=5).order_by('num'))[-1]
         _no_change, debit_rest, credit_rest = last_entry_account.serial_control(last_entry_account.get_serial())
         if abs(debit_rest - credit_rest) < 0.0001:
             end_desig = _("Retained earnings - Third party debt")
             new_entry = EntryAccount.objects.create(year=year, journal_id=1, designation=end_desig, date_value=year.begin)
-            for entry_line in last_entry_account.entrylineaccount_set.all():
-                if re.match(self.get_general_mask(), entry_line.account.code):
-                    new_entry.add_entry_line(-1 * entry_line.amount, entry_line.account.code, entry_line.account.name, entry_line.third)
+            general_mask = re.compile(self.get_general_mask())
+            last_lines = [(code, name, amount, third_id) for code, name, amount, third_id in last_entry_account.entrylineaccount_set.values_list('account__code', 'account__name', 'amount', 'third_id')
+                          if (general_mask.match(code) is not None) and (abs(amount) > 0.0001)]
+            chart_map = year.get_chartaccount_map(set([(code, name) for code, name, _amount, _third_id in last_lines]))
+            EntryLineAccount.objects.bulk_create([EntryLineAccount(entry=new_entry, account=chart_map[code], amount=-1 * amount, third_id=third_id)
+                                                  for code, _name, amount, third_id in last_lines])
             new_entry.closed()
 
     def import_lastyear(self, year, import_result):
@@ -236,69 +230,43 @@ class DefaultSystemAccounting(object):
         self._create_report_third(year)
         return
 
+    def _fill_balancesheet_section(self, grid, line_idx, side, title, data_line, total1, total2):
+        from diacamma.accounting.tools_reports import add_cell_in_grid, add_item_in_grid, fill_grid, get_spaces
+        if len(data_line) > 0:
+            add_cell_in_grid(grid, line_idx, side, get_spaces(5) + "{[i]}%s{[/i]}" % title)
+            line_idx += 1
+            line_idx = fill_grid(grid, line_idx, side, data_line)
+            add_item_in_grid(grid, line_idx, side, (get_spaces(10) + "%s" % _('Sub-total'), total1, total2, None), "{[i]}%s{[/i]}")
+            line_idx += 1
+            add_cell_in_grid(grid, line_idx, side, '')
+            line_idx += 1
+        return line_idx
+
     def fill_fiscalyear_balancesheet(self, grid, currentfilter, lastfilter):
-        from django.db.models import Q
-        from diacamma.accounting.tools_reports import convert_query_to_account, add_cell_in_grid, add_item_in_grid, fill_grid, get_spaces
+        from diacamma.accounting.tools_reports import get_grouped_sums, convert_sums_to_account, add_cell_in_grid, add_item_in_grid, get_spaces
         from diacamma.accounting.tools import format_devise
-        cash_filter = Q(account__code__regex=self.get_cash_mask())
-        third_filter = Q(account__code__regex=self.get_third_mask())
+        if lastfilter is not None:
+            data_lines, accounts, _thirds = get_grouped_sums([currentfilter, lastfilter])
+        else:
+            data_lines, accounts, _thirds = get_grouped_sums([currentfilter])
+        with_last = lastfilter is not None
 
         left_line_idx = 0
-        actif1 = Q(account__type_of_account=0) & ~cash_filter & ~third_filter
-        data_line_left, total1_lefta, total2_lefta, _b_left = convert_query_to_account(currentfilter & actif1, lastfilter & actif1 if lastfilter is not None else None, None)
-        if len(data_line_left) > 0:
-            add_cell_in_grid(grid, left_line_idx, 'left', get_spaces(5) + "{[i]}%s{[/i]}" % _('immobilizations & stock'))
-            left_line_idx += 1
-            left_line_idx = fill_grid(grid, left_line_idx, 'left', data_line_left)
-            add_item_in_grid(grid, left_line_idx, 'left', (get_spaces(10) + "%s" % _('Sub-total'), total1_lefta, total2_lefta, None), "{[i]}%s{[/i]}")
-            left_line_idx += 1
-            add_cell_in_grid(grid, left_line_idx, 'left', '')
-            left_line_idx += 1
-
-        actif2 = third_filter
-        data_line_left, total1_leftb, total2_leftb, _b_left = convert_query_to_account(currentfilter & actif2, lastfilter & actif2 if lastfilter is not None else None, None, sign_value=-1)
-        if len(data_line_left) > 0:
-            add_cell_in_grid(grid, left_line_idx, 'left', get_spaces(5) + "{[i]}%s{[/i]}" % _('receivables'))
-            left_line_idx += 1
-            left_line_idx = fill_grid(grid, left_line_idx, 'left', data_line_left)
-            add_item_in_grid(grid, left_line_idx, 'left', (get_spaces(10) + "%s" % _('Sub-total'), total1_leftb, total2_leftb, None), "{[i]}%s{[/i]}")
-            left_line_idx += 1
-            add_cell_in_grid(grid, left_line_idx, 'left', '')
-            left_line_idx += 1
-
-        actif3 = Q(account__type_of_account=0) & cash_filter
-        data_line_left, total1_leftc, total2_leftc, _b_left = convert_query_to_account(currentfilter & actif3, lastfilter & actif3 if lastfilter is not None else None, None)
-        if len(data_line_left) > 0:
-            add_cell_in_grid(grid, left_line_idx, 'left', get_spaces(5) + "{[i]}%s{[/i]}" % _('values & availabilities'))
-            left_line_idx += 1
-            left_line_idx = fill_grid(grid, left_line_idx, 'left', data_line_left)
-            add_item_in_grid(grid, left_line_idx, 'left', (get_spaces(10) + "%s" % _('Sub-total'), total1_leftc, total2_leftc, None), "{[i]}%s{[/i]}")
-            left_line_idx += 1
-            add_cell_in_grid(grid, left_line_idx, 'left', '')
-            left_line_idx += 1
+        data_line_left, total1_lefta, total2_lefta = convert_sums_to_account(data_lines, accounts, with_last,
+                                                                             account_filter=lambda account: (account.type_of_account == 0) and not account.is_cash and not account.is_third)
+        left_line_idx = self._fill_balancesheet_section(grid, left_line_idx, 'left', _('immobilizations & stock'), data_line_left, total1_lefta, total2_lefta)
+        data_line_left, total1_leftb, total2_leftb = convert_sums_to_account(data_lines, accounts, with_last, sign_value=-1, account_filter=lambda account: account.is_third)
+        left_line_idx = self._fill_balancesheet_section(grid, left_line_idx, 'left', _('receivables'), data_line_left, total1_leftb, total2_leftb)
+        data_line_left, total1_leftc, total2_leftc = convert_sums_to_account(data_lines, accounts, with_last,
+                                                                             account_filter=lambda account: (account.type_of_account == 0) and account.is_cash)
+        left_line_idx = self._fill_balancesheet_section(grid, left_line_idx, 'left', _('values & availabilities'), data_line_left, total1_leftc, total2_leftc)
 
         right_line_idx = 0
-        passif1 = Q(account__type_of_account=2)
-        data_line_right, total1_righta, total2_righta, _b_right = convert_query_to_account(currentfilter & passif1, lastfilter & passif1 if lastfilter is not None else None, None)
-        if len(data_line_right) > 0:
-            add_cell_in_grid(grid, right_line_idx, 'right', get_spaces(5) + "{[i]}%s{[/i]}" % _('capital'))
-            right_line_idx += 1
-            right_line_idx = fill_grid(grid, right_line_idx, 'right', data_line_right)
-            add_item_in_grid(grid, right_line_idx, 'right', (get_spaces(10) + "%s" % _('Sub-total'), total1_righta, total2_righta, None), "{[i]}%s{[/i]}")
-            right_line_idx += 1
-            add_cell_in_grid(grid, right_line_idx, 'right', '')
-            right_line_idx += 1
-
-        passif2 = third_filter
-        data_line_right, total1_rightb, total2_rightb, _b_right = convert_query_to_account(currentfilter & passif2, lastfilter & passif2 if lastfilter is not None else None, None, sign_value=1)
-        if len(data_line_right) > 0:
-            add_cell_in_grid(grid, right_line_idx, 'right', get_spaces(5) + "{[i]}%s{[/i]}" % _('liabilities'))
-            right_line_idx += 1
-            right_line_idx = fill_grid(grid, right_line_idx, 'right', data_line_right)
-            add_item_in_grid(grid, right_line_idx, 'right', (get_spaces(10) + "%s" % _('Sub-total'), total1_rightb, total2_rightb, None), "{[i]}%s{[/i]}")
-            right_line_idx += 1
-            add_cell_in_grid(grid, right_line_idx, 'right', '')
-            right_line_idx += 1
+        data_line_right, total1_righta, total2_righta = convert_sums_to_account(data_lines, accounts, with_last,
+                                                                                account_filter=lambda account: account.type_of_account == 2)
+        right_line_idx = self._fill_balancesheet_section(grid, right_line_idx, 'right', _('capital'), data_line_right, total1_righta, total2_righta)
+        data_line_right, total1_rightb, total2_rightb = convert_sums_to_account(data_lines, accounts, with_last, sign_value=1, account_filter=lambda account: account.is_third)
+        right_line_idx = self._fill_balancesheet_section(grid, right_line_idx, 'right', _('liabilities'), data_line_right, total1_rightb, total2_rightb)
 
         total1left = total1_lefta + total1_leftb + total1_leftc
         total1right = total1_righta + total1_rightb
@@ -328,5 +296,5 @@ class DefaultSystemAccounting(object):
         if show_right:
             add_cell_in_grid(grid, line_idx, 'right', get_spaces(5) + "{[i]}{[b]}%s{[/b]}{[/i]}" % _('result (profit)'))
 
-    def get_export_xmlfiles(self):
+    def get_export_xsdfile(self):
         return None
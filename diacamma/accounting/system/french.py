@@ -19,6 +19,8 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 from __future__ import unicode_literals
 import re
+from bisect import bisect_left
+from functools import lru_cache
 
 from diacamma.accounting.system.default import DefaultSystemAccounting
 from os.path import dirname, join
@@ -219,13 +221,44 @@ GENERAL_CHARTS_ACCOUNT = [
     ("89", "89999999", "Bilan", 5)]
 
 
-def find_charts(code):
-    current_charts = None
+def _get_first_charts(is_covered):
     for chart_item in GENERAL_CHARTS_ACCOUNT:
-        if (chart_item[0] <= code) and (code <= chart_item[1]):
-            current_charts = chart_item
-            break
-    return current_charts
+        if is_covered(chart_item):
+            return chart_item
+    return None
+
+
+def _build_charts_index():
+    bounds = sorted(set([chart_item[0] for chart_item in GENERAL_CHARTS_ACCOUNT] + [chart_item[1] for chart_item in GENERAL_CHARTS_ACCOUNT]))
+    bound_charts = [_get_first_charts(lambda chart_item: (chart_item[0] <= bound) and (bound <= chart_item[1])) for bound in bounds]
+    between_charts = [None] + [_get_first_charts(lambda chart_item: (chart_item[0] <= bounds[bound_idx - 1]) and (bounds[bound_idx] <= chart_item[1]))
+                               for bound_idx in range(1, len(bounds))]
+    return bounds, bound_charts, between_charts
+
+
+CHARTS_INDEX = _build_charts_index()
+
+
+def find_charts(code):
+    bounds, bound_charts, between_charts = CHARTS_INDEX
+    bound_idx = bisect_left(bounds, code)
+    if bound_idx == len(bounds):
+        return None
+    if bounds[bound_idx] == code:
+        return bound_charts[bound_idx]
+    return between_charts[bound_idx]
+
+
+GENERAL_PATTERN = re.compile(GENERAL_MASK)
+
+
+@lru_cache(maxsize=4096)
+def get_charts_description(code):
+    if GENERAL_PATTERN.match(code):
+        current_charts = find_charts(code)
+        if current_charts is not None:
+            return current_charts[2], current_charts[3]
+    return '', -2
 
 
 class FrenchSystemAcounting(DefaultSystemAccounting):
@@ -270,13 +303,7 @@ class FrenchSystemAcounting(DefaultSystemAccounting):
         code = code.strip()
         if code == '':
             return '', -1
-        pattern = re.compile(GENERAL_MASK)
-        if pattern.match(code):
-            current_charts = find_charts(code)
-            if current_charts is not None:
-                return current_charts[2], current_charts[3]
-        return '', -2
-
-    def get_export_xmlfiles(self):
-        file_path = dirname(__file__)
-        return (join(file_path, 'french_accountexport.xml'), join(file_path, 'french_fichedescriptive_6709.xsd'))
+        return get_charts_description(code)
+
+    def get_export_xsdfile(self):
+        return join(dirname(__file__), 'french_fichedescriptive_6709.xsd')
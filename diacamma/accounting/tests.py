@@ -27,6 +27,9 @@ from shutil import rmtree
 from datetime import date, timedelta
 from base64 import b64decode
 from django.utils import six
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
 
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
 from lucterios.framework.test import LucteriosTest
@@ -40,10 +43,12 @@ from diacamma.accounting.views_other import ModelEntryList, ModelEntryAddModify,
 from diacamma.accounting.test_tools import initial_contacts, fill_entries_fr, initial_thirds_fr, create_third, fill_accounts_fr, fill_thirds_fr, default_compta_fr, set_accounting_system, add_models
 from diacamma.accounting.models import FiscalYear, Third
 from diacamma.accounting.system import get_accounting_system, accounting_system_ident
-from diacamma.accounting.tools import current_system_account, clear_system_account
+from diacamma.accounting.tools import current_system_account, clear_system_account, format_devise, currency_round, get_currency_formatter,\
+    format_devise_list
 from diacamma.accounting.views_entries import EntryAccountModelSelector
 from lucterios.CORE.parameters import Params
 from lucterios.contacts.models import CustomField
+from lucterios.CORE.models import Parameter
 
 
 class ThirdTest(LucteriosTest):
@@ -439,6 +444,35 @@ class ThirdTest(LucteriosTest):
         self.assert_json_equal('', 'third/@2/accountthird_set', '411{[br/]}401')
         self.assert_json_equal('', 'third/@2/total', '-34.01€')
 
+        third_list = ThirdList()
+        third_list.params = {'show_filter': 0}
+        third_list.filter = Q(status=0)
+        items = third_list.get_items_from_filter()
+        self.assertEqual(len(items), 7)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sorted([round(third.get_total(), 2) for third in items]), [-125.97, -34.01, 0.0, 0.0, 0.0, 0.0, 78.24])
+        self.assertEqual(len(queries), 0)
+
+    def test_third_totals(self):
+        fill_thirds_fr()
+        default_compta_fr()
+        fill_entries_fr(1)
+        totals = Third.get_totals()
+        self.assertAlmostEqual(0.0, totals[1], delta=0.0001)
+        self.assertAlmostEqual(78.24, totals[2], delta=0.0001)
+        self.assertAlmostEqual(-34.01, totals[4], delta=0.0001)
+        self.assertAlmostEqual(-125.97, totals[5], delta=0.0001)
+        self.assertAlmostEqual(0.0, totals[7], delta=0.0001)
+        totals = Third.get_totals([1, 7], date(2015, 2, 21))
+        self.assertAlmostEqual(0.0, totals[1], delta=0.0001)
+        self.assertAlmostEqual(-70.64, totals[7], delta=0.0001)
+        totals = Third.get_totals([7], date(2015, 2, 21), False)
+        self.assertEqual({}, totals)
+        third_list = Third.annotate_total(Third.objects.filter(id__in=(3, 4, 5))).order_by('id')
+        self.assertEqual([0.0, -34.01], [round(third.total_amount, 2) for third in third_list][:2])
+        self.assertEqual('-125.97€', third_list[2].total)
+        self.assertAlmostEqual(194.08, Third.objects.get(id=1).get_total(date(2015, 2, 16)), delta=0.0001)
+
     def test_listing(self):
         fill_thirds_fr()
         default_compta_fr()
@@ -819,6 +853,27 @@ class AdminTest(LucteriosTest):
         set_accounting_system()
         self.assertEqual(current_system_account().__class__.__name__, "FrenchSystemAcounting")
 
+    def test_params_snapshot(self):
+        self.assertEqual(format_devise(-25.456, 1), 'Débit: 25.46€')
+        self.assertEqual(format_devise(25.456, 6), '{[font color="green"]}25.46€{[/font]}')
+        self.assertEqual(currency_round(25.456), 25.46)
+        currency_formatter = get_currency_formatter()
+        self.assertIs(get_currency_formatter(), currency_formatter)
+        Parameter.change_value('accounting-devise-prec', 3)
+        self.assertEqual(currency_round(25.4567), 25.46)
+        Params.clear()
+        self.assertEqual(currency_round(25.4567), 25.457)
+        self.assertEqual(format_devise(25.4567, 5), '25.457€')
+        self.assertIsNot(get_currency_formatter(), currency_formatter)
+
+    def test_format_devise_list(self):
+        amounts = [25.456, -25.456, 0.0001, None]
+        for mode in range(7):
+            self.assertEqual(format_devise_list(amounts, mode), [format_devise(amount, mode) for amount in amounts])
+        self.assertEqual(format_devise_list(amounts, 2), ['{[font color="green"]}Crédit: 25.46€{[/font]}', '{[font color="blue"]}Débit: 25.46€{[/font]}',
+                                                          '{[font color="green"]}Crédit: 0.00€{[/font]}', '{[font color="green"]}Crédit: 0.00€{[/font]}'])
+        self.assertEqual(format_devise_list(amounts, 0), ['25.46€', '', '', ''])
+
     def test_configuration_customfield(self):
         self.factory.xfer = Configuration()
         self.calljson('/diacamma.accounting/configuration', {}, False)
@@ -23,6 +23,10 @@ from importlib import import_module
 from base64 import b64decode
 
 from django.utils import six
+from django.db import connection
+from django.db.models import Q
+from django.db.models.aggregates import Sum
+from django.test.utils import CaptureQueriesContext
 
 from lucterios.framework.test import LucteriosTest
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
@@ -32,7 +36,7 @@ from diacamma.accounting.test_tools import initial_thirds_fr, default_compta_fr,
 from diacamma.accounting.views_accounts import ChartsAccountList, ChartsAccountDel, ChartsAccountShow, ChartsAccountAddModify, ChartsAccountListing, ChartsAccountImportFiscalYear
 from diacamma.accounting.views_accounts import FiscalYearBegin, FiscalYearClose, FiscalYearReportLastYear
 from diacamma.accounting.views_entries import EntryAccountEdit, EntryAccountList
-from diacamma.accounting.models import FiscalYear
+from diacamma.accounting.models import FiscalYear, ChartsAccount, ChartsAccountBalance, EntryAccount, EntryLineAccount, Third, Budget, BudgetEngine
 from diacamma.accounting.views import ThirdList
 from diacamma.accounting.views_budget import BudgetList, BudgetAddModify, BudgetDel
 from diacamma.payoff.test_tools import PaymentTest
@@ -300,6 +304,21 @@ class ChartsAccountTest(LucteriosTest):
         content_csv = csv_value.split('\n')
         self.assertEqual(len(content_csv), 12, str(content_csv))
 
+    def test_classification(self):
+        self.assertEqual(sorted(ChartsAccount.objects.filter(year_id=1, is_cash=True).values_list('code', flat=True)), ['512', '531'])
+        self.assertEqual(sorted(ChartsAccount.objects.filter(year_id=1, is_third=True).values_list('code', flat=True)), ['401', '411'])
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_customer=True).values_list('code', flat=True)), ['411'])
+        self.assertEqual(list(ChartsAccount.objects.filter(year_id=1, is_provider=True).values_list('code', flat=True)), ['401'])
+        self.assertEqual(sorted(ChartsAccount.objects.filter(year_id=1, is_revenue=True).values_list('code', flat=True)), ['701', '706', '707'])
+        self.assertEqual(ChartsAccount.objects.filter(year_id=1, is_expense=True).count(), 5)
+        ChartsAccount.objects.filter(year_id=1).update(is_cash=False, is_third=True)
+        set_accounting_system()
+        self.assertEqual(sorted(ChartsAccount.objects.filter(year_id=1, is_cash=True).values_list('code', flat=True)), ['512', '531'])
+        self.assertEqual(sorted(ChartsAccount.objects.filter(year_id=1, is_third=True).values_list('code', flat=True)), ['401', '411'])
+        chart = ChartsAccount.objects.create(year_id=1, code='5300', name='caisse', type_of_account=0)
+        self.assertTrue(chart.is_cash)
+        self.assertFalse(chart.is_third)
+
     def test_budget(self):
         self.factory.xfer = BudgetList()
         self.calljson('/diacamma.accounting/budgetList', {'year': '1'}, False)
@@ -379,6 +398,35 @@ class ChartsAccountTest(LucteriosTest):
         self.assert_count_equal('#budget_expense/actions', 0)
         self.assert_json_equal('LABELFORM', 'result', '70.78€')
 
+    def test_budget_engine(self):
+        Budget.objects.bulk_create([Budget(year_id=1, code='6%02d1' % code_idx, amount=1.0 + code_idx) for code_idx in range(60)])
+        Budget.objects.bulk_create([Budget(year_id=1, code='860', amount=50.0), Budget(year_id=1, code='860', amount=-20.0), Budget(year_id=1, code='860', amount=-10.0)])
+        budget_engine = BudgetEngine(Q(year_id=1))
+        with CaptureQueriesContext(connection) as queries:
+            expense_lines = budget_engine.get_lines(False)
+            revenue_lines = budget_engine.get_lines(True)
+            total = budget_engine.get_total()
+        self.assertLess(len(queries), 10)
+        self.assertEqual(len(expense_lines), 64)
+        self.assertEqual(len(revenue_lines), 3)
+        expense_values = dict((line_id, (chart, value)) for line_id, chart, value in expense_lines)
+        revenue_values = dict((line_id, (chart, value)) for line_id, chart, value in revenue_lines)
+        self.assertEqual(six.text_type(expense_values['C601'][0]), '[601] 601')
+        self.assertAlmostEqual(expense_values['C601'][1], -8.19, delta=0.0001)
+        self.assertAlmostEqual(expense_values['C860'][1], -30.0, delta=0.0001)
+        self.assertAlmostEqual(revenue_values['C860'][1], 50.0, delta=0.0001)
+        revenue_total = Budget.objects.filter(year_id=1, code__startswith='7').aggregate(Sum('amount'))['amount__sum']
+        expense_total = Budget.objects.filter(year_id=1, code__startswith='6').aggregate(Sum('amount'))['amount__sum']
+        self.assertAlmostEqual(total, revenue_total - expense_total, delta=0.0001)
+        self.assertAlmostEqual(total, 169.56 - 1830.0, delta=0.0001)
+
+        self.factory.xfer = BudgetList()
+        self.calljson('/diacamma.accounting/budgetList', {'year': '1'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'budgetList')
+        self.assert_count_equal('budget_expense', 64)
+        self.assert_count_equal('budget_revenue', 3)
+        self.assert_json_equal('LABELFORM', 'result', '-1660.44€')
+
 
 class FiscalYearWorkflowTest(PaymentTest):
 
@@ -643,6 +691,53 @@ class FiscalYearWorkflowTest(PaymentTest):
         self.assert_json_equal('', 'chartsaccount/@6/current_total',
                                '{[font color="blue"]}Débit: 125.97€{[/font]}')
 
+    def test_close_large_year(self):
+        FiscalYear.objects.filter(id=1).update(status=1)
+        year = FiscalYear.objects.get(id=1)
+        FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear=year)
+        third_ids = list(Third.objects.values_list('id', flat=True))
+        entry_ids = []
+        new_lines = []
+        for entry_idx in range(200):
+            new_entry = EntryAccount.objects.create(year=year, journal_id=3, date_value='2015-03-01', designation='vente %d' % entry_idx)
+            entry_ids.append(new_entry.id)
+            new_lines.append(EntryLineAccount(entry=new_entry, account_id=1, third_id=third_ids[entry_idx % len(third_ids)], amount=10.0 + entry_idx))
+            new_lines.append(EntryLineAccount(entry=new_entry, account_id=10, amount=10.0 + entry_idx))
+        EntryLineAccount.objects.bulk_create(new_lines)
+        ChartsAccountBalance.rebuild(year)
+        EntryAccount.close_entries(entry_ids[:100])
+        nb_entry_noclose = year.check_to_close()
+        with CaptureQueriesContext(connection) as queries:
+            year.closed()
+        self.assertLess(len(queries), 100)
+        self.assertEqual(FiscalYear.objects.get(id=1).status, 2)
+        self.assertEqual(EntryAccount.objects.filter(year_id=2).count(), nb_entry_noclose)
+        self.assertEqual(EntryAccount.objects.filter(id__in=entry_ids[100:], year_id=2, date_value='2016-01-01').count(), 100)
+        self.assertEqual(EntryLineAccount.objects.filter(entry__year_id=2, account__year_id=2).count(), EntryLineAccount.objects.filter(entry__year_id=2).count())
+        self.assertEqual(EntryLineAccount.objects.filter(entry__year_id=1, entry__close=False).count(), 0)
+        third_total = EntryLineAccount.objects.filter(account__year_id=1, account__is_third=True, third__isnull=False).aggregate(Sum('amount'))['amount__sum']
+        self.assertAlmostEqual(third_total, 0.0, delta=0.0001)
+        account_total = EntryLineAccount.objects.filter(account__year_id=1, account__code='411').aggregate(Sum('amount'))['amount__sum']
+        self.assertAlmostEqual(ChartsAccount.objects.get(year_id=1, code='411').get_current_total(), account_total, delta=0.0001)
+
+    def test_import_large_charts(self):
+        year = FiscalYear.objects.get(id=1)
+        new_year = FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear=year)
+        self.assertEqual(ChartsAccount.create_accounts(year, [('6%04d1' % code_idx, 'charge %d' % code_idx, 4) for code_idx in range(1000, 4000)]), 3000)
+        self.assertEqual(ChartsAccount.create_accounts(year, [('610001', 'doublon', 4), ('60800', 'frais', None), ('ZZZ', 'invalide', None)]), 1)
+        self.assertEqual(ChartsAccount.objects.get(year=year, code='608').type_of_account, 4)
+        self.assertEqual(ChartsAccount.objects.filter(year=year).count(), 3018)
+        with CaptureQueriesContext(connection) as queries:
+            new_year.import_charts_accounts()
+        self.assertLess(len(queries), 100)
+        self.assertEqual(ChartsAccount.objects.filter(year=new_year).count(), 3018)
+        self.assertEqual(ChartsAccountBalance.objects.filter(account__year=new_year).count(), 3018)
+        self.assertEqual(ChartsAccount.objects.filter(year=new_year, is_expense=True).count(), ChartsAccount.objects.filter(year=year, is_expense=True).count())
+        self.assertEqual(ChartsAccount.objects.filter(year=new_year, is_third=True).count(), ChartsAccount.objects.filter(year=year, is_third=True).count())
+        self.assertEqual(ChartsAccount.objects.filter(year=year, is_expense=True).count(), 3006)
+        new_year.import_charts_accounts()
+        self.assertEqual(ChartsAccount.objects.filter(year=new_year).count(), 3018)
+
     def test_import_lastyear(self):
         FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0,
                                   last_fiscalyear=FiscalYear.objects.get(id=1))
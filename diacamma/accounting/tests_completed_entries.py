@@ -30,8 +30,13 @@ from datetime import date
 
 from django.utils import six, formats
 from django.db.models import Q
+from django.db.models.aggregates import Sum, Max
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from lucterios.framework.test import LucteriosTest
+from lucterios.framework.error import LucteriosException
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
 from lucterios.framework.filetools import get_user_dir, get_user_path
 from lucterios.CORE.models import Parameter
@@ -40,15 +45,15 @@ from lucterios.CORE.views import StatusMenu
 from lucterios.contacts.models import CustomField
 
 from diacamma.accounting.views_entries import EntryAccountList, EntryAccountListing, EntryAccountEdit, EntryAccountShow, \
-    EntryAccountClose, EntryAccountCostAccounting, EntryAccountSearch
+    EntryAccountClose, EntryAccountCostAccounting, EntryAccountSearch, EntryAccountAutoLink
 from diacamma.accounting.test_tools import default_compta_fr, initial_thirds_fr, fill_entries_fr, add_entry
-from diacamma.accounting.views_other import CostAccountingList, CostAccountingClose, CostAccountingAddModify
+from diacamma.accounting.views_other import CostAccountingList, CostAccountingClose, CostAccountingAddModify, CostAccountingReportByDate
 from diacamma.accounting.views_reports import FiscalYearBalanceSheet, FiscalYearIncomeStatement, FiscalYearLedger, FiscalYearTrialBalance,\
     CostAccountingTrialBalance, CostAccountingLedger, CostAccountingIncomeStatement,\
-    FiscalYearReportPrint
+    FiscalYearReportPrint, FiscalYearLedgerExport
 from diacamma.accounting.views_admin import FiscalYearExport
-from diacamma.accounting.models import FiscalYear, Third
-from diacamma.accounting.tools_reports import get_totalaccount_for_query, get_totalbudget_for_query
+from diacamma.accounting.models import FiscalYear, Third, ChartsAccount, ChartsAccountBalance, EntryAccount, AccountLink, NumberSequence, Budget, CostAccounting
+from diacamma.accounting.tools_reports import get_totalaccount_for_query, get_totalbudget_for_query, get_totalaccount_for_queries
 from diacamma.accounting.views_budget import BudgetList, BudgetAddModify, BudgetDel, BudgetImport
 
 
@@ -307,6 +312,188 @@ class CompletedEntryTest(LucteriosTest):
         self.assertAlmostEqual(6.24, values['604'][0], delta=0.0001)
         self.assertEqual('[604] 604', values['604'][1])
 
+        (values1, total1), (values2, total2) = get_totalaccount_for_queries([Q(account__type_of_account=0) & Q(entry__year_id=1),
+                                                                             Q(account__type_of_account=3) & Q(entry__year_id=1)])
+        self.assertAlmostEqual(1050.66 + 159.98, total1, delta=0.0001)
+        self.assertEqual(3, len(values1), values1)
+        self.assertAlmostEqual(-79.63, values1['531'][0], delta=0.0001)
+        self.assertAlmostEqual(230.62, total2, delta=0.0001)
+        self.assertEqual(1, len(values2), values2)
+        self.assertAlmostEqual(230.62, values2['707'][0], delta=0.0001)
+
+    def _check_account_balances(self):
+        for chart in ChartsAccount.objects.filter(year_id=1):
+            chart = ChartsAccount.objects.get(id=chart.id)
+            self.assertAlmostEqual(chart.entrylineaccount_set.aggregate(Sum('amount'))['amount__sum'] or 0.0, chart.get_current_total(), msg=chart.code, delta=0.0001)
+            self.assertAlmostEqual(chart.entrylineaccount_set.filter(entry__close=True).aggregate(Sum('amount'))['amount__sum'] or 0.0, chart.get_current_validated(), msg=chart.code, delta=0.0001)
+            self.assertAlmostEqual(chart.entrylineaccount_set.filter(entry__journal_id=1).aggregate(Sum('amount'))['amount__sum'] or 0.0, chart.get_last_year_total(), msg=chart.code, delta=0.0001)
+
+    def test_account_balance(self):
+        self._check_account_balances()
+        self.assertAlmostEqual(1130.29, ChartsAccount.objects.get(year_id=1, code='512').get_current_total(), delta=0.0001)
+        for entry in EntryAccount.objects.filter(year_id=1, close=False):
+            entry.closed()
+        self._check_account_balances()
+        EntryAccount.objects.filter(year_id=1, journal_id=4).delete()
+        self._check_account_balances()
+        ChartsAccountBalance.objects.filter(account__year_id=1).update(total=0.0, validated=0.0, last_year=0.0)
+        call_command('rebuild_accountbalance', year=1, stdout=six.StringIO())
+        self._check_account_balances()
+
+    def test_close_entries(self):
+        self.assertEqual(EntryAccount.objects.filter(year_id=1, close=True).aggregate(Max('num'))['num__max'], 8)
+        unbalanced = add_entry(1, 5, '2015-02-25', 'unbalanced', '-1|2|0|10.000000|0|None|\n-2|3|0|12.000000|0|None|')
+        open_ids = list(EntryAccount.objects.filter(year_id=1, close=False).order_by('date_value', 'id').values_list('id', flat=True))
+        with self.assertRaises(LucteriosException):
+            EntryAccount.close_entries(open_ids)
+        self.assertEqual(EntryAccount.objects.filter(year_id=1, close=False).count(), len(open_ids))
+        open_ids.remove(unbalanced.id)
+        unbalanced.delete()
+        self.assertEqual(EntryAccount.close_entries(open_ids), len(open_ids))
+        self.assertEqual(EntryAccount.close_entries(open_ids), 0)
+        self.assertEqual(list(EntryAccount.objects.filter(id__in=open_ids).order_by('date_value', 'id').values_list('num', flat=True)), list(range(9, 9 + len(open_ids))))
+        self.assertEqual(EntryAccount.objects.filter(year_id=1, close=False).count(), 0)
+        self._check_account_balances()
+
+    def test_number_sequence(self):
+        self.assertEqual(NumberSequence.objects.get(model_name='accounting.EntryAccount', year_id=1).last_num, 8)
+        self.assertEqual(EntryAccount.get_first_num(1, 5), 9)
+        self.assertEqual(EntryAccount.get_first_num(1), 14)
+        self.assertEqual(NumberSequence.objects.get(model_name='accounting.EntryAccount', year_id=1).last_num, 14)
+        self.assertEqual(NumberSequence.reserve('accounting.EntryAccount', 1, sub_type=2), 1)
+        self.assertEqual(NumberSequence.reserve('accounting.EntryAccount', 1, nb_num=3, sub_type=2, get_last_num=lambda: 100), 2)
+        self.assertEqual(NumberSequence.reserve('accounting.EntryAccount', 1, sub_type=2), 5)
+        entry = EntryAccount.objects.filter(year_id=1, close=False).order_by('id').first()
+        entry.closed()
+        self.assertEqual(EntryAccount.objects.get(id=entry.id).num, 15)
+
+    def test_clear_ghost(self):
+        nb_entries = EntryAccount.objects.count()
+        for ghost_idx in range(60):
+            EntryAccount.objects.create(year_id=1, journal_id=5, date_value='2015-03-%02d' % (ghost_idx % 28 + 1), designation='ghost %d' % ghost_idx)
+        linked_entry = EntryAccount.objects.filter(year_id=1, close=False, entrylineaccount__isnull=False).first()
+        ghost_entry = EntryAccount.objects.create(year_id=1, journal_id=5, date_value='2015-03-01', designation='ghost linked')
+        new_link = AccountLink.objects.create()
+        EntryAccount.objects.filter(id__in=(linked_entry.id, ghost_entry.id)).update(link=new_link)
+        with CaptureQueriesContext(connection) as queries:
+            EntryAccount.clear_ghost()
+        self.assertLessEqual(len(queries), 15)
+        self.assertEqual(EntryAccount.objects.count(), nb_entries)
+        self.assertEqual(EntryAccount.objects.get(id=linked_entry.id).link_id, None)
+        self.assertFalse(AccountLink.objects.filter(id=new_link.id).exists())
+
+    def test_entry_draft(self):
+        entry = EntryAccount.objects.get(id=2)
+        serial_entry = entry.get_serial()
+        serial_entry += '\n' + '\n'.join(['-%d|%d|%d|%f|%d|None|' % (idx + 10, 11 + idx % 5, idx % 7 + 1, 10.0 + idx, 2 if idx % 2 else 0) for idx in range(100)])
+        with CaptureQueriesContext(connection) as queries:
+            lines = entry.get_entrylineaccounts(serial_entry)
+            self.assertEqual(len(lines), 102)
+            self.assertEqual(len(set([six.text_type(line.entry_account) for line in lines])), 37)
+        self.assertLessEqual(len(queries), 5)
+        with CaptureQueriesContext(connection) as queries:
+            no_change, debit_rest, credit_rest = entry.serial_control(serial_entry)
+        self.assertLessEqual(len(queries), 2)
+        self.assertFalse(no_change)
+        self.assertAlmostEqual(credit_rest - debit_rest, 5950.0, delta=0.0001)
+        self.assertEqual(entry.serial_control(entry.get_serial()), (True, 0.0, 0.0))
+        self.assertEqual(entry.get_entrylineaccounts(serial_entry).count(), 102)
+
+    def test_account_letters(self):
+        letters = AccountLink.get_letters(FiscalYear.objects.get(id=1))
+        self.assertEqual(len(letters), AccountLink.objects.filter(entryaccount__year_id=1).distinct().count())
+        for link in AccountLink.objects.filter(entryaccount__year_id=1).distinct():
+            self.assertEqual(letters[link.id], link.letter)
+        self.assertEqual(sorted(letters.values()), ['A', 'C', 'E'])
+        entries = list(EntryAccount.objects.filter(link__isnull=False).select_related('link', 'year'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sorted(set([six.text_type(entry.link) for entry in entries])), ['A', 'C', 'E'])
+            self.assertEqual(entries[0].year.letter, 'A')
+        self.assertEqual(len(queries), 0)
+        entry1, entry2 = EntryAccount.objects.filter(link__isnull=True, year_id=1).order_by('id')[:2]
+        new_link = AccountLink.create_link([entry1, entry2])
+        self.assertEqual(new_link.letter, 'G')
+        self.assertEqual(EntryAccount.objects.filter(link=new_link).count(), 2)
+        entry_c = EntryAccount.objects.filter(link__letter='C').first()
+        entries_c = list(entry_c.link.entryaccount_set.all())
+        entry_c.unlink()
+        self.assertEqual(AccountLink.create_link(entries_c).letter, 'I')
+        new_link = AccountLink.create_link([entry1, entry2])
+        self.assertEqual(new_link.letter, 'K')
+        letters = AccountLink.get_letters(FiscalYear.objects.get(id=1))
+        self.assertEqual(sorted(letters.values()), ['A', 'E', 'I', 'K'])
+        entry1.unlink()
+        self.assertEqual(AccountLink.create_link([entry1, entry2]).letter, 'M')
+        letters = AccountLink.get_letters(FiscalYear.objects.get(id=1))
+        self.assertEqual(sorted(letters.values()), ['A', 'E', 'I', 'M'])
+        self.assertEqual(AccountLink.convert_letter(0), 'A')
+        self.assertEqual(AccountLink.convert_letter(26), 'AA')
+
+    def test_auto_link(self):
+        vente3_id = EntryAccount.objects.get(designation='vente 3').id
+        vente2_id = EntryAccount.objects.get(designation='vente 2').id
+        payment1 = add_entry(1, 4, '2015-02-25', 'reglement vente 3', '-1|2|0|34.010000|0|None|\n-2|1|4|-34.010000|0|None|')
+        payment2 = add_entry(1, 4, '2015-02-26', 'acompte vente 2', '-1|2|0|100.000000|0|None|\n-2|1|5|-100.000000|0|None|')
+        payment3 = add_entry(1, 4, '2015-02-27', 'solde vente 2', '-1|2|0|25.970000|0|None|\n-2|1|5|-25.970000|0|None|')
+        add_entry(1, 4, '2015-02-28', 'acompte depense 3', '-1|2|0|-50.000000|0|None|\n-2|4|2|-50.000000|0|None|')
+        links = AccountLink.find_auto_links(FiscalYear.objects.get(id=1))
+        self.assertEqual(sorted([sorted(entry_ids) for entry_ids in links]), sorted([sorted([vente3_id, payment1.id]), sorted([vente2_id, payment2.id, payment3.id])]))
+        self.assertEqual(AccountLink.find_auto_links(FiscalYear.objects.get(id=1), max_subset=1), [[vente3_id, payment1.id]])
+        self.assertEqual(AccountLink.find_auto_links(FiscalYear.objects.get(id=1), third_ids=[5]), [[vente2_id, payment2.id, payment3.id]])
+
+        self.factory.xfer = EntryAccountAutoLink()
+        self.calljson('/diacamma.accounting/entryAccountAutoLink', {'CONFIRME': 'YES', 'year': '1'}, False)
+        self.assert_observer('core.dialogbox', 'diacamma.accounting', 'entryAccountAutoLink')
+        self.assertEqual(EntryAccount.objects.get(id=vente3_id).link_id, EntryAccount.objects.get(id=payment1.id).link_id)
+        self.assertEqual(EntryAccount.objects.filter(link__isnull=False, year_id=1).count(), 11)
+        self.assertEqual(sorted(AccountLink.get_letters(FiscalYear.objects.get(id=1)).values())[:3], ['A', 'C', 'E'])
+        self.assertEqual(AccountLink.find_auto_links(FiscalYear.objects.get(id=1)), [])
+
+        EntryAccount.objects.get(id=vente3_id).unlink()
+        self.assertEqual(len(AccountLink.auto_link(FiscalYear.objects.get(id=1))), 1)
+        letters = list(AccountLink.get_letters(FiscalYear.objects.get(id=1)).values())
+        self.assertEqual(len(letters), 5)
+        self.assertEqual(len(set(letters)), 5)
+        self.assertEqual(EntryAccount.objects.get(id=vente3_id).link.letter, 'L')
+
+        for pay_idx in range(20):
+            add_entry(1, 3, '2015-03-%02d' % (pay_idx + 1), 'facture %d' % pay_idx, '-1|10|0|%d.000000|0|None|\n-2|1|4|%d.000000|0|None|' % (100 + pay_idx, 100 + pay_idx))
+            add_entry(1, 4, '2015-03-%02d' % (pay_idx + 1), 'reglement %d' % pay_idx, '-1|2|0|%d.000000|0|None|\n-2|1|4|-%d.000000|0|None|' % (100 + pay_idx, 100 + pay_idx))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(AccountLink.auto_link(FiscalYear.objects.get(id=1))), 20)
+        self.assertLess(len(queries), 15)
+        letters = AccountLink.get_letters(FiscalYear.objects.get(id=1))
+        self.assertEqual(len(letters), 25)
+        self.assertEqual(len(set(letters.values())), 25)
+        for pay_idx in range(20):
+            self.assertEqual(EntryAccount.objects.get(designation='facture %d' % pay_idx).link_id, EntryAccount.objects.get(designation='reglement %d' % pay_idx).link_id)
+
+    def test_total_values(self):
+        year = FiscalYear.objects.get(id=1)
+        with CaptureQueriesContext(connection) as queries:
+            total_values = year.get_total_values()
+        self.assertEqual(len(queries), 1)
+        self.assertAlmostEqual(total_values['revenue'], 230.62, delta=0.0001)
+        self.assertAlmostEqual(total_values['expense'], 348.60, delta=0.0001)
+        self.assertAlmostEqual(total_values['cash'], 1050.66, delta=0.0001)
+        self.assertAlmostEqual(total_values['cash_close'], 1244.74, delta=0.0001)
+        with CaptureQueriesContext(connection) as queries:
+            result_text = year.total_result_text
+        self.assertEqual(len(queries), 1)
+        self.assertIn('230.62', result_text)
+
+        add_entry(1, 2, '2015-03-01', 'depense 4', '-1|11|0|20.000000|0|None|\n-2|4|2|20.000000|0|None|')
+        self.assertAlmostEqual(year.total_expense, 368.60, delta=0.0001)
+        self.assertEqual(year.total_snapshot, '')
+
+        FiscalYear.objects.filter(id=1).update(status=2)
+        year = FiscalYear.objects.get(id=1)
+        self.assertAlmostEqual(year.total_expense, 368.60, delta=0.0001)
+        self.assertNotEqual(FiscalYear.objects.get(id=1).total_snapshot, '')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertAlmostEqual(FiscalYear.objects.get(id=1).total_revenue, 230.62, delta=0.0001)
+        self.assertEqual(len(queries), 1)
+
     def test_costaccounting(self):
         self.factory.xfer = EntryAccountEdit()
         self.calljson('/diacamma.accounting/entryAccountEdit',
@@ -394,6 +581,36 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_observer('core.custom', 'diacamma.accounting', 'costAccountingList')
         self.assert_count_equal('costaccounting', 2)
 
+    def test_costaccounting_totals(self):
+        for cost_item in CostAccounting.annotate_totals():
+            self.assertAlmostEqual(cost_item.get_total_revenue(), CostAccounting.objects.get(id=cost_item.id).get_total_revenue(), delta=0.0001)
+            self.assertAlmostEqual(cost_item.get_total_expense(), CostAccounting.objects.get(id=cost_item.id).get_total_expense(), delta=0.0001)
+        for cost_idx in range(30):
+            CostAccounting.objects.create(name='cost %d' % cost_idx, description='cost %d' % cost_idx)
+        with CaptureQueriesContext(connection) as queries:
+            self.factory.xfer = CostAccountingList()
+            self.calljson('/diacamma.accounting/costAccountingList', {'status': -1}, False)
+        self.assertLess(len(queries), 40)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'costAccountingList')
+        self.assert_count_equal('costaccounting', 25)
+        self.assert_json_equal('', 'costaccounting/@0/name', 'close')
+        self.assert_json_equal('', 'costaccounting/@1/total_result', '0.00€')
+
+        self.factory.xfer = CostAccountingReportByDate()
+        self.calljson('/diacamma.accounting/costAccountingReportByDate', {'begin_date': '2015-02-01', 'end_date': '2015-02-28'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'costAccountingReportByDate')
+        self.assertEqual(self.response_json['action']['action'], 'costAccountingIncomeStatement')
+        self.assertEqual(self.response_json['action']['params']['costaccounting'], '1;2')
+
+        cost = CostAccounting.objects.create(name='annexe', description='annexe', year_id=1)
+        account_860 = ChartsAccount.objects.get(year_id=1, code='860').id
+        account_870 = ChartsAccount.objects.get(year_id=1, code='870').id
+        add_entry(1, 5, '2015-03-10', 'contribution', '-1|%d|0|50.000000|%d|None|\n-2|%d|0|-50.000000|%d|None|' % (account_860, cost.id, account_870, cost.id))
+        self.factory.xfer = CostAccountingReportByDate()
+        self.calljson('/diacamma.accounting/costAccountingReportByDate', {'begin_date': '2015-03-01', 'end_date': '2015-03-31'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'costAccountingReportByDate')
+        self.assertEqual(self.response_json['action']['params']['costaccounting'], six.text_type(cost.id))
+
     def test_costaccouting_budget(self):
         self.factory.xfer = CostAccountingAddModify()
         self.calljson('/diacamma.accounting/costAccountingAddModify', {"SAVE": "YES", 'name': 'aaa', 'description': 'aaa', 'year': '1'}, False)
@@ -824,6 +1041,19 @@ class CompletedEntryTest(LucteriosTest):
         self.assertFalse('__tab_1' in self.json_data.keys(), self.json_data.keys())
         self.assert_grid_equal('report_2', {"left": "Charges", "left_n": "Valeur", "space": "", "right": "Produits", "right_n": "Valeur"}, 6)
 
+        cost_ids = ['1', '2']
+        for cost_idx in range(20):
+            cost_ids.append(six.text_type(CostAccounting.objects.create(name='cost %d' % cost_idx, description='cost %d' % cost_idx, last_costaccounting_id=2).id))
+        self.factory.xfer = CostAccountingIncomeStatement()
+        with CaptureQueriesContext(connection) as queries:
+            self.calljson('/diacamma.accounting/costAccountingIncomeStatement', {'costaccounting': ';'.join(cost_ids)}, False)
+        self.assertLess(len(queries), 20)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'costAccountingIncomeStatement')
+        self.assert_json_equal('', 'report_2/@6/name', '{[b]}{[u]}cost 0{[/u]}{[/b]}')
+        self.assert_json_equal('', 'report_2/@7/left_n_1', '63.94€')
+        self.assert_json_equal('', 'report_2/@8/left_n_1', '194.08€')
+        self.assert_json_equal('', 'report_2/@10/left_n_1', '{[u]}{[b]}258.02€{[/b]}{[/u]}')
+
     def test_costaccounting_importbudget(self):
         FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear_id=1)
         self.factory.xfer = CostAccountingAddModify()
@@ -1013,6 +1243,20 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_count_equal('budget_expense', 4)
         self.assert_json_equal('LABELFORM', 'result', '-117.98€')
 
+        with CaptureQueriesContext(connection) as queries:
+            Budget.import_budget(3, 0, 1)
+        self.assertLess(len(queries), 10)
+        self.assertEqual(Budget.objects.filter(year_id=3).count(), 5)
+        self.assertAlmostEqual(Budget.get_total(3, None), -117.98, delta=0.0001)
+
+        self.assertEqual(ChartsAccountBalance.objects.get(account__year_id=1, account__code='701').total, 0.0)
+        cost = CostAccounting.objects.create(name='cost 2016', description='cost 2016', year_id=3)
+        Budget.objects.create(year_id=3, cost_accounting=cost, code='701', amount=25.0)
+        Budget.import_budget(3, 0, 1)
+        self.assertEqual(Budget.objects.filter(year_id=3).count(), 7)
+        self.assertEqual(Budget.objects.get(year_id=3, cost_accounting__isnull=True, code='701').amount, -25.0)
+        self.assertAlmostEqual(Budget.get_total(3, None), -117.98, delta=0.0001)
+
     def test_fiscalyear_incomestatement_filter(self):
         self.factory.xfer = FiscalYearIncomeStatement()
         self.calljson('/diacamma.accounting/fiscalYearIncomeStatement', {'begin': '2015-02-22', 'end': '2015-02-28'}, False)
@@ -1045,6 +1289,32 @@ class CompletedEntryTest(LucteriosTest):
         pdf_value = b64decode(six.text_type(self.response_json['print']["content"]))
         self.assertEqual(pdf_value[:4], "%PDF".encode('ascii', 'ignore'))
 
+    def test_fiscalyear_ledger_paging(self):
+        self.factory.xfer = FiscalYearLedger()
+        self.calljson('/diacamma.accounting/fiscalYearLedger', {'GRID_PAGE%report_1': 1, 'GRID_SIZE%report_1': 20}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+        self.assert_count_equal('report_1', 20)
+        self.assertEqual(self.json_comp['report_1']['nb_lines'], 68)
+        self.assertEqual(self.json_comp['report_1']['page_max'], 4)
+        self.assertEqual(self.json_comp['report_1']['page_num'], 1)
+        self.assertEqual(self.json_comp['report_1']['no_pager'], False)
+
+        self.factory.xfer = FiscalYearLedger()
+        self.calljson('/diacamma.accounting/fiscalYearLedger', {'GRID_PAGE%report_1': 5, 'GRID_SIZE%report_1': 20}, False)
+        self.assert_count_equal('report_1', 20)
+        self.assertEqual(self.json_comp['report_1']['page_num'], 0)
+
+    def test_fiscalyear_ledger_export(self):
+        self.factory.xfer = FiscalYearLedgerExport()
+        self.calljson('/diacamma.accounting/fiscalYearLedgerExport', {'begin': '2015-02-22', 'end': '2015-02-28'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedgerExport')
+        self.assert_json_equal('DOWNLOAD', 'filename', 'ledger_2015-02-22_2015-02-28.csv')
+        with open(get_user_path('accounting', 'ledger_1.csv'), 'r', encoding='utf-8') as csv_file:
+            content_csv = csv_file.read().split('\n')
+        self.assertEqual(content_csv[0].strip(), "N°;date d'écriture;date de pièce;nom;débit;crédit")
+        self.assertEqual(content_csv[1].strip(), ";;;[411] 411;;")
+        self.assertEqual(content_csv[2].strip(), ";;;[411 Dalton Joe];;")
+
     def test_fiscalyear_trialbalance(self):
         self.factory.xfer = FiscalYearTrialBalance()
         self.calljson('/diacamma.accounting/fiscalYearTrialBalance', {}, False)
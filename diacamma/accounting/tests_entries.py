@@ -40,7 +40,7 @@ from diacamma.accounting.views_entries import EntryAccountList, \
     EntryLineAccountDel, EntryAccountUnlock
 from diacamma.accounting.test_tools import default_compta_fr, initial_thirds_fr,\
     fill_entries_fr
-from diacamma.accounting.models import EntryAccount, CostAccounting
+from diacamma.accounting.models import EntryAccount, CostAccounting, EntryAccountDraft
 from diacamma.accounting.views_other import CostAccountingAddModify
 
 
@@ -419,7 +419,7 @@ class EntryTest(LucteriosTest):
         self.assertEqual(self.json_context['journal'], "3")
         self.assertEqual(self.response_json['action']['id'], "diacamma.accounting/entryAccountEdit")
         self.assertEqual(len(self.response_json['action']['params']), 1)
-        serial_value = self.response_json['action']['params']['serial_entry']
+        serial_value = EntryAccountDraft.objects.get(id=self.response_json['action']['params']['entrydraft']).get_serial()
         self.assertEqual(serial_value[-23:], "|3|0|152.340000|0|ccdd|")
 
     def test_valid_entry(self):
@@ -854,7 +854,7 @@ class EntryTest(LucteriosTest):
         self.assert_observer('core.acknowledge', 'diacamma.accounting', 'entryLineAccountDel')
         self.assertEqual(self.response_json['action']['id'], "diacamma.accounting/entryAccountEdit")
         self.assertEqual(len(self.response_json['action']['params']), 1)
-        self.assertEqual(self.response_json['action']['params']['serial_entry'], "1|9|0|364.910000|0|None|")
+        self.assertEqual(EntryAccountDraft.objects.get(id=self.response_json['action']['params']['entrydraft']).get_serial(), "1|9|0|364.910000|0|None|")
         self.assertEqual(len(self.json_context), 3)
         self.assertEqual(self.json_context['entryaccount'], "1")
         self.assertEqual(self.json_context['year'], "1")
@@ -868,6 +868,74 @@ class EntryTest(LucteriosTest):
         self.assert_count_equal('entrylineaccount_serial', 1)
         self.assertEqual(len(self.json_actions), 2)
 
+    def test_entry_draft_store(self):
+        self.factory.xfer = EntryAccountEdit()
+        self.calljson('/diacamma.accounting/entryAccountEdit', {'SAVE': 'YES', 'year': '1', 'journal': '2',
+                                                                'date_value': '2015-02-13', 'designation': 'un plein cadie'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'entryAccountEdit')
+
+        self.factory.xfer = EntryLineAccountAdd()
+        self.calljson('/diacamma.accounting/entryLineAccountAdd', {'year': '1', 'journal': '2', 'entryaccount': '1',
+                                                                   'num_cpt': '4', 'third': 0, 'debit_val': '0.0', 'credit_val': '152.34'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'entryLineAccountAdd')
+        draft_id = self.response_json['action']['params']['entrydraft']
+        entry_draft = EntryAccountDraft.objects.get(id=draft_id)
+        self.assertEqual(entry_draft.nb_lines, 1)
+        self.assertEqual(entry_draft.debit_rest, 152.34)
+        self.assertEqual(entry_draft.credit_rest, 0.0)
+
+        self.factory.xfer = EntryLineAccountAdd()
+        self.calljson('/diacamma.accounting/entryLineAccountAdd', {'year': '1', 'journal': '2', 'entryaccount': '1', 'entrydraft': draft_id,
+                                                                   'num_cpt': '12', 'debit_val': '100.0', 'credit_val': '0.0'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'entryLineAccountAdd')
+        self.assertEqual(self.response_json['action']['params']['entrydraft'], draft_id)
+        entry_draft = EntryAccountDraft.objects.get(id=draft_id)
+        self.assertEqual(entry_draft.nb_lines, 2)
+        self.assertEqual(entry_draft.debit_rest, 52.34)
+        line_id = entry_draft.entrylinedraft_set.all()[1].line_id
+
+        self.factory.xfer = EntryLineAccountEdit()
+        self.calljson('/diacamma.accounting/entryLineAccountEdit', {'year': '1', 'journal': '2', 'entryaccount': '1', 'entrydraft': draft_id,
+                                                                    'entrylineaccount_serial': line_id}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryLineAccountEdit')
+        self.assert_json_equal('LABELFORM', 'account', '[602] 602')
+        self.assert_json_equal('FLOAT', 'debit_val', '100.00')
+
+        self.factory.xfer = EntryLineAccountAdd()
+        self.calljson('/diacamma.accounting/entryLineAccountAdd', {'year': '1', 'journal': '2', 'entryaccount': '1', 'entrydraft': draft_id,
+                                                                   'entrylineaccount_serial': line_id, 'num_cpt': '12', 'debit_val': '152.34', 'credit_val': '0.0'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'entryLineAccountAdd')
+        entry_draft = EntryAccountDraft.objects.get(id=draft_id)
+        self.assertEqual(entry_draft.nb_lines, 2)
+        self.assertEqual(entry_draft.debit_rest, 0.0)
+        self.assertEqual(entry_draft.credit_rest, 0.0)
+
+        self.factory.xfer = EntryAccountEdit()
+        self.calljson('/diacamma.accounting/entryAccountEdit', {'year': '1', 'journal': '2', 'entryaccount': '1', 'entrydraft': draft_id}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountEdit')
+        self.assert_count_equal('entrylineaccount_serial', 2)
+        self.assertEqual(self.json_context['entrydraft'], draft_id)
+        self.assertEqual(self.json_actions[0]['id'], "diacamma.accounting/entryAccountValidate")
+        line_id = entry_draft.entrylinedraft_set.all()[1].line_id
+
+        self.factory.xfer = EntryLineAccountDel()
+        self.calljson('/diacamma.accounting/entryLineAccountDel', {'year': '1', 'journal': '2', 'entryaccount': '1', 'entrydraft': draft_id,
+                                                                   'entrylineaccount_serial': line_id}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'entryLineAccountDel')
+        entry_draft = EntryAccountDraft.objects.get(id=draft_id)
+        self.assertEqual(entry_draft.nb_lines, 1)
+        self.assertEqual(entry_draft.debit_rest, 152.34)
+
+        EntryAccountDraft.objects.filter(id=draft_id).update(last_modified=entry_draft.last_modified - EntryAccountDraft.EXPIRY_DELAY * 2)
+        EntryAccountDraft.clear_expired()
+        self.assertEqual(EntryAccountDraft.objects.all().count(), 0)
+
+        self.factory.xfer = EntryLineAccountAdd()
+        self.calljson('/diacamma.accounting/entryLineAccountAdd', {'year': '1', 'journal': '2', 'entryaccount': '1', 'entrydraft': draft_id,
+                                                                   'num_cpt': '12', 'debit_val': '100.0', 'credit_val': '0.0'}, False)
+        self.assert_observer('core.exception', 'diacamma.accounting', 'entryLineAccountAdd')
+        self.assertEqual(EntryAccountDraft.objects.all().count(), 0)
+
     def test_delete_entries(self):
         self.factory.xfer = EntryAccountEdit()
         self.calljson('/diacamma.accounting/entryAccountEdit', {'SAVE': 'YES', 'year': '1', 'journal': '2',
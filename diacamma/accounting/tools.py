@@ -24,7 +24,10 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 
-from django.utils.translation import ugettext_lazy as _
+from lxml import etree
+
+from django.utils.translation import ugettext_lazy as _, get_language
+from django.utils import six
 
 from lucterios.CORE.parameters import Params
 
@@ -54,17 +57,135 @@ def get_amount_sum(val):
         return val['amount__sum']
 
 
+class CurrencyFormatter(object):
+
+    def __init__(self, currency_short, currency_decimal):
+        self.currency_short = currency_short
+        self.currency_decimal = currency_decimal
+        self.currency_format = "%%0.%df" % currency_decimal
+        self.currency_epsilon = pow(10, -1 * currency_decimal - 1)
+        self.templates = {}
+
+    def round(self, amount):
+        try:
+            return round(float(amount), self.currency_decimal)
+        except:
+            return round(0.0, self.currency_decimal)
+
+    def get_templates(self, mode):
+        # mode 0 25.45 => 25,45€ / -25.45 =>
+
+        # mode 1 25.45 => Credit 25,45€ / -25.45 => Debit 25,45€
+        # mode 2 25.45 => {[font color="green"]}Credit 25,45€{[/font]}     /
+        # -25.45 => {[font color="blue"]}Debit 25,45€{[/font]}
+
+        # mode 3 25.45 => 25,45 / -25.45 => -25.45
+        # mode 4 25.45 => 25,45€ / -25.45 => 25.45€
+        # mode 5 25.45 => 25,45€ / -25.45 => -25.45€
+        # mode 6 25.45 => {[font color="green"]}25,45€{[/font]}     /
+        # -25.45 => {[font color="blue"]}25,45€{[/font]}
+        template_key = (mode, get_language())
+        if template_key not in self.templates:
+            positive_prefix = ''
+            negative_prefix = ''
+            suffix = self.currency_short if mode != 3 else ''
+            if mode in (2, 6):
+                positive_prefix = '{[font color="green"]}'
+                negative_prefix = '{[font color="blue"]}'
+                suffix = suffix + '{[/font]}'
+            if mode in (1, 2):
+                positive_prefix = '%s%s: ' % (positive_prefix, _('Credit'))
+                negative_prefix = '%s%s: ' % (negative_prefix, _('Debit'))
+            if mode in (1, 2):
+                zero_text = positive_prefix + self.currency_format % 0 + suffix
+            elif mode == 6:
+                zero_text = positive_prefix + '{[/font]}'
+            elif mode == 0:
+                zero_text = ''
+            else:
+                zero_text = self.currency_format % 0 + suffix
+            with_sign = (mode == 3) or (mode == 5) or (mode > 6)
+            self.templates[template_key] = (zero_text, positive_prefix, negative_prefix if mode != 0 else None, suffix, with_sign)
+        return self.templates[template_key]
+
+    def format_list(self, amounts, mode):
+        from decimal import InvalidOperation
+        zero_text, positive_prefix, negative_prefix, suffix, with_sign = self.get_templates(mode)
+        currency_format = self.currency_format
+        currency_epsilon = self.currency_epsilon
+        results = []
+        for amount in amounts:
+            try:
+                if (amount is None) or (abs(amount) < currency_epsilon):
+                    results.append(zero_text)
+                elif amount > 0:
+                    results.append(positive_prefix + currency_format % amount + suffix)
+                elif negative_prefix is None:
+                    results.append('')
+                else:
+                    results.append(negative_prefix + currency_format % (amount if with_sign else -amount) + suffix)
+            except InvalidOperation:
+                results.append("???")
+        return results
+
+    def format(self, amount, mode):
+        return self.format_list((amount,), mode)[0]
+
+
+class ParamsSnapshot(object):
+
+    REFERENCE_PARAM = "accounting-devise-prec"
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.reference = None
+        self.values = {}
+        self.currency_formatter = None
+
+    def check(self):
+        # Params.clear() drops its cached objects: a new one means this snapshot is outdated
+        if (self.reference is None) or (Params._PARAM_CACHE_LIST.get(self.REFERENCE_PARAM) is not self.reference):
+            self.clear()
+            self.values[self.REFERENCE_PARAM] = Params.getvalue(self.REFERENCE_PARAM)
+            self.reference = Params._PARAM_CACHE_LIST.get(self.REFERENCE_PARAM)
+
+    def getvalue(self, name):
+        self.check()
+        if name not in self.values:
+            self.values[name] = Params.getvalue(name)
+        return self.values[name]
+
+    def get_currency_formatter(self):
+        self.check()
+        if self.currency_formatter is None:
+            self.currency_formatter = CurrencyFormatter(self.getvalue("accounting-devise"), self.getvalue("accounting-devise-prec"))
+        return self.currency_formatter
+
+
+PARAMS_SNAPSHOT = ParamsSnapshot()
+
+
+def get_param_value(name):
+    return PARAMS_SNAPSHOT.getvalue(name)
+
+
+def get_currency_formatter():
+    return PARAMS_SNAPSHOT.get_currency_formatter()
+
+
+def clear_params_snapshot():
+    PARAMS_SNAPSHOT.clear()
+
+
 def currency_round(amount):
-    currency_decimal = Params.getvalue("accounting-devise-prec")
-    try:
-        return round(float(amount), currency_decimal)
-    except:
-        return round(0.0, currency_decimal)
+    return get_currency_formatter().round(amount)
 
 
 def correct_accounting_code(code):
     if current_system_account().has_minium_code_size():
-        code_size = Params.getvalue("accounting-sizecode")
+        code_size = get_param_value("accounting-sizecode")
         while len(code) > code_size and code[-1] == '0':
             code = code[:-1]
         while len(code) < code_size:
@@ -73,54 +194,27 @@ def correct_accounting_code(code):
 
 
 def format_devise(amount, mode):
+    return get_currency_formatter().format(amount, mode)
+
+
+def format_devise_list(amounts, mode):
+    return get_currency_formatter().format_list(amounts, mode)
 
-    # mode 0 25.45 => 25,45€ / -25.45 =>
-
-    # mode 1 25.45 => Credit 25,45€ / -25.45 => Debit 25,45€
-    # mode 2 25.45 => {[font color="green"]}Credit 25,45€{[/font]}     /
-    # -25.45 => {[font color="blue"]}Debit 25,45€{[/font]}
-
-    # mode 3 25.45 => 25,45 / -25.45 => -25.45
-    # mode 4 25.45 => 25,45€ / -25.45 => 25.45€
-    # mode 5 25.45 => 25,45€ / -25.45 => -25.45€
-    # mode 6 25.45 => {[font color="green"]}25,45€{[/font]}     /
-    # -25.45 => {[font color="blue"]}25,45€{[/font]}
-    from decimal import InvalidOperation
-    result = ''
-    currency_short = Params.getvalue("accounting-devise")
-    currency_decimal = Params.getvalue("accounting-devise-prec")
-    currency_format = "%%0.%df" % currency_decimal
-    currency_epsilon = pow(10, -1 * currency_decimal - 1)
+
+def get_xml_element(tag, value):
+    element = etree.Element(tag)
+    element.text = six.text_type(value)
+    return element
+
+
+def xml_file_validator(xml_file, xsd_file):
     try:
-        if (amount is None) or (abs(amount) < currency_epsilon):
-            amount = 0
-    except InvalidOperation:
-        return "???"
-    if (abs(amount) >= currency_epsilon) or (mode in (1, 2, 6)):
-        if amount >= 0:
-            if mode in (2, 6):
-                result = '{[font color="green"]}'
-            if (mode == 1) or (mode == 2):
-                result = '%s%s: ' % (result, _('Credit'))
-        else:
-            if mode in (2, 6):
-                result = result + '{[font color="blue"]}'
-            if (mode == 1) or (mode == 2):
-                result = '%s%s: ' % (result, _('Debit'))
-    if mode == 3:
-        result = currency_format % amount
-    elif mode == 0:
-        if amount >= currency_epsilon:
-            result = currency_format % abs(amount) + currency_short
-    elif mode == 6:
-        if abs(amount) >= currency_epsilon:
-            result = result + currency_format % abs(amount) + currency_short
-    else:
-        if mode < 5:
-            amount_text = currency_format % abs(amount)
-        else:
-            amount_text = currency_format % amount
-        result = result + amount_text + currency_short
-    if mode in (2, 6):
-        result = result + '{[/font]}'
-    return result
+        schema = etree.XMLSchema(file=xsd_file)
+        for _event, element in etree.iterparse(xml_file, events=('end',), schema=schema):
+            if element.getparent() is not None:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        return None
+    except etree.XMLSyntaxError as xml_error:
+        return six.text_type(xml_error)
@@ -23,18 +23,48 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+import re
 
+from django.db.models import Q, Case, When, FloatField
 from django.db.models.aggregates import Sum
 from django.utils import six
 
-from diacamma.accounting.models import format_devise, EntryLineAccount, ChartsAccount, Budget, Third
-from diacamma.accounting.tools import correct_accounting_code
+from diacamma.accounting.models import format_devise, EntryLineAccount, ChartsAccount, Budget, Third, FiscalYear
+from diacamma.accounting.tools import format_devise_list
+from diacamma.accounting.tools import correct_accounting_code, current_system_account
 
 
 def get_spaces(size):
     return ''.ljust(size, '-').replace('-', '&#160;')
 
 
+def clean_report_text(value):
+    value = re.sub(r'\{\[[^\]]*\]\}', '', six.text_type(value))
+    return value.replace('&#160;', ' ').strip()
+
+
+def get_accounts_by_id(account_ids):
+    return ChartsAccount.objects.in_bulk(list(set(account_ids)))
+
+
+def get_thirds_by_id(third_ids):
+    third_ids = [third_id for third_id in set(third_ids) if third_id is not None]
+    return Third.objects.select_related('contact', 'contact__legalentity', 'contact__individual').in_bulk(third_ids)
+
+
+def get_charts_by_code(codes):
+    current_year = FiscalYear.get_current()
+    codes = set([correct_accounting_code(code) for code in codes])
+    charts = {}
+    for chart in current_year.chartsaccount_set.filter(code__in=codes):
+        charts[chart.code] = chart
+    for code in codes:
+        if code not in charts:
+            descript, typeaccount = current_system_account().new_charts_account(code)
+            charts[code] = ChartsAccount(year=current_year, code=code, name=descript, type_of_account=typeaccount)
+    return charts
+
+
 def credit_debit_way(data_line):
     if 'account' in data_line.keys():
         account = ChartsAccount.objects.get(id=data_line['account'])
@@ -46,33 +76,50 @@ def credit_debit_way(data_line):
     return 0
 
 
-def get_totalaccount_for_query(query, sign_value=None, with_third=False):
-    total = 0
-    values = {}
+def get_grouped_sums(queries, with_third=False):
     if with_third:
         fields = ['account', 'third']
     else:
         fields = ['account']
-    for data_line in EntryLineAccount.objects.filter(query).order_by(*fields).values(*fields).annotate(data_sum=Sum('amount')):
-        if abs(data_line['data_sum']) > 0.001:
-            account = ChartsAccount.objects.get(id=data_line['account'])
+    global_query = None
+    sum_fields = {}
+    for query_idx, query in enumerate(queries):
+        if global_query is None:
+            global_query = query
+        else:
+            global_query |= query
+        sum_fields['data_sum_%d' % query_idx] = Sum(Case(When(query, then='amount'), output_field=FloatField()))
+    data_lines = list(EntryLineAccount.objects.filter(global_query).order_by(*fields).values(*fields).annotate(**sum_fields))
+    accounts = get_accounts_by_id([data_line['account'] for data_line in data_lines])
+    thirds = get_thirds_by_id([data_line['third'] for data_line in data_lines]) if with_third else {}
+    return data_lines, accounts, thirds
+
+
+def get_values_from_sums(data_lines, query_idx, accounts, thirds, sign_value=None, account_filter=None):
+    total = 0
+    values = {}
+    for data_line in data_lines:
+        data_sum = data_line['data_sum_%d' % query_idx]
+        if (data_sum is not None) and (abs(data_sum) > 0.001):
+            account = accounts[data_line['account']]
+            if (account_filter is not None) and not account_filter(account):
+                continue
             account_code = correct_accounting_code(account.code)
             if ('third' in data_line.keys()) and (data_line['third'] is not None):
                 account_code = "%s#%s" % (account_code, data_line['third'])
-                third = Third.objects.get(id=data_line['third'])
-                account_title = "[%s %s]" % (account.code, six.text_type(third))
+                account_title = "[%s %s]" % (account.code, six.text_type(thirds[data_line['third']]))
             else:
                 account_title = account.get_name()
             amount = None
             if sign_value is None:
-                amount = data_line['data_sum']
+                amount = data_sum
             elif isinstance(sign_value, bool):
                 if sign_value:
-                    amount = credit_debit_way(data_line) * data_line['data_sum']
+                    amount = account.credit_debit_way() * data_sum
                 else:
-                    amount = -1 * credit_debit_way(data_line) * data_line['data_sum']
+                    amount = -1 * account.credit_debit_way() * data_sum
             else:
-                amount = sign_value * credit_debit_way(data_line) * data_line['data_sum']
+                amount = sign_value * account.credit_debit_way() * data_sum
                 if (amount < 0):
                     amount = None
             if amount is not None:
@@ -83,19 +130,29 @@ def get_totalaccount_for_query(query, sign_value=None, with_third=False):
     return values, total
 
 
+def get_totalaccount_for_queries(queries, sign_value=None, with_third=False):
+    data_lines, accounts, thirds = get_grouped_sums(queries, with_third)
+    return [get_values_from_sums(data_lines, query_idx, accounts, thirds, sign_value) for query_idx in range(len(queries))]
+
+
+def get_totalaccount_for_query(query, sign_value=None, with_third=False):
+    return get_totalaccount_for_queries([query], sign_value, with_third)[0]
+
+
 def get_totalbudget_for_query(query):
     total = 0
     values = {}
-    for data_line in Budget.objects.filter(query).order_by('code').values('code').annotate(data_sum=Sum('amount')):
-        if abs(data_line['data_sum']) > 0.001:
-            account = ChartsAccount.get_chart_account(data_line['code'])
-            account_code = account.code
-            account_title = account.get_name()
-            amount = data_line['data_sum']
-            if account_code not in values.keys():
-                values[account_code] = [0, account_title]
-            values[account_code][0] += amount
-            total += amount
+    data_lines = [data_line for data_line in Budget.objects.filter(query).order_by('code').values('code').annotate(data_sum=Sum('amount')) if abs(data_line['data_sum']) > 0.001]
+    charts = get_charts_by_code([data_line['code'] for data_line in data_lines])
+    for data_line in data_lines:
+        account = charts[correct_accounting_code(data_line['code'])]
+        account_code = account.code
+        account_title = account.get_name()
+        amount = data_line['data_sum']
+        if account_code not in values.keys():
+            values[account_code] = [0, account_title]
+        values[account_code][0] += amount
+        total += amount
     return values, total
 
 
@@ -109,12 +166,14 @@ def convert_query_to_account(query1, query2=None, query_budget=None, sign_value=
             else:
                 dict_account[account_code].append(None)
     dict_account = {}
-    values1, total1 = get_totalaccount_for_query(query1, sign_value, with_third)
+    if query2 is not None:
+        (values1, total1), (values2, total2) = get_totalaccount_for_queries([query1, query2], sign_value, with_third)
+    else:
+        values1, total1 = get_totalaccount_for_query(query1, sign_value, with_third)
     for account_code in values1.keys():
         check_account(account_code, values1[account_code][1])
         dict_account[account_code][1] = values1[account_code][0]
     if query2 is not None:
-        values2, total2 = get_totalaccount_for_query(query2, sign_value, with_third)
         for account_code in values2.keys():
             check_account(account_code, values2[account_code][1])
             dict_account[account_code][2] = values2[account_code][0]
@@ -147,6 +206,95 @@ def convert_query_to_account(query1, query2=None, query_budget=None, sign_value=
     return res, total1, total2, total3
 
 
+def convert_sums_to_account(data_lines, accounts, with_last, sign_value=None, account_filter=None, budget_values=None):
+    dict_account = {}
+    values1, total1 = get_values_from_sums(data_lines, 0, accounts, {}, sign_value, account_filter)
+    for account_code in values1.keys():
+        dict_account[account_code] = [values1[account_code][1], values1[account_code][0], None, None]
+    if with_last:
+        values2, total2 = get_values_from_sums(data_lines, 1, accounts, {}, sign_value, account_filter)
+        for account_code in values2.keys():
+            if account_code not in dict_account.keys():
+                dict_account[account_code] = [values2[account_code][1], None, None, None]
+            dict_account[account_code][2] = values2[account_code][0]
+    else:
+        total2 = 0
+    if budget_values is not None:
+        for account_code in budget_values.keys():
+            if account_code not in dict_account.keys():
+                dict_account[account_code] = [budget_values[account_code][1], None, None, None]
+            dict_account[account_code][3] = budget_values[account_code][0]
+    res = []
+    for key in sorted(dict_account.keys()):
+        res.append(dict_account[key])
+    return res, total1, total2
+
+
+class CostAccountingReportEngine(object):
+
+    def __init__(self, costaccountings, date_begin=None, date_end=None):
+        self.last_ids = {costaccounting.id: costaccounting.last_costaccounting_id for costaccounting in costaccountings}
+        line_filter = Q(costaccounting_id__in=list(self.last_ids.keys()))
+        if date_begin is not None:
+            line_filter &= Q(entry__date_value__gte=date_begin)
+        if date_end is not None:
+            line_filter &= Q(entry__date_value__lte=date_end)
+        self.current_sums = self._get_sums(EntryLineAccount.objects.filter(line_filter), 'costaccounting', 'account')
+        last_ids = [last_id for last_id in set(self.last_ids.values()) if last_id is not None]
+        self.last_sums = self._get_sums(EntryLineAccount.objects.filter(costaccounting_id__in=last_ids), 'costaccounting', 'account')
+        self.budget_sums = self._get_sums(Budget.objects.filter(cost_accounting_id__in=list(self.last_ids.keys())), 'cost_accounting', 'code')
+        account_ids = []
+        for sums in list(self.current_sums.values()) + list(self.last_sums.values()):
+            account_ids.extend(sums.keys())
+        self.accounts = get_accounts_by_id(account_ids)
+        codes = []
+        for sums in self.budget_sums.values():
+            codes.extend(sums.keys())
+        self.charts = get_charts_by_code(codes)
+
+    @classmethod
+    def _get_sums(cls, queryset, cost_field, key_field):
+        sums = {}
+        for data_line in queryset.order_by(cost_field, key_field).values(cost_field, key_field).annotate(data_sum=Sum('amount')):
+            if data_line[cost_field] not in sums:
+                sums[data_line[cost_field]] = {}
+            sums[data_line[cost_field]][data_line[key_field]] = data_line['data_sum']
+        return sums
+
+    def get_result(self, costaccounting_id):
+        result = 0.0
+        for account_id, data_sum in self.current_sums.get(costaccounting_id, {}).items():
+            if self.accounts[account_id].type_of_account == 3:
+                result += data_sum
+            elif self.accounts[account_id].type_of_account == 4:
+                result -= data_sum
+        return result
+
+    def get_budget_values(self, costaccounting_id, code_regex):
+        total = 0
+        values = {}
+        for code, data_sum in sorted(self.budget_sums.get(costaccounting_id, {}).items()):
+            if (code_regex.search(code) is None) or (abs(data_sum) <= 0.001):
+                continue
+            account = self.charts[correct_accounting_code(code)]
+            if account.code not in values.keys():
+                values[account.code] = [0, account.get_name()]
+            values[account.code][0] += data_sum
+            total += data_sum
+        return values, total
+
+    def convert_to_account(self, costaccounting_id, account_filter, budget_regex=None, sign_value=None, with_last=False):
+        current_sums = self.current_sums.get(costaccounting_id, {})
+        last_sums = self.last_sums.get(self.last_ids[costaccounting_id], {}) if with_last else {}
+        data_lines = [{'account': account_id, 'data_sum_0': current_sums.get(account_id), 'data_sum_1': last_sums.get(account_id)}
+                      for account_id in sorted(set(current_sums.keys()) | set(last_sums.keys()))]
+        budget_values, total3 = None, 0
+        if budget_regex is not None:
+            budget_values, total3 = self.get_budget_values(costaccounting_id, budget_regex)
+        res, total1, total2 = convert_sums_to_account(data_lines, self.accounts, with_last, sign_value, account_filter, budget_values)
+        return res, total1, total2, total3
+
+
 def add_cell_in_grid(grid, line_idx, colname, value):
     grid.set_value("L%04d" % line_idx, colname, value)
 
@@ -161,8 +309,16 @@ def add_item_in_grid(grid, line_idx, side, data_item, formttext='%s'):
 
 
 def fill_grid(grid, index_begin, side, data_line):
+    values_n = format_devise_list([data_item[1] for data_item in data_line], 5)
+    values_n_1 = format_devise_list([data_item[2] for data_item in data_line], 5)
+    values_b = format_devise_list([data_item[3] for data_item in data_line], 5)
     line_idx = index_begin
-    for data_item in data_line:
-        add_item_in_grid(grid, line_idx, side, data_item)
+    for data_item, value_n, value_n_1, value_b in zip(data_line, values_n, values_n_1, values_b):
+        add_cell_in_grid(grid, line_idx, side, '%s' % data_item[0])
+        add_cell_in_grid(grid, line_idx, side + '_n', value_n)
+        if data_item[2] is not None:
+            add_cell_in_grid(grid, line_idx, side + '_n_1', value_n_1)
+        if data_item[3] is not None:
+            add_cell_in_grid(grid, line_idx, side + '_b', value_b)
         line_idx += 1
     return line_idx
@@ -61,6 +61,9 @@ class ThirdList(XferListEditor):
 
     def get_items_from_filter(self):
         items = self.model.objects.annotate(completename=Concat('contact__individual__lastname', Value(' '), 'contact__individual__firstname')).filter(self.filter)
+        items = Third.annotate_total(items)
+        if self.getparam('show_filter', 0) == 2:
+            items = items.exclude(total_amount__range=(-0.0001, 0.0001))
         sort_third = self.getparam('GRID_ORDER%third', '')
         sort_thirdbis = self.getparam('GRID_ORDER%third+', '')
         self.params['GRID_ORDER%third'] = ""
@@ -71,8 +74,6 @@ class ThirdList(XferListEditor):
                 sort_thirdbis = "-"
             self.params['GRID_ORDER%third+'] = sort_thirdbis
         items = sorted(items, key=lambda t: six.text_type(t).lower(), reverse=sort_thirdbis.startswith('-'))
-        if self.getparam('show_filter', 0) == 2:
-            items = [item for item in items if abs(item.get_total()) > 0.0001]
         res = QuerySet(model=Third)
         res._result_cache = items
         return res
@@ -250,10 +251,11 @@ class ThirdListing(XferPrintListing):
     caption = _("Listing third")
 
     def filter_callback(self, items):
+        items = Third.annotate_total(items)
+        if (self.getparam('CRITERIA') is None) and (self.getparam('show_filter', 0) == 2):
+            items = items.exclude(total_amount__range=(-0.0001, 0.0001))
         items = sorted(items, key=lambda t: six.text_type(
             t))
-        if (self.getparam('CRITERIA') is None) and (self.getparam('show_filter', 0) == 2):
-            items = [item for item in items if abs(item.get_total()) > 0.0001]
         res = QuerySet(model=Third)
         res._result_cache = items
         return res
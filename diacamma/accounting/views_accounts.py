@@ -77,6 +77,9 @@ class ChartsAccountList(XferListEditor):
         if select_type != -1:
             self.filter &= Q(type_of_account=select_type)
 
+    def get_items_from_filter(self):
+        return XferListEditor.get_items_from_filter(self).select_related('balance')
+
     def fillresponse(self):
         XferListEditor.fillresponse(self)
         lbl = XferCompLabelForm("result")
@@ -218,6 +221,9 @@ class ChartsAccountListing(XferPrintListing):
             new_filter = XferPrintListing.get_filter(self)
         return new_filter
 
+    def filter_callback(self, items):
+        return items.select_related('balance')
+
 
 @ActionsManage.affect_list(_('Last fiscal year'), 'images/edit.png',
                            condition=lambda xfer: (xfer.item.year.status == 0) and (xfer.item.year.last_fiscalyear is not None) and xfer.item.year.has_no_lastyear_entry and (xfer.item.year.last_fiscalyear.status == 2))
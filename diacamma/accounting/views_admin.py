@@ -40,7 +40,7 @@ from diacamma.accounting.models import FiscalYear, Journal, AccountThird, Charts
     Third
 from diacamma.accounting.system import accounting_system_list, accounting_system_name
 from diacamma.accounting.tools import clear_system_account, correct_accounting_code,\
-    current_system_account
+    current_system_account, clear_params_snapshot
 from django.utils import six
 from lucterios.contacts.models import CustomField
 
@@ -239,6 +239,7 @@ class JournalDel(XferDelete):
 
 @signal_and_lock.Signal.decorate('param_change')
 def paramchange_accounting(params):
+    clear_params_snapshot()
     if 'accounting-sizecode' in params:
         for account in AccountThird.objects.all():
             if account.code != correct_accounting_code(account.code):
@@ -252,6 +253,8 @@ def paramchange_accounting(params):
             if model_line.code != correct_accounting_code(model_line.code):
                 model_line.code = correct_accounting_code(model_line.code)
                 model_line.save()
+    if 'accounting-system' in params:
+        ChartsAccount.refresh_classification()
 
 
 @signal_and_lock.Signal.decorate('conf_wizard')
@@ -17,8 +17,8 @@ from lucterios.framework.tools import SELECT_SINGLE
 from lucterios.framework.signal_and_lock import Signal
 from lucterios.CORE.xferprint import XferPrintAction
 
-from diacamma.accounting.tools import current_system_account, format_devise
-from diacamma.accounting.models import Budget, CostAccounting, FiscalYear, ChartsAccount, EntryLineAccount
+from diacamma.accounting.tools import format_devise
+from diacamma.accounting.models import Budget, BudgetEngine, CostAccounting, FiscalYear, ChartsAccount
 from django.db.models.aggregates import Sum
 
 
@@ -54,46 +54,30 @@ class BudgetList(XferListEditor):
             self.filter &= Q(cost_accounting_id=self.getparam('cost_accounting'))
 
     def fill_grid(self, row, model, field_id, items):
-        XferListEditor.fill_grid(self, row, model, field_id, items)
-        if self.getparam('cost_accounting') is None:
-            grid = self.get_components(field_id)
-            grid.record_ids = []
-            grid.records = {}
-            last_code = ''
-            value = 0
-            for current_budget in items:
-                if last_code != current_budget.code:
-                    if last_code != '':
-                        chart = ChartsAccount.get_chart_account(last_code)
-                        grid.set_value('C' + last_code, 'budget', six.text_type(chart))
-                        grid.set_value('C' + last_code, 'montant', format_devise(value, 2))
-                        value = 0
-                    last_code = current_budget.code
-                value += current_budget.credit_debit_way() * current_budget.amount
-            if last_code != '':
-                chart = ChartsAccount.get_chart_account(last_code)
-                grid.set_value('C' + last_code, 'budget', six.text_type(chart))
-                grid.set_value('C' + last_code, 'montant', format_devise(value, 2))
-            grid.nb_lines = len(grid.records)
-            grid.order_list = None
-            grid.page_max = 1
-            grid.page_num = 0
+        XferListEditor.fill_grid(self, row, model, field_id, model.objects.none())
+        grid = self.get_components(field_id)
+        for line_id, chart, value in items:
+            grid.set_value(line_id, 'budget', six.text_type(chart))
+            grid.set_value(line_id, 'montant', format_devise(value, 2))
+        grid.nb_lines = len(grid.records)
+        grid.order_list = None
+        grid.page_max = 1
+        grid.page_num = 0
 
     def fillresponse_body(self):
         self.get_components("title").colspan = 2
         row_id = self.get_max_row() + 1
+        budget_engine = BudgetEngine(self.filter, self.getparam('cost_accounting') is None)
 
-        expense_filter = Q(code__regex=current_system_account().get_expence_mask()) | (Q(code__regex=current_system_account().get_annexe_mask()) & Q(amount__lt=0))
-        self.fill_grid(row_id, self.model, 'budget_expense', self.model.objects.filter(self.filter & expense_filter).distinct())
+        self.fill_grid(row_id, self.model, 'budget_expense', budget_engine.get_lines(False))
         self.get_components("budget_expense").colspan = 3
         self.get_components("budget_expense").description = _("Expense")
 
-        revenue_filter = Q(code__regex=current_system_account().get_revenue_mask()) | (Q(code__regex=current_system_account().get_annexe_mask()) & Q(amount__gte=0))
-        self.fill_grid(row_id + 1, self.model, 'budget_revenue', self.model.objects.filter(self.filter & revenue_filter).distinct())
+        self.fill_grid(row_id + 1, self.model, 'budget_revenue', budget_engine.get_lines(True))
         self.get_components("budget_revenue").colspan = 3
         self.get_components("budget_revenue").description = _("Revenue")
 
-        resultat_budget = Budget.get_total(self.getparam('year'), self.getparam('cost_accounting'))
+        resultat_budget = budget_engine.get_total()
         if abs(resultat_budget) > 0.0001:
             row_id = self.get_max_row() + 1
             lbl = XferCompLabelForm('result')
@@ -258,33 +242,7 @@ class BudgetImport(XferContainerAcknowledge):
             dlg.add_action(self.get_action(TITLE_OK, "images/ok.png"), close=CLOSE_YES, params={'CONFIRME': 'YES'})
             dlg.add_action(WrapAction(TITLE_CANCEL, 'images/cancel.png'))
         else:
-            currentyear = self.getparam('currentyear', 0)
-            costaccounting = self.getparam('costaccounting', 0)
-            if cost_accounting == 0:
-                budget_filter = Q(year_id=year)
-            else:
-                budget_filter = Q(cost_accounting_id=cost_accounting)
-            for budget_line in Budget.objects.filter(budget_filter).distinct():
-                if (cost_accounting != 0) or (budget_line.cost_accounting_id is None):
-                    budget_line.delete()
-            if cost_accounting == 0:
-                for chart in ChartsAccount.objects.filter(Q(year_id=currentyear) & Q(type_of_account__in=(3, 4))).distinct():
-                    value = chart.get_current_total()
-                    for current_budget in Budget.objects.filter(year_id=year, code=chart.code):
-                        value -= current_budget.amount
-                    if abs(value) > 0.001:
-                        Budget.objects.create(code=chart.code, amount=value, year_id=year)
-            else:
-                if year == 0:
-                    year = None
-                values = {}
-                for line in EntryLineAccount.objects.filter(account__type_of_account__in=(3, 4), costaccounting_id=costaccounting).distinct():
-                    if line.account.code not in values.keys():
-                        values[line.account.code] = 0.0
-                    values[line.account.code] += line.amount
-                for code, value in values.items():
-                    if abs(value) > 0.001:
-                        Budget.objects.create(code=code, amount=value, year_id=year, cost_accounting_id=cost_accounting)
+            Budget.import_budget(year, cost_accounting, self.getparam('currentyear', 0), self.getparam('costaccounting', 0))
 
 
 @ActionsManage.affect_list(_("Budget"), "account.png")
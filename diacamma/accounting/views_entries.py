@@ -40,7 +40,8 @@ from lucterios.CORE.xferprint import XferPrintListing
 from lucterios.CORE.editors import XferSavedCriteriaSearchEditor
 from lucterios.CORE.parameters import Params
 
-from diacamma.accounting.models import EntryLineAccount, EntryAccount, FiscalYear, Journal, AccountLink, current_system_account, CostAccounting, ModelEntry
+from diacamma.accounting.models import EntryLineAccount, EntryAccount, FiscalYear, Journal, AccountLink, current_system_account, CostAccounting, ModelEntry,\
+    EntryAccountDraft
 from django.db.models.expressions import Case, When, ExpressionWrapper
 from django.db.models.fields import DecimalField
 
@@ -233,8 +234,7 @@ class EntryAccountClose(XferContainerAcknowledge):
 
     def fillresponse(self):
         if (len(self.items) > 0) and self.confirme(_("Do you want to close this entry?")):
-            for item in self.items:
-                item.closed()
+            EntryAccount.close_entries([item.id for item in self.items])
         if (len(self.items) == 1) and (self.getparam('REOPEN') == 'YES'):
             if 'entryline' in self.params.keys():
                 del self.params['entryline']
@@ -267,6 +267,21 @@ class EntryAccountLink(XferContainerAcknowledge):
             AccountLink.create_link(self.items)
 
 
+@ActionsManage.affect_grid(_("Auto-letter"), "images/left.png", unique=SELECT_NONE, condition=lambda xfer, gridname='': hasattr(xfer.item, 'year') and (xfer.item.year.status in [0, 1]))
+@MenuManage.describ('accounting.add_entryaccount')
+class EntryAccountAutoLink(XferContainerAcknowledge):
+    icon = "entry.png"
+    model = EntryAccount
+    field_id = '???'
+    caption = _("Automatic lettering")
+
+    def fillresponse(self, year=0):
+        current_year = FiscalYear.get_current(year)
+        if self.confirme(_("Do you want to letter automatically the third entries of this fiscal year?")):
+            links = AccountLink.auto_link(current_year)
+            self.message(_("%(nb_link)d letters created for %(nb_entry)d entries.") % {'nb_link': len(links), 'nb_entry': sum([len(entry_ids) for entry_ids in links])})
+
+
 @ActionsManage.affect_grid(_("Cost"), "images/edit.png", unique=SELECT_MULTI, condition=lambda xfer, gridname='': len(CostAccounting.objects.filter(status=0)) > 0)
 @MenuManage.describ('accounting.add_entryaccount')
 class EntryAccountCostAccounting(XferContainerAcknowledge):
@@ -341,7 +356,7 @@ class EntryAccountOpenFromLine(XferContainerAcknowledge):
         if field_id != '':
             self.item = EntryAccount.objects.get(id=self.getparam(field_id, 0))
             self.params['entryaccount'] = self.item.id
-        for old_key in ["SAVE", 'entrylineaccount', 'entrylineaccount_link', 'third', 'reference', 'serial_entry', 'costaccounting']:
+        for old_key in ["SAVE", 'entrylineaccount', 'entrylineaccount_link', 'third', 'reference', 'serial_entry', 'entrydraft', 'costaccounting']:
             if old_key in self.params.keys():
                 del self.params[old_key]
         if self.item.close:
@@ -405,7 +420,9 @@ class EntryAccountUnlock(XferContainerAcknowledge):
     field_id = 'entryaccount'
 
     def fillresponse(self):
-        self.item.delete_if_ghost_entry()
+        if not self.item.delete_if_ghost_entry():
+            EntryAccountDraft.objects.filter(id=self.getparam('entrydraft', 0), entry=self.item).delete()
+        EntryAccountDraft.clear_expired()
 
 
 @ActionsManage.affect_other('', '')
@@ -430,7 +447,8 @@ class EntryAccountValidate(XferContainerAcknowledge):
     field_id = 'entryaccount'
     caption = _("Validate entry line of account")
 
-    def fillresponse(self, serial_entry=''):
+    def fillresponse(self):
+        entry_draft = EntryAccountDraft.get_draft(self.item, self)
         save = XferSave()
         save.model = self.model
         save.field_id = self.field_id
@@ -438,8 +456,10 @@ class EntryAccountValidate(XferContainerAcknowledge):
         save._initialize(self.request)
         save.params["SAVE"] = "YES"
         save.fillresponse()
-        self.item.save_entrylineaccounts(serial_entry)
-        for old_key in ['date_value', 'designation', 'SAVE', 'serial_entry']:
+        self.item.save_entrylineaccounts(entry_draft.get_serial())
+        entry_draft.delete()
+        EntryAccountDraft.clear_expired()
+        for old_key in ['date_value', 'designation', 'SAVE', 'serial_entry', 'entrydraft']:
             if old_key in self.params.keys():
                 del self.params[old_key]
         self.redirect_action(EntryAccountEdit.get_action())
@@ -453,7 +473,7 @@ class EntryAccountReverse(XferContainerAcknowledge):
     caption = _("Reverse entry lines of account")
 
     def fillresponse(self):
-        for old_key in ['serial_entry']:
+        for old_key in ['serial_entry', 'entrydraft']:
             if old_key in self.params.keys():
                 del self.params[old_key]
         for line in self.item.entrylineaccount_set.all():
@@ -532,14 +552,15 @@ class EntryLineAccountAdd(XferContainerAcknowledge):
     field_id = 'entrylineaccount'
     caption = _("Save entry line of account")
 
-    def fillresponse(self, entryaccount=0, entrylineaccount_serial=0, serial_entry='', num_cpt=0, credit_val=0.0, debit_val=0.0, third=0, costaccounting=0, reference='None'):
+    def fillresponse(self, entryaccount=0, entrylineaccount_serial=0, num_cpt=0, credit_val=0.0, debit_val=0.0, third=0, costaccounting=0, reference='None'):
+        entry = EntryAccount.objects.get(id=entryaccount)
+        entry_draft = EntryAccountDraft.get_draft(entry, self)
         if (credit_val > 0.0001) or (debit_val > 0.0001):
-            for old_key in ['num_cpt_txt', 'num_cpt', 'credit_val', 'debit_val', 'third', 'reference', 'entrylineaccount_serial', 'serial_entry']:
+            for old_key in ['num_cpt_txt', 'num_cpt', 'credit_val', 'debit_val', 'third', 'reference', 'entrylineaccount_serial', 'entrydraft']:
                 if old_key in self.params.keys():
                     del self.params[old_key]
-            entry = EntryAccount.objects.get(id=entryaccount)
-            serial_entry = entry.add_new_entryline(serial_entry, entrylineaccount_serial, num_cpt, credit_val, debit_val, third, costaccounting, reference)
-        self.redirect_action(EntryAccountEdit.get_action(), params={"serial_entry": serial_entry})
+            entry.add_new_entryline(entry_draft, entrylineaccount_serial, num_cpt, credit_val, debit_val, third, costaccounting, reference)
+        self.redirect_action(EntryAccountEdit.get_action(), params={"entrydraft": entry_draft.id})
 
 
 @ActionsManage.affect_grid(TITLE_MODIFY, "images/edit.png", unique=SELECT_SINGLE, close=CLOSE_YES)
@@ -550,13 +571,15 @@ class EntryLineAccountEdit(XferContainerCustom):
     field_id = 'entrylineaccount'
     caption = _("Modify entry line of account")
 
-    def fillresponse(self, entryaccount, entrylineaccount_serial=0, serial_entry=''):
+    def fillresponse(self, entryaccount, entrylineaccount_serial=0):
         if 'reference' in self.params.keys():
             del self.params['reference']
         entry = EntryAccount.objects.get(id=entryaccount)
-        for line in entry.get_entrylineaccounts(serial_entry):
-            if line.id == entrylineaccount_serial:
-                self.item = line
+        entry_draft = EntryAccountDraft.get_draft(entry, self)
+        self.params['entrydraft'] = entry_draft.id
+        line = entry_draft.get_line(entrylineaccount_serial)
+        if line is not None:
+            self.item = line
         img = XferCompImage('img')
         img.set_value(self.icon_path())
         img.set_location(0, 0, 1, 6)
@@ -576,10 +599,11 @@ class EntryLineAccountDel(XferContainerAcknowledge):
     field_id = 'entrylineaccount'
     caption = _("Delete entry line of account")
 
-    def fillresponse(self, entryaccount=0, entrylineaccount_serial=0, serial_entry=''):
-        for old_key in ['serial_entry', 'entrylineaccount_serial']:
+    def fillresponse(self, entryaccount=0, entrylineaccount_serial=0):
+        entry = EntryAccount.objects.get(id=entryaccount)
+        entry_draft = EntryAccountDraft.get_draft(entry, self)
+        for old_key in ['entrylineaccount_serial', 'entrydraft']:
             if old_key in self.params.keys():
                 del self.params[old_key]
-        entry = EntryAccount.objects.get(id=entryaccount)
-        serial_entry = entry.remove_entrylineaccounts(serial_entry, entrylineaccount_serial)
-        self.redirect_action(EntryAccountEdit.get_action(), params={"serial_entry": serial_entry})
+        entry_draft.remove_line(entrylineaccount_serial)
+        self.redirect_action(EntryAccountEdit.get_action(), params={"entrydraft": entry_draft.id})
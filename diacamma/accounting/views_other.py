@@ -48,6 +48,9 @@ class CostAccountingList(XferListEditor):
         comp_status.set_value(status_filter)
         comp_status.set_action(self.request, self.get_action(), close=CLOSE_NO, modal=FORMTYPE_REFRESH)
 
+    def get_items_from_filter(self):
+        return CostAccounting.annotate_totals(XferListEditor.get_items_from_filter(self))
+
     def fillresponse(self):
         XferListEditor.fillresponse(self)
         self.get_components('title').colspan += 1
@@ -91,10 +94,8 @@ class CostAccountingReportByDate(XferContainerAcknowledge):
             dlg.add_action(self.get_action(TITLE_OK, 'images/ok.png'))
             dlg.add_action(WrapAction(TITLE_CANCEL, 'images/cancel.png'))
         else:
-            list_cost = []
-            for cost_item in CostAccounting.objects.filter(Q(entrylineaccount__entry__date_value__gte=begin_date) & Q(entrylineaccount__entry__date_value__lte=end_date)).distinct():
-                list_cost.append(six.text_type(cost_item.id))
-            list_cost = set(list_cost)
+            cost_ids = CostAccounting.objects.filter(Q(entrylineaccount__entry__date_value__gte=begin_date) & Q(entrylineaccount__entry__date_value__lte=end_date)).order_by('id').distinct().values_list('id', flat=True)
+            list_cost = [six.text_type(cost_id) for cost_id in cost_ids]
             if len(list_cost) == 0:
                 raise LucteriosException(IMPORTANT, _("No cost accounting finds for this range !"))
             self.redirect_action(CostAccountingIncomeStatement.get_action(), modal=FORMTYPE_NOMODAL, close=CLOSE_YES, params={'begin_date': begin_date, 'end_date': end_date, 'costaccounting': ";".join(list_cost)})
@@ -24,25 +24,30 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 import sys
+import re
+from csv import writer
+from os.path import join
 from datetime import date, datetime
 
 from django.utils.translation import ugettext_lazy as _
-from django.db.models import Q
+from django.db.models import Q, Case, When, Value, FloatField
 from django.db.models.aggregates import Sum
 from django.utils import six, formats
 
 from lucterios.framework.tools import MenuManage, FORMTYPE_NOMODAL, CLOSE_NO, FORMTYPE_REFRESH, WrapAction, convert_date, ActionsManage, SELECT_MULTI
 from lucterios.framework.xfergraphic import XferContainerCustom
-from lucterios.framework.xfercomponents import XferCompImage, XferCompSelect, XferCompLabelForm, XferCompGrid, XferCompEdit, XferCompCheck
+from lucterios.framework.xfercomponents import XferCompImage, XferCompSelect, XferCompLabelForm, XferCompGrid, XferCompEdit, XferCompCheck,\
+    XferCompDownLoad, GRID_PAGE, GRID_SIZE
+from lucterios.framework.filetools import get_user_path
 from lucterios.framework.xferadvance import TITLE_PRINT, TITLE_CLOSE
 from lucterios.framework.models import get_value_converted
 from lucterios.contacts.models import LegalEntity
 from lucterios.CORE.xferprint import XferPrintAction
 
-from diacamma.accounting.models import FiscalYear, format_devise, EntryLineAccount, ChartsAccount, CostAccounting, Third
-from diacamma.accounting.tools import correct_accounting_code, current_system_account
+from diacamma.accounting.models import FiscalYear, format_devise, EntryLineAccount, CostAccounting
+from diacamma.accounting.tools import correct_accounting_code, current_system_account, format_devise_list
 from diacamma.accounting.tools_reports import get_spaces, convert_query_to_account,\
-    add_cell_in_grid, fill_grid, add_item_in_grid
+    add_cell_in_grid, fill_grid, get_accounts_by_id, get_thirds_by_id, clean_report_text, CostAccountingReportEngine
 from lucterios.CORE.parameters import Params
 
 
@@ -94,8 +99,7 @@ class FiscalYearReport(XferContainerCustom):
         new_begin = convert_date(self.getparam("begin"), self.item.begin)
         new_end = convert_date(self.getparam("end"), self.item.end)
         if (new_begin >= self.item.begin) and (new_end <= self.item.end):
-            self.item.begin = new_begin
-            self.item.end = new_end
+            self.item.set_period(new_begin, new_end)
         img = XferCompImage('img')
         img.set_value(self.icon_path())
         img.set_location(0, 0, 1, 3)
@@ -217,16 +221,16 @@ class FiscalYearReport(XferContainerCustom):
         return line_idx
 
     def _add_left_right_accounting(self, left_filter, rigth_filter, total_in_left):
-        data_line_left, total1_left, total2_left, totalb_left = convert_query_to_account(
-            self.filter & left_filter, self.lastfilter & left_filter if self.lastfilter is not None else None, self.budgetfilter_left)
-        data_line_right, total1_right, total2_right, totalb_right = convert_query_to_account(
-            self.filter & rigth_filter, self.lastfilter & rigth_filter if self.lastfilter is not None else None, self.budgetfilter_right)
-        line_idx = 0
-        for line_idx in range(max(len(data_line_left), len(data_line_right))):
-            if line_idx < len(data_line_left):
-                add_item_in_grid(self.grid, self.line_offset + line_idx, 'left', data_line_left[line_idx])
-            if line_idx < len(data_line_right):
-                add_item_in_grid(self.grid, self.line_offset + line_idx, 'right', data_line_right[line_idx])
+        values_left = convert_query_to_account(self.filter & left_filter, self.lastfilter & left_filter if self.lastfilter is not None else None, self.budgetfilter_left)
+        values_right = convert_query_to_account(self.filter & rigth_filter, self.lastfilter & rigth_filter if self.lastfilter is not None else None, self.budgetfilter_right)
+        return self._fill_left_right_accounting(values_left, values_right, total_in_left)
+
+    def _fill_left_right_accounting(self, values_left, values_right, total_in_left):
+        data_line_left, total1_left, total2_left, totalb_left = values_left
+        data_line_right, total1_right, total2_right, totalb_right = values_right
+        fill_grid(self.grid, self.line_offset, 'left', data_line_left)
+        fill_grid(self.grid, self.line_offset, 'right', data_line_right)
+        line_idx = max(len(data_line_left), len(data_line_right), 1) - 1
         return self.add_total_in_grid(total_in_left, total1_left, total2_left, totalb_left, total1_right, total2_right, totalb_right, line_idx)
 
     def calcul_table(self):
@@ -324,17 +328,22 @@ class FiscalYearIncomeStatement(FiscalYearReport):
             self.add_component(lbl)
 
     def show_annexe(self, line_idx, budgetfilter):
-        add_cell_in_grid(self.grid, self.line_offset + line_idx + 1, 'left', '')
-        other_filter = Q(account__code__regex=current_system_account().get_annexe_mask())
+        other_filter = Q(account__is_annexe=True)
         budget_other = Q(code__regex=current_system_account().get_annexe_mask())
-        data_line_left, anx_total1_left, anx_total2_left, anx_totalb_left = convert_query_to_account(self.filter & other_filter,
-                                                                                                     self.lastfilter & other_filter if self.lastfilter is not None else None,
-                                                                                                     budgetfilter & budget_other,
-                                                                                                     sign_value=-1)
-        data_line_right, anx_total1_right, anx_total2_right, anx_totalb_right = convert_query_to_account(self.filter & other_filter,
-                                                                                                         self.lastfilter & other_filter if self.lastfilter is not None else None,
-                                                                                                         budgetfilter & budget_other,
-                                                                                                         sign_value=1)
+        values_left = convert_query_to_account(self.filter & other_filter,
+                                               self.lastfilter & other_filter if self.lastfilter is not None else None,
+                                               budgetfilter & budget_other,
+                                               sign_value=-1)
+        values_right = convert_query_to_account(self.filter & other_filter,
+                                                self.lastfilter & other_filter if self.lastfilter is not None else None,
+                                                budgetfilter & budget_other,
+                                                sign_value=1)
+        return self._fill_annexe(line_idx, values_left, values_right)
+
+    def _fill_annexe(self, line_idx, values_left, values_right):
+        data_line_left, anx_total1_left, anx_total2_left, anx_totalb_left = values_left
+        data_line_right, anx_total1_right, anx_total2_right, anx_totalb_right = values_right
+        add_cell_in_grid(self.grid, self.line_offset + line_idx + 1, 'left', '')
         if (len(data_line_left) > 0) or (len(data_line_right) > 0):
             add_cell_in_grid(self.grid, self.line_offset + line_idx + 1, 'left', get_spaces(20) + "{[i]}%s{[/i]}" % _('annexe'))
             add_cell_in_grid(self.grid, self.line_offset + line_idx + 1, 'right', get_spaces(20) + "{[i]}%s{[/i]}" % _('annexe'))
@@ -379,13 +388,12 @@ class FiscalYearLedger(FiscalYearReport):
     caption = _("Ledger")
     add_filtering = True
     force_date_filter = True
+    chunk_size = 2000
 
     def __init__(self, **kwargs):
         FiscalYearReport.__init__(self, **kwargs)
-        self.last_account = None
-        self.last_third = None
-        self.last_total = 0
         self.line_idx = 1
+        self.no_pager = True
 
     def define_gridheader(self):
         self.grid = XferCompGrid('report_%d' % self.item.id)
@@ -396,39 +404,105 @@ class FiscalYearLedger(FiscalYearReport):
         self.grid.add_header('debit', _('debit'))
         self.grid.add_header('credit', _('credit'))
 
-    def _add_total_account(self):
-        if self.last_account is not None:
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', get_spaces(30) + "{[i]}%s{[/i]}" % _('total'))
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'debit', "{[i]}%s{[/i]}" %
-                             format_devise(max((0, -1 * self.last_account.credit_debit_way() * self.last_total)), 0))
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'credit', "{[i]}%s{[/i]}" %
-                             format_devise(max((0, self.last_account.credit_debit_way() * self.last_total)), 0))
-            self.line_idx += 1
-            add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', '{[br/]}')
-            self.line_idx += 1
-            self.last_total = 0
+    def _get_total_account(self, account, total):
+        return [{'entry.designation': get_spaces(30) + "{[i]}%s{[/i]}" % _('total'),
+                 'debit': "{[i]}%s{[/i]}" % format_devise(max((0, -1 * account.credit_debit_way() * total)), 0),
+                 'credit': "{[i]}%s{[/i]}" % format_devise(max((0, account.credit_debit_way() * total)), 0)},
+                {'entry.designation': '{[br/]}'}]
+
+    def _get_line_values(self, line):
+        return {'entry.num': six.text_type(get_value_converted(line.entry.num, True)),
+                'entry.date_entry': six.text_type(get_value_converted(line.entry.date_entry, True)),
+                'entry.date_value': six.text_type(get_value_converted(line.entry.date_value, True)),
+                'entry.designation': six.text_type(line.entry.designation),
+                'debit': six.text_type(line.debit),
+                'credit': six.text_type(line.credit)}
+
+    def get_ledger_rows(self):
+        last_account = None
+        last_third_id = None
+        last_total = 0
+        entry_lines = EntryLineAccount.objects.filter(self.filter).distinct().order_by('account__code', 'entry__date_value', 'third')
+        entry_lines = entry_lines.select_related('account', 'entry', 'third', 'third__contact', 'third__contact__legalentity', 'third__contact__individual')
+        for line in entry_lines.iterator(chunk_size=self.chunk_size):
+            if (last_account is None) or (last_account.id != line.account_id):
+                if last_account is not None:
+                    for row in self._get_total_account(last_account, last_total):
+                        yield row
+                last_account = line.account
+                last_third_id = None
+                last_total = 0
+                yield {'entry.designation': get_spaces(15) + "{[u]}{[b]}%s{[/b]}{[/u]}" % six.text_type(last_account)}
+            if last_third_id != line.third_id:
+                yield {'entry.designation': get_spaces(8) + "{[b]}%s{[/b]}" % six.text_type(line.entry_account)}
+            last_third_id = line.third_id
+            yield self._get_line_values(line)
+            last_total += line.amount
+        if last_account is not None:
+            for row in self._get_total_account(last_account, last_total):
+                yield row
 
     def calcul_table(self):
-        self.line_idx = 1
-        self.last_account = None
-        self.last_third = None
-        self.last_total = 0
-        for line in EntryLineAccount.objects.filter(self.filter).distinct().order_by('account__code', 'entry__date_value', 'third'):
-            if self.last_account != line.account:
-                self._add_total_account()
-                self.last_account = line.account
-                self.last_third = None
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', get_spaces(15) + "{[u]}{[b]}%s{[/b]}{[/u]}" % six.text_type(self.last_account))
-                self.line_idx += 1
-            if self.last_third != line.third:
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, 'entry.designation', get_spaces(8) + "{[b]}%s{[/b]}" % six.text_type(line.entry_account))
-                self.line_idx += 1
-            self.last_third = line.third
-            for header in self.grid.headers:
-                add_cell_in_grid(self.grid, self.line_offset + self.line_idx, header.name, line.evaluate('#' + header.name))
-            self.last_total += line.amount
-            self.line_idx += 1
-        self._add_total_account()
+        printing = self.getparam('PRINTING', False)
+        size_by_page = self.getparam(GRID_SIZE + self.grid.name, self.grid.size_by_page)
+        page_num = self.getparam(GRID_PAGE + self.grid.name, 0)
+        record_min = page_num * size_by_page
+        record_max = (page_num + 1) * size_by_page
+        nb_lines = 0
+        for row in self.get_ledger_rows():
+            if printing or ((nb_lines >= record_min) and (nb_lines < record_max)):
+                for colname, value in row.items():
+                    add_cell_in_grid(self.grid, self.line_offset + nb_lines + 1, colname, value)
+            nb_lines += 1
+        if not printing and (page_num > 0) and (record_min >= nb_lines):
+            self.params[GRID_PAGE + self.grid.name] = 0
+            return self.calcul_table()
+        self.line_idx = nb_lines + 1
+        self.grid.nb_lines = nb_lines
+        if printing:
+            self.grid.size_by_page = nb_lines
+            self.grid.page_max = 1
+            self.grid.page_num = 0
+            self.no_pager = True
+        else:
+            self.grid.size_by_page = size_by_page
+            self.grid.page_max = int(nb_lines / size_by_page) + 1
+            self.grid.page_num = page_num
+            self.no_pager = False
+
+    def fill_body(self):
+        FiscalYearReport.fill_body(self)
+        self.grid.no_pager = self.no_pager
+
+    def fill_buttons(self):
+        self.add_action(FiscalYearLedgerExport.get_action(_('Export'), "images/down.png"), close=CLOSE_NO)
+        FiscalYearReport.fill_buttons(self)
+
+
+@MenuManage.describ('accounting.change_fiscalyear')
+class FiscalYearLedgerExport(FiscalYearLedger):
+    caption = _("Export ledger")
+
+    def write_ledger(self, file_name):
+        with open(file_name, 'w', encoding='utf-8', newline='') as csv_file:
+            csv_writer = writer(csv_file, delimiter=';')
+            csv_writer.writerow([six.text_type(header.descript) for header in self.grid.headers])
+            for row in self.get_ledger_rows():
+                values = [clean_report_text(row.get(header.name, '')) for header in self.grid.headers]
+                if ''.join(values) != '':
+                    csv_writer.writerow(values)
+
+    def fillresponse(self):
+        self.fill_header()
+        file_name = "ledger_%s.csv" % six.text_type(self.item.id)
+        self.write_ledger(get_user_path("accounting", file_name))
+        down = XferCompDownLoad('filename')
+        down.compress = False
+        down.set_value('ledger_%s_%s.csv' % (self.item.begin.isoformat(), self.item.end.isoformat()))
+        down.set_download(join("accounting", file_name))
+        down.set_location(1, 11, 5)
+        self.add_component(down)
+        self.add_action(WrapAction(TITLE_CLOSE, 'images/close.png'))
 
 
 @MenuManage.describ('accounting.change_fiscalyear', FORMTYPE_NOMODAL, 'bookkeeping', _('Show trial balance for current fiscal year'))
@@ -471,43 +545,55 @@ class FiscalYearTrialBalance(FiscalYearReport):
             fields = ['account', 'third']
         else:
             fields = ['account']
-        data_line_positifs = list(EntryLineAccount.objects.filter(self.filter & Q(amount__gt=0)).order_by(*fields).values(*fields).annotate(data_sum=Sum('amount')))
-        data_line_negatifs = list(EntryLineAccount.objects.filter(self.filter & Q(amount__lt=0)).order_by(*fields).values(*fields).annotate(data_sum=Sum('amount')))
-        for data_line in data_line_positifs + data_line_negatifs:
-            if abs(data_line['data_sum']) > 0.0001:
-                account = ChartsAccount.objects.get(id=data_line['account'])
-                account_code = correct_accounting_code(account.code)
-                if ('third' in data_line.keys()) and (data_line['third'] is not None):
-                    account_code = "%s#%s" % (account_code, data_line['third'])
+        data_lines = list(EntryLineAccount.objects.filter(self.filter).order_by(*fields).values(*fields).annotate(
+            sum_positive=Sum(Case(When(amount__gt=0, then='amount'), default=Value(0.0), output_field=FloatField())),
+            sum_negative=Sum(Case(When(amount__lt=0, then='amount'), default=Value(0.0), output_field=FloatField()))))
+        accounts = get_accounts_by_id([data_line['account'] for data_line in data_lines])
+        thirds = get_thirds_by_id([data_line['third'] for data_line in data_lines]) if self.with_third else {}
+        for data_line in data_lines:
+            account = accounts[data_line['account']]
+            account_code = correct_accounting_code(account.code)
+            third_id = data_line.get('third')
+            if third_id is not None:
+                account_code = "%s#%s" % (account_code, third_id)
+            for data_sum in (data_line['sum_positive'], data_line['sum_negative']):
+                if (data_sum is None) or (abs(data_sum) <= 0.0001):
+                    continue
                 if account_code not in balance_values.keys():
-                    if ('third' in data_line.keys()) and (data_line['third'] is not None):
-                        third = Third.objects.get(id=data_line['third'])
-                        account_title = "[%s %s]" % (account.code, six.text_type(third))
+                    if third_id is not None:
+                        account_title = "[%s %s]" % (account.code, six.text_type(thirds[third_id]))
                     else:
                         account_title = account.get_name()
                     balance_values[account_code] = [account_title, 0, 0]
-                if (account.credit_debit_way() * data_line['data_sum']) > 0.0001:
-                    balance_values[account_code][2] = account.credit_debit_way() * data_line['data_sum']
+                if (account.credit_debit_way() * data_sum) > 0.0001:
+                    balance_values[account_code][2] = account.credit_debit_way() * data_sum
                 else:
-                    balance_values[account_code][1] = -1 * account.credit_debit_way() * data_line['data_sum']
+                    balance_values[account_code][1] = -1 * account.credit_debit_way() * data_sum
         return balance_values
 
     def calcul_table(self):
         line_idx = 1
         balance_values = self._get_balance_values()
-        keys = sorted(balance_values.keys())
-        for key in keys:
+        balance_lines = []
+        for key in sorted(balance_values.keys()):
             diff = balance_values[key][1] - balance_values[key][2]
             if (self.only_nonull is False) or (abs(diff) > 0.0001):
-                add_cell_in_grid(self.grid, self.line_offset + line_idx, 'designation', balance_values[key][0])
-                add_cell_in_grid(self.grid, self.line_offset + line_idx, 'total_debit', format_devise(balance_values[key][1], 5))
-                add_cell_in_grid(self.grid, self.line_offset + line_idx, 'total_credit', format_devise(balance_values[key][2], 5))
-                add_cell_in_grid(self.grid, self.line_offset + line_idx, 'solde_debit', format_devise(max(0, diff), 0))
-                if abs(diff) < 0.0001:
-                    add_cell_in_grid(self.grid, self.line_offset + line_idx, 'solde_credit', format_devise(0, 5))
-                else:
-                    add_cell_in_grid(self.grid, self.line_offset + line_idx, 'solde_credit', format_devise(max(0, -1 * diff), 0))
-                line_idx += 1
+                balance_lines.append((balance_values[key], diff))
+        total_debits = format_devise_list([balance_value[1] for balance_value, _diff in balance_lines], 5)
+        total_credits = format_devise_list([balance_value[2] for balance_value, _diff in balance_lines], 5)
+        solde_debits = format_devise_list([max(0, diff) for _balance_value, diff in balance_lines], 0)
+        solde_credits = format_devise_list([max(0, -1 * diff) for _balance_value, diff in balance_lines], 0)
+        solde_null = format_devise(0, 5)
+        for balance_idx, (balance_value, diff) in enumerate(balance_lines):
+            add_cell_in_grid(self.grid, self.line_offset + line_idx, 'designation', balance_value[0])
+            add_cell_in_grid(self.grid, self.line_offset + line_idx, 'total_debit', total_debits[balance_idx])
+            add_cell_in_grid(self.grid, self.line_offset + line_idx, 'total_credit', total_credits[balance_idx])
+            add_cell_in_grid(self.grid, self.line_offset + line_idx, 'solde_debit', solde_debits[balance_idx])
+            if abs(diff) < 0.0001:
+                add_cell_in_grid(self.grid, self.line_offset + line_idx, 'solde_credit', solde_null)
+            else:
+                add_cell_in_grid(self.grid, self.line_offset + line_idx, 'solde_credit', solde_credits[balance_idx])
+            line_idx += 1
 
 
 @MenuManage.describ('accounting.change_fiscalyear')
@@ -653,16 +739,12 @@ class CostAccountingIncomeStatement(CostAccountingReport, FiscalYearIncomeStatem
         res1, res2, resb = (0, 0, 0)
         self.addNameCol = True
         self.lastfilter = True
+        self.report_engine = CostAccountingReportEngine(self.items, self.date_begin, self.date_end)
         self.item = self.items[len(self.items) - 1]
         self.define_gridheader()
         for self.item in self.items:
             add_cell_in_grid(self.grid, self.line_offset, 'name', '{[b]}{[u]}%s{[/u]}{[/b]}' % self.item)
             self.line_offset += 1
-            self.filter = Q(costaccounting=self.item)
-            if self.date_begin is not None:
-                self.filter &= Q(entry__date_value__gte=self.date_begin)
-            if self.date_end is not None:
-                self.filter &= Q(entry__date_value__lte=self.date_end)
             self.fill_filterheader()
             all_have_last = all_have_last or (self.lastfilter is not None)
             self.calcul_table()
@@ -673,8 +755,8 @@ class CostAccountingIncomeStatement(CostAccountingReport, FiscalYearIncomeStatem
                 tot_b += totalb_left
             if total2_left:
                 tot_n1 += total2_left
-            subres1, subres2, subresb = self.result
-            res1 -= subres1
+            _subres1, subres2, subresb = self.result
+            res1 -= self.report_engine.get_result(self.item.id)
             res2 -= subres2
             resb -= subresb
             self.fill_body()
@@ -713,12 +795,13 @@ class CostAccountingIncomeStatement(CostAccountingReport, FiscalYearIncomeStatem
         self.fill_buttons()
 
     def fill_filterheader(self):
-        if self.item.last_costaccounting is not None:
-            self.lastfilter = Q(costaccounting=self.item.last_costaccounting)
+        if self.item.last_costaccounting_id is not None:
+            self.lastfilter = Q(costaccounting_id=self.item.last_costaccounting_id)
         else:
             self.lastfilter = None
 
     def calcul_table(self):
+        system_account = current_system_account()
         if (self.date_begin is not None) or (self.date_end is not None):
             self.budgetfilter_right = None
             self.budgetfilter_left = None
@@ -727,11 +810,21 @@ class CostAccountingIncomeStatement(CostAccountingReport, FiscalYearIncomeStatem
             self.grid.delete_header('left_n_1')
             self.grid.delete_header('right_b')
             self.grid.delete_header('right_n_1')
+            revenue_regex = None
+            expense_regex = None
         else:
-            self.budgetfilter_right = Q(cost_accounting=self.item) & Q(code__regex=current_system_account().get_revenue_mask())
-            self.budgetfilter_left = Q(cost_accounting=self.item) & Q(code__regex=current_system_account().get_expence_mask())
-        line_idx = self._add_left_right_accounting(Q(account__type_of_account=4), Q(account__type_of_account=3), True)
-        self.show_annexe(line_idx, Q(cost_accounting=self.item))
+            self.budgetfilter_right = Q(cost_accounting=self.item) & Q(code__regex=system_account.get_revenue_mask())
+            self.budgetfilter_left = Q(cost_accounting=self.item) & Q(code__regex=system_account.get_expence_mask())
+            revenue_regex = re.compile(system_account.get_revenue_mask())
+            expense_regex = re.compile(system_account.get_expence_mask())
+        with_last = self.lastfilter is not None
+        line_idx = self._fill_left_right_accounting(self.report_engine.convert_to_account(self.item.id, lambda account: account.type_of_account == 4, expense_regex, with_last=with_last),
+                                                    self.report_engine.convert_to_account(self.item.id, lambda account: account.type_of_account == 3, revenue_regex, with_last=with_last),
+                                                    True)
+        annexe_regex = re.compile(system_account.get_annexe_mask())
+        self._fill_annexe(line_idx,
+                          self.report_engine.convert_to_account(self.item.id, lambda account: account.is_annexe, annexe_regex, sign_value=-1, with_last=with_last),
+                          self.report_engine.convert_to_account(self.item.id, lambda account: account.is_annexe, annexe_regex, sign_value=1, with_last=with_last))
 
 
 @ActionsManage.affect_grid(_("Ledger"), 'images/print.png', unique=SELECT_MULTI, modal=FORMTYPE_NOMODAL)
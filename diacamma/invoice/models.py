@@ -27,7 +27,7 @@ from re import match
 import logging
 from os.path import exists, join, dirname
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models.aggregates import Max, Sum
 from django.db.models.functions import Concat
 from django.db.models import Q, Value, F
@@ -47,8 +47,9 @@ from lucterios.CORE.models import Parameter, SavedCriteria
 from lucterios.CORE.parameters import Params
 from lucterios.contacts.models import CustomField, CustomizeObject
 
-from diacamma.accounting.models import FiscalYear, Third, EntryAccount, CostAccounting, Journal, EntryLineAccount, ChartsAccount, AccountThird
-from diacamma.accounting.tools import current_system_account, format_devise, currency_round, correct_accounting_code
+from diacamma.accounting.models import FiscalYear, Third, EntryAccount, CostAccounting, Journal, EntryLineAccount, ChartsAccount, AccountThird,\
+    NumberSequence
+from diacamma.accounting.tools import current_system_account, format_devise, currency_round, correct_accounting_code, get_param_value
 from diacamma.payoff.models import Supporting, Payoff
 from datetime import timedelta
 
@@ -486,7 +487,7 @@ class Bill(Supporting):
 
     @property
     def total(self):
-        if Params.getvalue("invoice-vat-mode") == 2:
+        if get_param_value("invoice-vat-mode") == 2:
             return self.total_incltax
         else:
             return self.total_excltax
@@ -694,7 +695,7 @@ class Bill(Supporting):
             detail_item = detail_list[detail_key]
             if abs(detail_item[1]) > 0.0001:
                 EntryLineAccount.objects.create(account=detail_item[0], amount=is_bill * detail_item[1], entry=self.entry, costaccounting_id=detail_item[2])
-        if Params.getvalue("invoice-vat-mode") != 0:
+        if get_param_value("invoice-vat-mode") != 0:
             vat_val = {}
             for detail in self.detail_set.all():
                 if (detail.article is not None) and (detail.article.vat is not None):
@@ -720,18 +721,16 @@ class Bill(Supporting):
 
     @transition(field=status, source=0, target=1, conditions=[lambda item:item.get_info_state() == ''])
     def valid(self):
-        self.fiscal_year = FiscalYear.get_current()
-        bill_list = Bill.objects.filter(Q(bill_type=self.bill_type) & Q(fiscal_year=self.fiscal_year)).exclude(status=0)
-        val = bill_list.aggregate(Max('num'))
-        if val['num__max'] is None:
-            self.num = 1
-        else:
-            self.num = val['num__max'] + 1
-        self.status = 1
-        if self.bill_type != 0:
-            self.generate_entry()
-            self.generate_storage()
-        self.save()
+        with transaction.atomic():
+            self.fiscal_year = FiscalYear.get_current()
+            bill_list = Bill.objects.filter(Q(bill_type=self.bill_type) & Q(fiscal_year=self.fiscal_year)).exclude(status=0)
+            self.num = NumberSequence.reserve(Bill._meta.label, self.fiscal_year.id, sub_type=self.bill_type,
+                                              get_last_num=lambda: bill_list.aggregate(Max('num'))['num__max'])
+            self.status = 1
+            if self.bill_type != 0:
+                self.generate_entry()
+                self.generate_storage()
+            self.save()
         Signal.call_signal("change_bill", 'valid', self, None)
 
     transitionname__archive = _("Archive")
@@ -1013,16 +1012,16 @@ class Detail(LucteriosModel):
         return newdetail
 
     def get_price(self):
-        if (Params.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
+        if (get_param_value("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
             return currency_round(self.price * self.vta_rate)
-        if (Params.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
+        if (get_param_value("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
             return currency_round(self.price * -1 * self.vta_rate / (1 - self.vta_rate))
         return float(self.price)
 
     def get_reduce(self):
-        if (Params.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
+        if (get_param_value("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
             return currency_round(self.reduce * self.vta_rate)
-        if (Params.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
+        if (get_param_value("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
             return currency_round(self.reduce * -1 * self.vta_rate / (1 - self.vta_rate))
         return float(self.reduce)
 
@@ -1063,9 +1062,9 @@ class Detail(LucteriosModel):
 
     @property
     def total(self):
-        if Params.getvalue("invoice-vat-mode") == 2:
+        if get_param_value("invoice-vat-mode") == 2:
             return self.total_incltax
-        elif Params.getvalue("invoice-vat-mode") == 1:
+        elif get_param_value("invoice-vat-mode") == 1:
             return self.total_excltax
         else:
             return format_devise(self.get_total(), 5)
@@ -1442,12 +1442,12 @@ class BillTest(InvoiceTest):
                       {'year': '1', 'journal': '-1', 'filter': '0'}, False)
         self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountList')
         self.assert_count_equal('entryline', 6)
-        self.assert_json_equal('', 'entryline/@5/entry.link', 'A')
-        self.assert_json_equal('', 'entryline/@4/entry.link', 'A')
-        self.assert_json_equal('', 'entryline/@3/entry.link', 'A')
-        self.assert_json_equal('', 'entryline/@2/entry.link', 'A')
-        self.assert_json_equal('', 'entryline/@1/entry.link', 'A')
-        self.assert_json_equal('', 'entryline/@0/entry.link', 'A')
+        self.assert_json_equal('', 'entryline/@5/entry.link', 'E')
+        self.assert_json_equal('', 'entryline/@4/entry.link', 'E')
+        self.assert_json_equal('', 'entryline/@3/entry.link', 'E')
+        self.assert_json_equal('', 'entryline/@2/entry.link', 'E')
+        self.assert_json_equal('', 'entryline/@1/entry.link', 'E')
+        self.assert_json_equal('', 'entryline/@0/entry.link', 'E')
         self.assert_json_equal('LABELFORM', 'result', '{[center]}{[b]}Produit :{[/b]} 150.00€ - {[b]}Charge :{[/b]} 0.00€ = {[b]}Résultat :{[/b]} 150.00€{[br/]}{[b]}Trésorerie :{[/b]} 150.00€ - {[b]}Validé :{[/b]} 0.00€{[/center]}')
 
     def test_payoff_multi_bydate(self):
@@ -36,7 +36,7 @@ from lucterios.CORE.parameters import Params
 from lucterios.CORE.views import ParamEdit, ObjectImport
 from lucterios.CORE.models import Parameter
 
-from diacamma.accounting.tools import correct_accounting_code
+from diacamma.accounting.tools import correct_accounting_code, clear_params_snapshot
 from diacamma.invoice.models import Vat, Article, Category, StorageArea,\
     AccountPosting, AutomaticReduce
 from diacamma.accounting.system import accounting_system_ident
@@ -252,6 +252,7 @@ def paramchange_invoice(params):
             Parameter.change_value('invoice-reduce-account', correct_accounting_code('708'))
             Parameter.change_value("invoice-account-third", correct_accounting_code('400'))
     Params.clear()
+    clear_params_snapshot()
 
 
 @signal_and_lock.Signal.decorate('conf_wizard')
@@ -126,6 +126,8 @@ class SupportingThird(XferListEditor):
 
     def get_items_from_filter(self):
         items = self.model.objects.annotate(completename=Concat('contact__individual__lastname', Value(' '), 'contact__individual__firstname')).filter(self.filter)
+        if self.getparam('show_filter', 0) == 2:
+            items = Third.annotate_total(items).exclude(total_amount__range=(-0.0001, 0.0001))
         sort_third = self.getparam('GRID_ORDER%third', '')
         sort_thirdbis = self.getparam('GRID_ORDER%third+', '')
         self.params['GRID_ORDER%third'] = ""
@@ -136,8 +138,6 @@ class SupportingThird(XferListEditor):
                 sort_thirdbis = "-"
             self.params['GRID_ORDER%third+'] = sort_thirdbis
         items = sorted(items, key=lambda t: six.text_type(t).lower(), reverse=sort_thirdbis.startswith('-'))
-        if self.getparam('show_filter', 0) == 2:
-            items = [item for item in items if abs(item.get_total()) > 0.0001]
         res = QuerySet(model=Third)
         res._result_cache = items
         return res
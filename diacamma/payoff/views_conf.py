@@ -16,7 +16,7 @@ from lucterios.CORE.parameters import Params
 from lucterios.CORE.views import ParamEdit
 from lucterios.CORE.models import Parameter
 
-from diacamma.accounting.tools import correct_accounting_code
+from diacamma.accounting.tools import correct_accounting_code, clear_params_snapshot
 from diacamma.payoff.models import BankAccount, PaymentMethod
 from diacamma.accounting.system import accounting_system_ident
 
@@ -148,6 +148,7 @@ def paramchange_payoff(params):
         elif system_ident == "belgium":
             Parameter.change_value('payoff-cash-account', correct_accounting_code('570000'))
     Params.clear()
+    clear_params_snapshot()
 
 
 @signal_and_lock.Signal.decorate('conf_wizard')